@@ -0,0 +1,55 @@
+import sys
+import argparse
+
+from database.backup import BackupError, create_backup, restore_backup, verify_backup, read_manifest
+from database.db import Database
+from utils.logging_config import setup_logging
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="EMAG - kopia zapasowa całej bazy (pełna lub przyrostowa) i jej przywracanie."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    create = commands.add_parser("create", help="utwórz kopię zapasową w katalogu")
+    create.add_argument("dest", help="katalog kopii zapasowych")
+    create.add_argument("--incremental", action="store_true",
+                        help="tylko zmiany od najnowszej kopii w katalogu")
+    create.add_argument("--page-size", type=int, default=1000, help="liczba węzłów pobieranych na zapytanie")
+    verify = commands.add_parser("verify", help="sprawdź sumy kontrolne kopii (z kopiami bazowymi)")
+    verify.add_argument("backup", help="katalog kopii")
+    restore = commands.add_parser("restore", help="przywróć bazę z kopii (z kopiami bazowymi)")
+    restore.add_argument("backup", help="katalog kopii")
+    restore.add_argument("--wipe", action="store_true",
+                         help="usuń najpierw zapisane w kopii drzewa (bez tego nadmiarowe węzły zostają)")
+    restore.add_argument("--workers", type=int, default=8, help="równoległe zapisy")
+    restore.add_argument("--yes", action="store_true", help="nie pytaj o potwierdzenie")
+    args = parser.parse_args(argv)
+    setup_logging(console_level="INFO")
+
+    try:
+        if args.command == "verify":
+            print(f"Kopia poprawna: sprawdzono {verify_backup(args.backup)} plików.")
+            return 0
+        db = Database()
+        if args.command == "create":
+            path = create_backup(db, args.dest, incremental=args.incremental, page_size=args.page_size)
+            manifest = read_manifest(path)
+            print(f"Kopia ({manifest['kind']}): {manifest['records']} węzłów w {len(manifest['chunks'])} plikach "
+                  f"-> '{path}'.")
+            return 0
+        if not args.yes:
+            answer = input(f"Przywrócić bazę z kopii '{args.backup}'? Bieżące dane zostaną nadpisane. [t/N] ")
+            if answer.strip().lower() not in ("t", "tak", "y", "yes"):
+                print("Przerwano.")
+                return 1
+        counts = restore_backup(db, args.backup, wipe=args.wipe, workers=args.workers)
+        print(f"Przywrócono {counts['records']} węzłów ({counts['requests']} zapisów).")
+        return 0
+    except BackupError as e:
+        print(f"Błąd kopii zapasowej: {e}")
+        return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,31 @@
+import sys
+import argparse
+
+from database.db import Database
+from utils.logging_config import setup_logging
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="EMAG - sprawdzenie spójności danych magazynu (i opcjonalna naprawa) bez GUI."
+    )
+    parser.add_argument("--incremental", action="store_true",
+                        help="sprawdź tylko dane zmienione od poprzedniego sprawdzenia")
+    parser.add_argument("--repair", action="store_true", help="zastosuj automatyczne naprawy")
+    args = parser.parse_args(argv)
+    setup_logging(console_level="INFO")
+
+    db = Database()
+    issues = db.check_integrity(incremental=args.incremental)
+    repairable = [issue for issue in issues if issue["repair"]]
+    print(f"Niespójności: {len(issues)} (do automatycznej naprawy: {len(repairable)})")
+    for issue in issues:
+        print(f"  {issue['check']:<26} {issue['path']}  {issue['detail']}")
+    if args.repair and repairable:
+        written = db.repair_integrity(repairable)
+        print(f"Naprawiono: {written} zmian.")
+    return 2 if len(issues) > (len(repairable) if args.repair else 0) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
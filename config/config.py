@@ -1,3 +1,13 @@
 # Konfiguracja aplikacji EMAG
 APP_NAME = "EMAG - Zarządzanie magazynem"
 VERSION = "v1.2.0"
+
+# Próg niskiego stanu magazynowego (sztuk)
+LOW_STOCK_THRESHOLD = 5
+
+# Monitor blokad interfejsu: wywołania Tk dłuższe niż próg (ms) są zapisywane
+STALL_THRESHOLD_MS = 100
+
+# Kategorie części z datą ważności: przy przyjęciu dostawy pytamy o datę,
+# partie są zużywane według najkrótszej ważności (FEFO)
+DATED_CATEGORIES = ("Uszczelki gumowe",)
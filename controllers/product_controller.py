@@ -1,55 +1,107 @@
+import logging
+
 from models.product import Product, Part
 from database.db import Database
+from config.config import LOW_STOCK_THRESHOLD
+from utils.delivery_import import import_delivery, read_count_file
+from controllers.production_planner import ProductionPlanner
+from utils.picking import build_pick_lists
 
+logger = logging.getLogger(__name__)
 
-class ProductController:
-    def __init__(self):
-        self.db = Database()
-        self.available_parts = {
-            "Wybierz": ["Rozmiar"],
-            "Śrubki": ["M4", "M6", "M8"],
-            "Nakrętki": ["M4", "M6", "M8"],
-            "Podkładki": ["M4", "M6", "M8"],
-            "Uszczelki gumowe": ["10mm", "20mm", "30mm"],
-            "Flansze plastikowe": ["50mm", "100mm", "150mm"],
-            "Flansze stalowe": ["50mm", "100mm", "150mm"],
-            "Flansze ocynkowane": ["50mm", "100mm", "150mm"],
-            "Haczyki": ["Małe", "Średnie", "Duże"],
-        }
 
+class ProductController:
+    def __init__(self, db=None):
+        # A Database (or server.client.RemoteDatabase) may be shared with the caller
+        self.db = db or Database()
+        self.planner = ProductionPlanner(self)
         self.available_products = {
         }
     
+    @property
+    def available_parts(self):
+        """Rodziny części i rozmiary z katalogu części (dane w Firebase, nie w kodzie)."""
+        return {"Wybierz": ["Rozmiar"], **self.db.catalogue.families()}
+
     def get_available_parts(self):
         """Zwraca listę dostępnych części."""
         return self.available_parts
 
+    def add_part_family(self, category, sizes, unit="szt."):
+        """Dodaje nową rodzinę części (np. nowe flansze) do katalogu. Zwraca ID części."""
+        return [self.db.catalogue.register(category, size, unit) for size in sizes]
+
     def get_available_products(self):
         """Zwraca listę dostępnych produktów."""
         return self.available_products
 
     def add_part_to_inventory(self, part_name, size, quantity):
         """Dodaje część do magazynu."""
-        if part_name not in self.available_parts:
-            print(f"Część '{part_name}' nie jest dostępna na liście.")
+        available_parts = self.available_parts
+        if part_name not in available_parts:
+            logger.warning("Część '%s' nie jest dostępna na liście.", part_name)
             return
-        if size not in self.available_parts[part_name]:
-            print(f"Rozmiar '{size}' nie jest dostępny dla części '{part_name}'.")
+        if size not in available_parts[part_name]:
+            logger.warning("Rozmiar '%s' nie jest dostępny dla części '%s'.", size, part_name)
             return
         if quantity <= 0:
-            print("Ilość musi być większa niż 0.")
+            logger.warning("Ilość musi być większa niż 0.")
             return
 
         part_key = f"{part_name} ({size})"
         self.db.add_part(part_key, quantity)
-        print(f"Część '{part_key}' dodana do magazynu. Ilość: {quantity}.")
+        logger.info("Część '%s' dodana do magazynu. Ilość: %d.", part_key, quantity)
+
+    def import_delivery_file(self, path, reject_path=None, chunk_size=5000):
+        """
+        Przyjmuje dostawę z pliku dostawcy (CSV/JSON/JSONL) bez GUI.
+        Zwraca podsumowanie: liczba wierszy, przyjęte, odrzucone, sztuki, części.
+        """
+        summary = import_delivery(self.db, path, reject_path=reject_path, chunk_size=chunk_size)
+        logger.info(
+            "Dostawa '%s': %d/%d wierszy przyjęto, %d szt. dla %d części.",
+            path, summary["accepted"], summary["rows"], summary["units"], summary["parts"]
+        )
+        if summary["reject_path"]:
+            logger.warning("Odrzucone wiersze (%d) zapisano w '%s'.", summary["rejected"], summary["reject_path"])
+        return summary
+
+    def import_stocktake_file(self, stocktake_id, path):
+        """
+        Wczytuje wyniki liczenia z pliku (CSV/JSON/JSONL: EAN + ilość) do
+        otwartej inwentaryzacji; ilości z pliku zastępują wcześniejsze liczenia
+        tych części. Zwraca podsumowanie.
+        """
+        counts, summary = read_count_file(self.db, path)
+        self.db.record_stocktake_counts(stocktake_id, counts, replace=True)
+        logger.info(
+            "Inwentaryzacja '%s': wczytano %d/%d wierszy dla %d części z '%s'.",
+            stocktake_id, summary["accepted"], summary["rows"], summary["parts"], path
+        )
+        return summary
+
+    def plan_production(self, demand, start=None):
+        """
+        Plan produkcji dla zamówień [{"product", "quantity", "due"}]: harmonogram
+        budowy po okresach, braki części i lista zakupów (zob. ProductionPlanner).
+        """
+        return self.planner.plan_rows(self.planner.plan(demand, start=start))
+
+    def pick_lists(self, lines, batch_size=20):
+        """
+        Listy kompletacji dla fali zamówień [{"order", "item", "quantity"}]
+        (item: produkt lub część): partie zamówień z trasą po lokalizacjach.
+        """
+        bins = self.db.load_bins()
+        # Products are picked from their own bins; parts (e.g. spare-part orders) from theirs
+        return build_pick_lists(lines, {**bins["parts"], **bins["products"]}, batch_size=batch_size)
 
     def add_product(self, product_name, product_quantity, selected_parts):
         """Adds a product to the database with its associated parts."""
         # Check if product already exists
         for product in self.db.products:
             if product["name"] == product_name:
-                print(f"Produkt '{product_name}' już istnieje.")
+                logger.warning("Produkt '%s' już istnieje.", product_name)
                 return False
 
         # Deduct parts from inventory
@@ -73,7 +125,7 @@ class ProductController:
             "quantity": product_quantity,
             "parts": selected_parts,
         })
-        print(f"Produkt '{product_name}' dodany pomyślnie.")
+        logger.info("Produkt '%s' dodany pomyślnie.", product_name)
         return True
 
 
@@ -86,7 +138,7 @@ class ProductController:
 
         low_stock_parts = []
         for part, quantity in self.db.inventory.items():
-            if quantity < 5:  # Przykład niskiego stanu
+            if quantity < LOW_STOCK_THRESHOLD:
                 low_stock_parts.append(part)
             print(f"{part}: {quantity}")
 
@@ -101,12 +153,12 @@ class ProductController:
         if part_key in self.db.inventory:
             new_quantity = self.db.inventory[part_key] + delta
             if new_quantity < 0:
-                print("Nie można zmniejszyć ilości poniżej zera.")
+                logger.warning("Nie można zmniejszyć ilości poniżej zera.")
                 return
             self.db.inventory[part_key] = new_quantity
-            print(f"Ilość części '{part_key}' została zaktualizowana do {new_quantity}.")
+            logger.info("Ilość części '%s' została zaktualizowana do %d.", part_key, new_quantity)
         else:
-            print(f"Część '{part_key}' nie istnieje w magazynie.")
+            logger.warning("Część '%s' nie istnieje w magazynie.", part_key)
 
     def remove_product(self, product_name, size):
         """Usuwa produkt z listy produktów."""
@@ -114,6 +166,6 @@ class ProductController:
         for product in self.db.products:
             if product.name == product_key:
                 self.db.products.remove(product)
-                print(f"Produkt '{product_key}' został usunięty.")
+                logger.info("Produkt '%s' został usunięty.", product_key)
                 return
-        print(f"Produkt '{product_key}' nie istnieje.")
+        logger.warning("Produkt '%s' nie istnieje.", product_key)
@@ -0,0 +1,187 @@
+import time
+import logging
+from datetime import date, datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+# -------------------------------------------------------------------------
+#                   PRODUCTION PLANNING (MRP OVER PRODUCT BOMs)
+# -------------------------------------------------------------------------
+# Demand (orders with due dates) is bucketed by period and netted against
+# the finished-goods stock; what is left has to be built, `lead_buckets`
+# periods before it is due. Builds are exploded through the BOMs into part
+# requirements, which are netted against the part stock the same way;
+# what is left is the shortage / purchase list.
+#
+# Everything is arrays: demand is a (periods x products) matrix, the BOMs
+# are kept as sparse triplets (product index, part index, units per
+# product), and netting is a cumulative sum per column:
+#
+#   net_cum[t]  = max(cum_demand[t] - stock, 0)
+#   need[t]     = net_cum[t] - net_cum[t - 1]
+#
+# so a full replan is a handful of numpy operations, whatever the number
+# of products and parts. Compiling the BOM triplets is the only per-entry
+# Python loop and is skipped while the products do not change.
+DEFAULT_BUCKET_DAYS = 7
+DEFAULT_HORIZON_BUCKETS = 12
+
+
+def _require_numpy():
+    try:
+        import numpy  # installed with matplotlib
+        return numpy
+    except ImportError:
+        raise RuntimeError("Planowanie produkcji wymaga pakietu 'numpy' (pip install numpy).")
+
+
+def _as_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value).strip()[:10])
+
+
+class ProductionPlanner:
+    """MRP engine over the products and stock of a ProductController's Database."""
+
+    def __init__(self, controller, bucket_days=DEFAULT_BUCKET_DAYS, horizon_buckets=DEFAULT_HORIZON_BUCKETS,
+                 lead_buckets=0):
+        self.controller = controller
+        self.bucket_days = bucket_days
+        self.horizon_buckets = horizon_buckets
+        self.lead_buckets = lead_buckets
+        self._signature = None
+        self.products = []         # product names, matrix column order
+        self.parts = []            # part labels, matrix column order
+        self.product_index = {}
+        self.part_index = {}
+        self.bom_rows = self.bom_cols = self.bom_units = None
+
+    # ---- BOM compilation -------------------------------------------------
+    def _compile(self, products):
+        np = _require_numpy()
+        signature = tuple(
+            (product["name"], tuple(sorted((product.get("parts") or {}).items())))
+            for product in products
+        )
+        if signature == self._signature:
+            return
+        self.products = [product["name"] for product in products]
+        self.product_index = {name: i for i, name in enumerate(self.products)}
+        parts, rows, cols, units = {}, [], [], []
+        for i, product in enumerate(products):
+            for part, per_unit in (product.get("parts") or {}).items():
+                if isinstance(per_unit, int) and per_unit > 0:
+                    rows.append(i)
+                    cols.append(parts.setdefault(part, len(parts)))
+                    units.append(per_unit)
+        self.parts = list(parts)
+        self.part_index = parts
+        self.bom_rows = np.array(rows, dtype=np.int64)
+        self.bom_cols = np.array(cols, dtype=np.int64)
+        self.bom_units = np.array(units, dtype=np.int64)
+        self._signature = signature
+        logger.debug("BOMs compiled: %d products, %d parts, %d entries.", len(self.products), len(parts), len(units))
+
+    # ---- netting ---------------------------------------------------------
+    @staticmethod
+    def _net(np, requirements, stock):
+        """Per-period quantities not covered by `stock` (cumulative netting, column-wise)."""
+        net_cum = np.maximum(np.cumsum(requirements, axis=0) - stock, 0)
+        return np.diff(net_cum, axis=0, prepend=0)
+
+    def plan(self, demand, start=None, inventory=None, products=None):
+        """
+        `demand` is a list of {"product", "quantity", "due"} (due: date or
+        ISO string). Returns the period start dates and the (periods x products)
+        build and (periods x parts) requirement / shortage arrays, plus the
+        orders that could not be planned; plan_rows() turns it into lists.
+        """
+        np = _require_numpy()
+        started = time.perf_counter()
+        db = self.controller.db
+        products = db.load_products() if products is None else products
+        inventory = db.load_inventory() if inventory is None else inventory
+        self._compile(products)
+        start = _as_date(start or date.today())
+        periods = self.horizon_buckets
+
+        # Demand matrix (periods x products); overdue orders fall into the first period
+        demand_matrix = np.zeros((periods, len(self.products)), dtype=np.int64)
+        unknown, beyond = [], []
+        rows, cols, quantities = [], [], []
+        for order in demand:
+            column = self.product_index.get(order["product"])
+            if column is None:
+                unknown.append(order)
+                continue
+            bucket = max(0, (_as_date(order["due"]) - start).days // self.bucket_days)
+            if bucket >= periods:
+                beyond.append(order)
+                continue
+            rows.append(bucket)
+            cols.append(column)
+            quantities.append(int(order["quantity"]))
+        np.add.at(demand_matrix, (np.array(rows, dtype=np.int64), np.array(cols, dtype=np.int64)), quantities)
+
+        # Finished goods first, then build what is left lead_buckets periods earlier
+        finished = np.array([product.get("quantity", 0) for product in products], dtype=np.int64)
+        builds = self._net(np, demand_matrix, np.maximum(finished, 0))
+        if self.lead_buckets:
+            shifted = np.zeros_like(builds)
+            shifted[0] = builds[:self.lead_buckets + 1].sum(axis=0)
+            shifted[1:periods - self.lead_buckets] = builds[self.lead_buckets + 1:]
+            builds = shifted
+
+        # Explode builds through the BOM triplets into part requirements (periods x parts)
+        requirements = np.zeros((periods, len(self.parts)), dtype=np.int64)
+        if len(self.bom_units):
+            np.add.at(
+                requirements.T, self.bom_cols, (builds[:, self.bom_rows] * self.bom_units).T
+            )
+        stock = np.array([max(inventory.get(part, 0), 0) for part in self.parts], dtype=np.int64)
+        shortages = self._net(np, requirements, stock)
+
+        result = {
+            "buckets": [start + timedelta(days=self.bucket_days * t) for t in range(periods)],
+            "builds": builds,
+            "requirements": requirements,
+            "shortages": shortages,
+            "unknown_products": unknown,
+            "beyond_horizon": beyond,
+            "elapsed_ms": (time.perf_counter() - started) * 1000,
+        }
+        logger.info(
+            "Production plan: %d orders, %d units to build, %d parts short (%.1f ms).",
+            len(demand), int(builds.sum()), int((shortages.sum(axis=0) > 0).sum()), result["elapsed_ms"],
+        )
+        return result
+
+    # ---- reporting -------------------------------------------------------
+    def plan_rows(self, result):
+        """The array plan as lists: build schedule, shortages per period, purchase list, unplanned orders."""
+        np = _require_numpy()
+        buckets = result["buckets"]
+        schedule = [
+            {"period": buckets[t].isoformat(), "product": self.products[p], "quantity": int(result["builds"][t, p])}
+            for t, p in zip(*np.nonzero(result["builds"]))
+        ]
+        shortages = [
+            {"period": buckets[t].isoformat(), "part": self.parts[k], "quantity": int(result["shortages"][t, k])}
+            for t, k in zip(*np.nonzero(result["shortages"]))
+        ]
+        totals = result["shortages"].sum(axis=0)
+        first_needed = (result["shortages"] > 0).argmax(axis=0)   # first period each part is short in
+        purchases = sorted(
+            (
+                {"part": self.parts[k], "quantity": int(totals[k]), "needed_by": buckets[first_needed[k]].isoformat()}
+                for k in np.nonzero(totals)[0]
+            ),
+            key=lambda row: (row["needed_by"], row["part"]),
+        )
+        return {
+            "schedule": schedule, "shortages": shortages, "purchases": purchases,
+            "unknown_products": result["unknown_products"], "beyond_horizon": result["beyond_horizon"],
+        }
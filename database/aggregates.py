@@ -0,0 +1,131 @@
+import threading
+
+from config.config import LOW_STOCK_THRESHOLD
+
+
+def part_category(part_name):
+    """'Śrubki (M4)' -> 'Śrubki'; names without a size are their own category."""
+    if part_name.endswith(")") and " (" in part_name:
+        return part_name.rsplit(" (", 1)[0]
+    return part_name
+
+
+class WarehouseAggregates:
+    """
+    Materialized warehouse KPIs, kept current by O(1) deltas from every
+    Database mutation. A full recompute is only done from trees that were
+    downloaded anyway (load_inventory / load_products) or by an explicit
+    consistency check.
+    """
+
+    def __init__(self, low_stock_threshold=LOW_STOCK_THRESHOLD):
+        self.low_stock_threshold = low_stock_threshold
+        self.lock = threading.Lock()
+        self.part_quantities = {}     # part -> quantity (last known)
+        self.product_quantities = {}  # product -> quantity (last known)
+        self.reset()
+
+    def reset(self):
+        self.total_units = 0
+        self.units_by_category = {}
+        self.low_stock_count = 0
+        self.product_count = 0
+        self.product_units = 0
+        self.part_quantities.clear()
+        self.product_quantities.clear()
+        self.inventory_loaded = False
+        self.products_loaded = False
+
+    # ---- parts ----------------------------------------------------------
+    def _is_low(self, quantity):
+        return quantity < self.low_stock_threshold
+
+    def _set_part_locked(self, name, quantity):
+        old = self.part_quantities.get(name)
+        if old is None:
+            old_units, was_low = 0, False
+        else:
+            old_units, was_low = old, self._is_low(old)
+
+        self.part_quantities[name] = quantity
+        delta = quantity - old_units
+        self.total_units += delta
+        category = part_category(name)
+        self.units_by_category[category] = self.units_by_category.get(category, 0) + delta
+        self.low_stock_count += int(self._is_low(quantity)) - int(was_low)
+
+    def set_part(self, name, quantity):
+        """Records the new absolute quantity of a part."""
+        with self.lock:
+            self._set_part_locked(name, quantity)
+
+    def apply_part_delta(self, name, delta):
+        """Records a relative change of a part's quantity."""
+        with self.lock:
+            self._set_part_locked(name, self.part_quantities.get(name, 0) + delta)
+
+    # ---- products -------------------------------------------------------
+    def set_product(self, name, quantity):
+        with self.lock:
+            old = self.product_quantities.get(name)
+            if old is None:
+                self.product_count += 1
+                old = 0
+            self.product_quantities[name] = quantity
+            self.product_units += quantity - old
+
+    def remove_product(self, name):
+        with self.lock:
+            old = self.product_quantities.pop(name, None)
+            if old is not None:
+                self.product_count -= 1
+                self.product_units -= old
+
+    # ---- full recompute -------------------------------------------------
+    def load_inventory(self, inventory):
+        """Rebuilds the part KPIs from a full /inventory snapshot."""
+        with self.lock:
+            self.total_units = 0
+            self.units_by_category = {}
+            self.low_stock_count = 0
+            self.part_quantities.clear()
+            for name, quantity in inventory.items():
+                if isinstance(quantity, int):
+                    self._set_part_locked(name, quantity)
+            self.inventory_loaded = True
+
+    def load_products(self, products):
+        """Rebuilds the product KPIs from a full list of product dicts."""
+        with self.lock:
+            self.product_quantities = {p["name"]: p.get("quantity", 0) for p in products}
+            self.product_count = len(self.product_quantities)
+            self.product_units = sum(self.product_quantities.values())
+            self.products_loaded = True
+
+    def snapshot(self):
+        """Returns the current KPIs as a plain dict."""
+        with self.lock:
+            return {
+                "total_units": self.total_units,
+                "units_by_category": dict(self.units_by_category),
+                "low_stock_count": self.low_stock_count,
+                "product_count": self.product_count,
+                "product_units": self.product_units,
+                "loaded": self.inventory_loaded and self.products_loaded,
+            }
+
+    def verify(self, inventory, products):
+        """
+        Recomputes everything from full trees and compares with the
+        maintained values. Returns {kpi: (maintained, recomputed)} for every
+        mismatch and adopts the recomputed values.
+        """
+        maintained = self.snapshot()
+        self.load_inventory(inventory)
+        self.load_products(products)
+        recomputed = self.snapshot()
+        return {
+            key: (maintained[key], recomputed[key])
+            for key in recomputed
+            if key != "loaded" and maintained[key] != recomputed[key]
+        }
@@ -0,0 +1,38 @@
+from firebase_admin import db as firebase_db
+
+from database.memory_backend import MemoryBackend
+
+# -------------------------------------------------------------------------
+#                          STORAGE BACKEND SEAM
+# -------------------------------------------------------------------------
+# Everything that talks to the Realtime Database goes through reference(),
+# so the storage can be switched from Firebase to a local in-memory tree
+# (load tests, offline experiments) without touching the data layer.
+_memory = None
+
+# Server-side write time (resolved by the database, not the station's clock)
+SERVER_TIMESTAMP = {".sv": "timestamp"}
+
+
+def reference(path="/"):
+    """Like firebase_admin.db.reference, against the active backend."""
+    if _memory is not None:
+        return _memory.reference(path)
+    return firebase_db.reference(path)
+
+
+def use_memory_backend(backend=None):
+    """Routes all references to an in-memory tree (a new empty one by default)."""
+    global _memory
+    _memory = backend or MemoryBackend()
+    return _memory
+
+
+def use_firebase():
+    global _memory
+    _memory = None
+
+
+def memory_backend():
+    """The active MemoryBackend, or None when Firebase is used."""
+    return _memory
@@ -0,0 +1,373 @@
+import os
+import gzip
+import json
+import time
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from database import backend
+from database.backend import SERVER_TIMESTAMP
+from database.schema import PRODUCTS_PATH
+from database.db import SYNC_OVERLAP_MS, DELTA_READ_WORKERS
+
+logger = logging.getLogger(__name__)
+
+# -------------------------------------------------------------------------
+#                 STREAMING BACKUP AND RESTORE OF THE DATABASE
+# -------------------------------------------------------------------------
+# A backup is a directory of gzip-compressed JSON Lines chunks plus a
+# manifest written last (a backup without one is incomplete):
+#
+#   <dest>/<id>/manifest.json         format, kind, base, high_water, trees,
+#                                     chunks [{file, tree, records, bytes, sha256}]
+#   <dest>/<id>/<tree>-00001.jsonl.gz one ["path", value] per line
+#
+# Trees are streamed page by page (Database.iter_children; nested trees
+# such as /changes one level deeper), several trees at a time, and every
+# chunk is hashed while it is written, so memory stays at one page plus one
+# compression buffer per tree whatever the size of the database.
+#
+# Incremental backups keep only what changed since their base, found with
+# the delta-sync stamps: /changes/inventory, products' "updated_at", the
+# /changes/products tombstones (a null value records a deletion) and the
+# "u" stamps of /products_v2 (whose deletions are tombstone nodes). Trees
+# without stamps (EAN maps, catalogue, locations, ...) are small; they are
+# copied whole every time and replace the base's copy on restore. A restore
+# verifies every checksum of the chain first, then replays full ->
+# incrementals as parallel multi-path updates. Restored parts and products
+# are stamped with the restore time, so stations pick them up with their
+# next delta sync; the old /changes stamps are not written back.
+BACKUP_FORMAT = 1
+MANIFEST_FILE = "manifest.json"
+CHUNK_RECORDS = 50000
+RESTORE_BATCH_SIZE = 500
+RESTORE_WORKERS = 8
+BACKUP_WORKERS = 4
+# Trees whose children are large maps themselves are streamed one level deeper
+NESTED_TREES = {"changes": 2, "inventory_locations": 2, "bins": 2, "adjustments": 2, "part_catalogue": 2}
+# Trees read from the delta-sync stamps in incremental backups (the rest is copied whole)
+STAMPED_TREES = ("inventory", "products", "changes", PRODUCTS_PATH)
+
+
+class BackupError(Exception):
+    """A backup is incomplete, corrupted or does not fit the requested chain."""
+
+
+def new_backup_id(kind):
+    return time.strftime("%Y%m%d-%H%M%S") + "-" + kind
+
+
+class _HashingWriter:
+    """File wrapper hashing the (compressed) bytes as they are written."""
+
+    def __init__(self, f):
+        self.f = f
+        self.sha256 = hashlib.sha256()
+        self.bytes = 0
+
+    def write(self, data):
+        self.sha256.update(data)
+        self.bytes += len(data)
+        return self.f.write(data)
+
+    def flush(self):
+        self.f.flush()
+
+
+class _ChunkWriter:
+    """Writes ["path", value] records of one tree into numbered, checksummed chunks."""
+
+    def __init__(self, directory, tree, chunk_records=CHUNK_RECORDS):
+        self.directory = directory
+        self.tree = tree
+        self.chunk_records = chunk_records
+        self.chunks = []
+        self.records = 0
+        self._file = self._hashing = self._gzip = None
+        self._in_chunk = 0
+
+    def _open(self):
+        name = f"{self.tree}-{len(self.chunks) + 1:05d}.jsonl.gz"
+        self._file = open(os.path.join(self.directory, name), "wb")
+        self._hashing = _HashingWriter(self._file)
+        self._gzip = gzip.GzipFile(filename="", mode="wb", fileobj=self._hashing, mtime=0)
+        self.chunks.append({"file": name, "tree": self.tree, "records": 0})
+        self._in_chunk = 0
+
+    def _close_chunk(self):
+        self._gzip.close()
+        self._file.close()
+        self.chunks[-1].update({"records": self._in_chunk, "bytes": self._hashing.bytes,
+                                "sha256": self._hashing.sha256.hexdigest()})
+        self._gzip = None
+
+    def write(self, path, value):
+        if self._gzip is None:
+            self._open()
+        line = json.dumps([path, value], ensure_ascii=False, separators=(",", ":")) + "\n"
+        self._gzip.write(line.encode("utf-8"))
+        self._in_chunk += 1
+        self.records += 1
+        if self._in_chunk >= self.chunk_records:
+            self._close_chunk()
+
+    def close(self):
+        if self._gzip is not None:
+            self._close_chunk()
+        return self.chunks
+
+
+# ---- reading the database ----------------------------------------------
+def _iter_tree(db, path, depth, page_size):
+    """(path, value) of the nodes `depth` levels below `path`, streamed page by page."""
+    if depth <= 1:
+        for key, value in db.iter_children(path, page_size):
+            yield f"{path}/{key}", value
+        return
+    keys = backend.reference(path).get(shallow=True) or {}
+    for key, value in sorted(keys.items()) if isinstance(keys, dict) else ():
+        if value is True:   # a map: one level further down
+            yield from _iter_tree(db, f"{path}/{key}", depth - 1, page_size)
+        else:
+            yield f"{path}/{key}", value
+
+
+def _iter_changed(since):
+    """(path, value or None) of the parts and products changed since `since` ({"inventory", "products", ...})."""
+    stamped = backend.reference("changes/inventory").order_by_value().start_at(since["inventory"]).get() or {}
+    keys = sorted(stamped)
+    with ThreadPoolExecutor(max_workers=DELTA_READ_WORKERS) as pool:
+        for start in range(0, len(keys), RESTORE_BATCH_SIZE):
+            batch = keys[start:start + RESTORE_BATCH_SIZE]
+            for key, value in zip(batch, pool.map(lambda k: backend.reference(f"inventory/{k}").get(), batch)):
+                yield f"inventory/{key}", value
+    changed = backend.reference("products").order_by_child("updated_at").start_at(since["products"]).get() or {}
+    for name in sorted(changed):
+        yield f"products/{name}", changed[name]
+    deleted = backend.reference("changes/products").order_by_value().start_at(since["products"]).get() or {}
+    for name in sorted(deleted):
+        if name not in changed:
+            yield f"products/{name}", None
+    # A base made before schema 2 existed has no stamp for it: everything is new
+    compact = backend.reference(PRODUCTS_PATH).order_by_child("u").start_at(since.get(PRODUCTS_PATH, 0)).get() or {}
+    for pid in sorted(compact):
+        yield f"{PRODUCTS_PATH}/{pid}", compact[pid]
+
+
+def _high_water(db):
+    return {
+        "inventory": db.newest_stamp("changes/inventory"),
+        "products": max(db.newest_stamp("products", "updated_at"), db.newest_stamp("changes/products")),
+        PRODUCTS_PATH: db.newest_stamp(PRODUCTS_PATH, "u"),
+    }
+
+
+# ---- backup ------------------------------------------------------------
+def latest_backup(dest):
+    """The newest complete backup (directory with a manifest) under `dest`, or None."""
+    if not os.path.isdir(dest):
+        return None
+    complete = [
+        name for name in os.listdir(dest)
+        if os.path.isfile(os.path.join(dest, name, MANIFEST_FILE))
+    ]
+    return os.path.join(dest, max(complete)) if complete else None
+
+
+def read_manifest(path):
+    try:
+        with open(os.path.join(path, MANIFEST_FILE), encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        raise BackupError(f"Backup '{path}' has no readable manifest: {e}")
+    if manifest.get("format") != BACKUP_FORMAT:
+        raise BackupError(f"Backup '{path}' has an unsupported format {manifest.get('format')}.")
+    return manifest
+
+
+def create_backup(db, dest, incremental=False, page_size=1000, chunk_records=CHUNK_RECORDS,
+                  workers=BACKUP_WORKERS):
+    """
+    Writes a full backup (or an incremental one on top of the newest backup
+    in `dest`) and returns its directory. Trees are discovered with a
+    shallow read of the root and streamed `workers` at a time.
+    """
+    started = time.perf_counter()
+    base = latest_backup(dest) if incremental else None
+    if incremental and base is None:
+        raise BackupError(f"No complete backup in '{dest}' to base an incremental backup on.")
+    base_manifest = read_manifest(base) if base else None
+    kind = "incremental" if base else "full"
+    backup_id = new_backup_id(kind)
+    directory = os.path.join(dest, backup_id)
+    os.makedirs(directory)
+
+    # Stamps first: anything written while streaming is newer and lands in the next incremental
+    high_water = _high_water(db)
+    trees = sorted(backend.reference().get(shallow=True) or {})
+    since = None
+    if base_manifest:
+        since = {tree: stamp - SYNC_OVERLAP_MS for tree, stamp in base_manifest["high_water"].items()}
+
+    def stream(tree):
+        writer = _ChunkWriter(directory, tree.replace("/", "_"), chunk_records)
+        try:
+            if tree == "stamped":
+                records = _iter_changed(since)
+            else:
+                records = _iter_tree(db, tree, NESTED_TREES.get(tree, 1), page_size)
+            for path, value in records:
+                writer.write(path, value)
+        finally:
+            chunks = writer.close()
+        return chunks
+
+    jobs = [tree for tree in trees if not (base_manifest and tree in STAMPED_TREES)]
+    if base_manifest:
+        jobs.append("stamped")
+    chunks = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for tree_chunks in pool.map(stream, jobs):
+            chunks.extend(tree_chunks)
+
+    manifest = {
+        "format": BACKUP_FORMAT,
+        "id": backup_id,
+        "kind": kind,
+        "base": base_manifest["id"] if base_manifest else None,
+        "database_url": os.getenv("FIREBASE_DATABASE_URL"),
+        "created_at": time.time(),
+        "since": since,
+        "high_water": high_water,
+        "trees": trees,
+        "copied": [tree for tree in jobs if tree != "stamped"],
+        "records": sum(chunk["records"] for chunk in chunks),
+        "chunks": chunks,
+    }
+    tmp_path = os.path.join(directory, MANIFEST_FILE + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, os.path.join(directory, MANIFEST_FILE))
+    logger.info(
+        "%s backup '%s': %d records in %d chunks (%.1f MB) in %.1f s.",
+        kind.capitalize(), backup_id, manifest["records"], len(chunks),
+        sum(chunk["bytes"] for chunk in chunks) / 1e6, time.perf_counter() - started,
+    )
+    return directory
+
+
+# ---- verification --------------------------------------------------------
+def backup_chain(path):
+    """[full, incremental, ...] directories leading up to (and including) the backup at `path`."""
+    chain = [path]
+    manifest = read_manifest(path)
+    while manifest["base"]:
+        base = os.path.join(os.path.dirname(os.path.abspath(path)), manifest["base"])
+        if not os.path.isdir(base):
+            raise BackupError(f"Base backup '{manifest['base']}' of '{manifest['id']}' is missing.")
+        chain.insert(0, base)
+        manifest = read_manifest(base)
+    return chain
+
+
+def verify_backup(path):
+    """Checks the checksums of every chunk in the chain of `path`; returns the number of chunks verified."""
+    verified = 0
+    for directory in backup_chain(path):
+        for chunk in read_manifest(directory)["chunks"]:
+            sha256 = hashlib.sha256()
+            try:
+                with open(os.path.join(directory, chunk["file"]), "rb") as f:
+                    for block in iter(lambda: f.read(1 << 20), b""):
+                        sha256.update(block)
+            except OSError as e:
+                raise BackupError(f"Chunk '{chunk['file']}' cannot be read: {e}")
+            if sha256.hexdigest() != chunk["sha256"]:
+                raise BackupError(f"Chunk '{chunk['file']}' of '{directory}' is corrupted (checksum mismatch).")
+            verified += 1
+    return verified
+
+
+# ---- restore -------------------------------------------------------------
+def _iter_records(directory, manifest):
+    for chunk in manifest["chunks"]:
+        with gzip.open(os.path.join(directory, chunk["file"]), "rt", encoding="utf-8") as f:
+            for line in f:
+                yield json.loads(line)
+
+
+def _restore_updates(path, value):
+    """Multi-path update entries for one record, re-stamped for delta sync."""
+    tree, _, rest = path.partition("/")
+    if tree == "changes" and rest.split("/", 1)[0] in ("inventory", "products"):
+        return {}   # regenerated below with the restore time
+    updates = {path: value}
+    if tree == "inventory" and rest:
+        updates[f"changes/inventory/{rest}"] = SERVER_TIMESTAMP
+    elif tree == "products" and rest and "/" not in rest:
+        if isinstance(value, dict):
+            updates[path] = {**value, "updated_at": SERVER_TIMESTAMP}
+        else:
+            updates[f"changes/products/{rest}"] = SERVER_TIMESTAMP
+    elif tree == PRODUCTS_PATH and rest and "/" not in rest and isinstance(value, dict):
+        updates[path] = {**value, "u": SERVER_TIMESTAMP}
+    return updates
+
+
+def restore_backup(db, path, wipe=False, batch_size=RESTORE_BATCH_SIZE, workers=RESTORE_WORKERS):
+    """
+    Verifies and replays the chain of the backup at `path` into the database.
+    `wipe` deletes the backed-up trees first (otherwise nodes missing from
+    the backup are left alone). Returns {"records", "requests"}.
+    """
+    started = time.perf_counter()
+    chain = backup_chain(path)
+    verify_backup(path)
+    counts = {"records": 0, "requests": 0}
+    counts_lock = threading.Lock()
+
+    def write(updates):
+        backend.reference().update(updates)
+        with counts_lock:
+            counts["requests"] += 1
+
+    previous_trees = []
+    for index, directory in enumerate(chain):
+        manifest = read_manifest(directory)
+        if index == 0:
+            cleared = manifest["trees"] if wipe else []
+        else:
+            # Trees copied whole replace what the base had; trees gone since the base are removed
+            cleared = manifest["copied"] + [tree for tree in previous_trees if tree not in manifest["trees"]]
+        if cleared:
+            backend.reference().update({tree: None for tree in cleared})
+        previous_trees = manifest["trees"]
+        # Paths within one backup are disjoint, so its batches can be written in any order;
+        # at most 2 * workers batches are in flight, which keeps memory flat
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            pending, batch = set(), {}
+            for record_path, value in _iter_records(directory, manifest):
+                batch.update(_restore_updates(record_path, value))
+                counts["records"] += 1
+                if len(batch) >= batch_size:
+                    pending.add(pool.submit(write, batch))
+                    batch = {}
+                    if len(pending) >= 2 * workers:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            future.result()
+            if batch:
+                pending.add(pool.submit(write, batch))
+            for future in pending:
+                future.result()
+        logger.info("Restored backup '%s' (%s).", manifest["id"], manifest["kind"])
+
+    # The station's KPIs still describe the data before the restore
+    db.check_aggregates()
+    logger.info(
+        "Restore of '%s' done: %d records in %d writes, %.1f s.",
+        os.path.basename(path), counts["records"], counts["requests"], time.perf_counter() - started,
+    )
+    return counts
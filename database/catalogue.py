@@ -0,0 +1,199 @@
+import logging
+import threading
+
+from database import backend
+
+logger = logging.getLogger(__name__)
+
+# Part families the catalogue is seeded with when it is empty. After that
+# the catalogue lives in Firebase and new families are plain data.
+SEED_PART_FAMILIES = {
+    "Śrubki": ["M4", "M6", "M8"],
+    "Nakrętki": ["M4", "M6", "M8"],
+    "Podkładki": ["M4", "M6", "M8"],
+    "Uszczelki gumowe": ["10mm", "20mm", "30mm"],
+    "Flansze plastikowe": ["50mm", "100mm", "150mm"],
+    "Flansze stalowe": ["50mm", "100mm", "150mm"],
+    "Flansze ocynkowane": ["50mm", "100mm", "150mm"],
+    "Haczyki": ["Małe", "Średnie", "Duże"],
+}
+DEFAULT_UNIT = "szt."
+KEY_PREFIX = "p"   # Firebase turns objects with small integer keys into arrays, so IDs are stored as "p<id>"
+# Label -> ID, claimed in a transaction, so two stations registering one label get one ID
+LABELS_PATH = "part_catalogue/labels"
+
+
+def format_label(category, size):
+    """Display label used throughout the GUI, e.g. 'Śrubki (M4)'."""
+    return f"{category} ({size})" if size else category
+
+
+def label_key(label):
+    """Firebase key of a label: characters not allowed in keys are %-escaped."""
+    return "".join(f"%{ord(c):02X}" if c in ".$#[]/%" else c for c in label)
+
+
+def parse_label(label):
+    """'Śrubki (M4)' -> ('Śrubki', 'M4'); a label without a size -> (label, '')."""
+    if label.endswith(")") and " (" in label:
+        category, size = label[:-1].rsplit(" (", 1)
+        return category, size
+    return label, ""
+
+
+class PartCatalogue:
+    """
+    Persisted part catalogue under /part_catalogue:
+        parts/p<id>     = {"category": ..., "size": ..., "unit": ..., "eans": {<ean>: true}}
+        labels/<label>  = <id>
+        next_id         = <int>
+    Every part has a stable integer ID. Inventory and BOMs are stored under
+    "p<id>" keys; labels like 'Śrubki (M4)' exist only for display.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.parts = {}         # id -> {"category", "size", "unit", "eans"}
+        self.by_category = {}   # category -> set(ids)
+        self.by_size = {}       # size -> set(ids)
+        self.by_label = {}      # label -> id
+        self.by_ean = {}        # ean -> id
+
+    # ---- keys -----------------------------------------------------------
+    @staticmethod
+    def key(part_id):
+        return f"{KEY_PREFIX}{part_id}"
+
+    @staticmethod
+    def id_from_key(key):
+        if isinstance(key, str) and key.startswith(KEY_PREFIX) and key[len(KEY_PREFIX):].isdigit():
+            return int(key[len(KEY_PREFIX):])
+        return None
+
+    # ---- loading / indexing --------------------------------------------
+    def load(self):
+        """Loads the catalogue from Firebase, seeding it on first use."""
+        data = backend.reference("part_catalogue/parts").get()
+        if not data:
+            self.seed()
+            return
+        with self.lock:
+            self.parts.clear()
+            self.by_category.clear()
+            self.by_size.clear()
+            self.by_label.clear()
+            self.by_ean.clear()
+            for key, value in data.items():
+                part_id = self.id_from_key(key)
+                if part_id is not None and isinstance(value, dict):
+                    self._index(part_id, value)
+        logger.debug("Loaded %d parts from the catalogue.", len(self.parts))
+
+    def _index(self, part_id, value):
+        part = {
+            "category": value.get("category", ""),
+            "size": value.get("size", ""),
+            "unit": value.get("unit", DEFAULT_UNIT),
+            "eans": sorted((value.get("eans") or {}).keys()),
+        }
+        self.parts[part_id] = part
+        self.by_category.setdefault(part["category"], set()).add(part_id)
+        self.by_size.setdefault(part["size"], set()).add(part_id)
+        self.by_label[format_label(part["category"], part["size"])] = part_id
+        for ean in part["eans"]:
+            self.by_ean[ean] = part_id
+
+    def seed(self, families=SEED_PART_FAMILIES):
+        for category, sizes in families.items():
+            for size in sizes:
+                self.register(category, size)
+
+    # ---- lookups --------------------------------------------------------
+    def label(self, part_id):
+        part = self.parts.get(part_id)
+        return format_label(part["category"], part["size"]) if part else None
+
+    def label_for_key(self, key):
+        """Storage key -> display label; unknown (legacy) keys are returned unchanged."""
+        part_id = self.id_from_key(key)
+        label = self.label(part_id) if part_id is not None else None
+        return label or key
+
+    def key_for(self, name, create=False):
+        """
+        Display label or storage key -> storage key. Labels missing from the
+        catalogue are registered when `create` is set, otherwise returned
+        unchanged (legacy name-keyed data keeps working).
+        """
+        if self.id_from_key(name) in self.parts:
+            return name
+        part_id = self.by_label.get(name)
+        if part_id is None and create:
+            part_id = self.register(*parse_label(name))
+        return self.key(part_id) if part_id is not None else name
+
+    def ids_in_category(self, category):
+        return sorted(self.by_category.get(category, ()))
+
+    def ids_with_size(self, size):
+        return sorted(self.by_size.get(size, ()))
+
+    def id_for_ean(self, ean):
+        return self.by_ean.get(ean)
+
+    def families(self):
+        """{category: [sizes]} for pickers (replaces the old hard-coded dict)."""
+        result = {}
+        for category, ids in sorted(self.by_category.items()):
+            result[category] = [self.parts[i]["size"] for i in sorted(ids)]
+        return result
+
+    # ---- writes ---------------------------------------------------------
+    def _allocate_id(self):
+        def increment(current):
+            return (current or 0) + 1
+        return backend.reference("part_catalogue/next_id").transaction(increment)
+
+    def register(self, category, size="", unit=DEFAULT_UNIT, eans=()):
+        """Adds a part (or returns the existing ID for the same category and size)."""
+        label = format_label(category, size)
+        existing = self.by_label.get(label)
+        if existing is not None:
+            for ean in eans:
+                self.add_ean(existing, ean)
+            return existing
+
+        candidate = self._allocate_id()
+
+        def claim(current):
+            # The first station to register the label wins; the others take its ID
+            return current if isinstance(current, int) else candidate
+
+        part_id = backend.reference(f"{LABELS_PATH}/{label_key(label)}").transaction(claim)
+        value = {"category": category, "size": size, "unit": unit}
+        if part_id == candidate:
+            # An update, so EANs another station adds in the meantime are kept
+            backend.reference(f"part_catalogue/parts/{self.key(part_id)}").update(
+                {**value, **{f"eans/{ean}": True for ean in eans}}
+            )
+            value["eans"] = {ean: True for ean in eans}
+            logger.info("Part '%s' registered in the catalogue as ID %d.", label, part_id)
+        else:
+            stored = backend.reference(f"part_catalogue/parts/{self.key(part_id)}").get()
+            value = stored if isinstance(stored, dict) else value
+            logger.info("Part '%s' was registered by another station as ID %d.", label, part_id)
+        with self.lock:
+            self._index(part_id, value)
+        if part_id != candidate:
+            for ean in eans:
+                self.add_ean(part_id, ean)
+        return part_id
+
+    def add_ean(self, part_id, ean):
+        if self.by_ean.get(ean) == part_id:
+            return
+        backend.reference(f"part_catalogue/parts/{self.key(part_id)}/eans/{ean}").set(True)
+        with self.lock:
+            part = self.parts[part_id]
+            part["eans"] = sorted(set(part["eans"]) | {ean})
+            self.by_ean[ean] = part_id
@@ -0,0 +1,303 @@
+import os
+import logging
+import json
+import time
+import uuid
+import threading
+
+from database import backend
+
+logger = logging.getLogger(__name__)
+
+# -------------------------------------------------------------------------
+#                 REPLICATED STOCK COUNTERS (PN-COUNTERS)
+# -------------------------------------------------------------------------
+# /inventory_counters/<part_key> = {
+#     "slots":  {<station>: {"p": <added>, "n": <removed>, "t": <ms>}},
+#     "base":   {"p": ..., "n": ...},          # sum of folded slots
+#     "folded": {<station>: {"p": ..., "n": ...}},
+# }
+# "base" starts as the part's legacy /inventory value (seed_counter), which
+# is no longer written once counters are on. A node without "base" has not
+# been seeded yet - e.g. created by the slot push of a station that was
+# offline when it first changed the part - and has no value until some
+# station seeds it; the seed is retried on every sync until it lands.
+# Every station only ever writes its own slot, and slot values only grow,
+# so concurrent or offline stations never overwrite each other: merging is
+# a per-station max and the stock is base + sum(p - n) over the slots.
+# Compaction folds the slots of idle stations into "base" inside a
+# transaction; a station that finds its slot of a part folded continues that
+# part under a new slot id, carrying over only what the fold did not include.
+#
+# /changes/inventory_counters/<part_key> = <server ms> is stamped with every
+# slot push, seed and fold, so a station refreshes only the counters changed
+# since its last sync.
+COUNTERS_PATH = "inventory_counters"
+CHANGES_PATH = "changes/inventory_counters"
+STATE_FILE = "station_counters.json"
+# Re-read stamps this much older than the high-water mark (writes in flight)
+SYNC_OVERLAP_MS = 5000
+
+
+def mark_changed(part_key):
+    """Stamps a counter changed outside a slot push (seed, fold)."""
+    backend.reference(f"{CHANGES_PATH}/{part_key}").set({".sv": "timestamp"})
+
+
+def seed_counter(part_key):
+    """
+    Gives the counter of a part its base from the legacy /inventory value
+    unless it has one (a transaction, so stations racing to seed agree).
+    Returns True if this call seeded it.
+    """
+    legacy = backend.reference(f"inventory/{part_key}").get()
+    legacy = legacy if isinstance(legacy, int) else 0
+    seeded = [False]
+
+    def seed(node):
+        node = node if isinstance(node, dict) else {}
+        seeded[0] = "base" not in node
+        return {**node, "base": {"p": max(legacy, 0), "n": max(-legacy, 0)}} if seeded[0] else node
+
+    backend.reference(f"{COUNTERS_PATH}/{part_key}").transaction(seed)
+    if seeded[0]:
+        mark_changed(part_key)
+    return seeded[0]
+
+
+class PNCounter:
+    """One part's replicated counter."""
+
+    def __init__(self, slots=None, base=None, folded=None):
+        self.seeded = base is not None
+        self.base = [(base or {}).get("p", 0), (base or {}).get("n", 0)]
+        self.folded = {station: [v.get("p", 0), v.get("n", 0)] for station, v in (folded or {}).items()}
+        # A slot written by a station after it was folded is stale and ignored
+        self.slots = {
+            station: [v.get("p", 0), v.get("n", 0)]
+            for station, v in (slots or {}).items()
+            if station not in self.folded
+        }
+
+    @classmethod
+    def from_node(cls, node):
+        node = node if isinstance(node, dict) else {}
+        return cls(node.get("slots"), node.get("base"), node.get("folded"))
+
+    def value(self):
+        return self.base[0] - self.base[1] + sum(p - n for p, n in self.slots.values())
+
+    def merge_slot(self, station, p, n):
+        """Per-station max: the join of two replicas' views of a slot."""
+        if station in self.folded:
+            return
+        slot = self.slots.setdefault(station, [0, 0])
+        slot[0] = max(slot[0], p)
+        slot[1] = max(slot[1], n)
+
+
+class StationCounters:
+    """
+    This station's side of the counters: its own slots (persisted locally,
+    so increments survive restarts and network outages) and the last merged
+    view of every part it has synced.
+    """
+
+    def __init__(self, state_dir=".", station_id=None):
+        self.lock = threading.Lock()
+        self.state_path = os.path.join(state_dir, STATE_FILE)
+        self.own = {}       # part_key -> [p, n]
+        self.synced = {}    # part_key -> [p, n] last pushed to Firebase
+        self.view = {}      # part_key -> PNCounter (remote view, own slot merged in)
+        self.slot_ids = {}  # part_key -> slot id, when it differs from station_id
+        self.unseeded = set()  # part keys whose seed has not landed yet
+        self.high_water = 0  # newest change stamp merged into view (0: full read next)
+        self.station_id = station_id
+        self._load_state()
+        if not self.station_id:
+            self.station_id = f"st-{uuid.uuid4().hex[:8]}"
+            self._save_state()
+
+    # ---- local state ----------------------------------------------------
+    def _load_state(self):
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return
+        self.station_id = self.station_id or state.get("station_id")
+        self.own = {k: list(v) for k, v in state.get("own", {}).items()}
+        self.synced = {k: list(v) for k, v in state.get("synced", {}).items()}
+        self.slot_ids = dict(state.get("slot_ids", {}))
+        self.unseeded = set(state.get("unseeded", []))
+
+    def _save_state(self):
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "station_id": self.station_id, "own": self.own,
+                "synced": self.synced, "slot_ids": self.slot_ids, "unseeded": sorted(self.unseeded),
+            }, f)
+        os.replace(tmp_path, self.state_path)
+
+    def slot_id(self, part_key):
+        return self.slot_ids.get(part_key, self.station_id)
+
+    def all_slot_ids(self):
+        return {self.station_id} | set(self.slot_ids.values())
+
+    # ---- local operations (no network) ----------------------------------
+    def increment(self, part_key, delta):
+        """Records a stock change locally in O(1); pushed by the next sync()."""
+        with self.lock:
+            slot = self.own.setdefault(part_key, [0, 0])
+            if delta >= 0:
+                slot[0] += delta
+            else:
+                slot[1] -= delta
+            counter = self.view.get(part_key)
+            if counter is not None:
+                counter.merge_slot(self.slot_id(part_key), *slot)
+            self._save_state()
+
+    def mark_unseeded(self, part_key):
+        """The seed of a part failed (offline); the next sync() retries it."""
+        with self.lock:
+            self.unseeded.add(part_key)
+            self._save_state()
+
+    def value(self, part_key):
+        """Merged stock of a part, or None until its counter has been read with a seed."""
+        with self.lock:
+            counter = self.view.get(part_key)
+            if counter is None or not counter.seeded:
+                return None
+            return counter.value()
+
+    def pending(self):
+        with self.lock:
+            return {k: v for k, v in self.own.items() if self.synced.get(k) != v}
+
+    # ---- sync -----------------------------------------------------------
+    def _rotate_slot(self, part_key, folded_amounts):
+        """Our slot of a part was folded: continue under a new id with what the fold missed."""
+        old_id = self.slot_id(part_key)
+        self.slot_ids[part_key] = f"{self.station_id}-{uuid.uuid4().hex[:4]}"
+        slot = self.own.get(part_key, [0, 0])
+        self.own[part_key] = [slot[0] - folded_amounts[0], slot[1] - folded_amounts[1]]
+        self.synced.pop(part_key, None)
+        logger.info("Counter slot '%s' of '%s' was compacted; continuing as '%s'.",
+                    old_id, part_key, self.slot_ids[part_key])
+
+    def _read_changed(self):
+        """
+        Counters changed since the high-water mark (the whole tree on the
+        first call) and the new mark.
+        """
+        if not self.high_water:
+            nodes = backend.reference(COUNTERS_PATH).get() or {}
+            stamps = [
+                slot.get("t") for node in nodes.values() if isinstance(node, dict)
+                for slot in (node.get("slots") or {}).values() if isinstance(slot, dict)
+            ]
+        else:
+            changed = (
+                backend.reference(CHANGES_PATH).order_by_value()
+                .start_at(self.high_water - SYNC_OVERLAP_MS).get() or {}
+            )
+            nodes = {k: backend.reference(f"{COUNTERS_PATH}/{k}").get() for k in changed}
+            stamps = list(changed.values())
+        stamps = [t for t in stamps if isinstance(t, (int, float))]
+        return nodes, max(stamps, default=self.high_water)
+
+    def sync(self, part_keys=None):
+        """
+        Pushes this station's dirty slots in one multi-path update and
+        refreshes the merged view of `part_keys` (default: every counter
+        changed since the last such sync).
+        Safe to call while offline - failures leave the slots pending.
+        """
+        try:
+            # Seeds first, so the nodes read below have their base
+            for part_key in sorted(self.unseeded):
+                seed_counter(part_key)
+                with self.lock:
+                    self.unseeded.discard(part_key)
+                if part_keys is not None:
+                    part_keys = [*part_keys, part_key]
+            high_water = self.high_water
+            if part_keys is not None:
+                part_keys = list(dict.fromkeys(part_keys))
+                nodes = {k: backend.reference(f"{COUNTERS_PATH}/{k}").get() for k in part_keys}
+            else:
+                nodes, high_water = self._read_changed()
+            with self.lock:
+                for part_key, node in nodes.items():
+                    folded = PNCounter.from_node(node).folded
+                    if self.slot_id(part_key) in folded:
+                        self._rotate_slot(part_key, folded[self.slot_id(part_key)])
+
+                dirty = {k: list(v) for k, v in self.own.items() if self.synced.get(k) != v}
+                if dirty:
+                    updates = {}
+                    for k, v in dirty.items():
+                        updates[f"{COUNTERS_PATH}/{k}/slots/{self.slot_id(k)}"] = {
+                            "p": v[0], "n": v[1], "t": {".sv": "timestamp"},
+                        }
+                        updates[f"{CHANGES_PATH}/{k}"] = {".sv": "timestamp"}
+                    backend.reference().update(updates)
+                    self.synced.update(dirty)
+
+                for part_key, node in nodes.items():
+                    counter = PNCounter.from_node(node)
+                    slot = self.own.get(part_key)
+                    if slot is not None:
+                        counter.merge_slot(self.slot_id(part_key), *slot)
+                    self.view[part_key] = counter
+                    if not counter.seeded:
+                        self.unseeded.add(part_key)  # another station's unseeded push; seeded next sync
+                self.high_water = high_water
+                self._save_state()
+            return True
+        except Exception as e:
+            logger.warning("Counter sync failed, changes stay pending: %s", e)
+            return False
+
+    def totals(self):
+        """Merged stock of every seeded counter in the view."""
+        with self.lock:
+            return {part_key: counter.value() for part_key, counter in self.view.items() if counter.seeded}
+
+
+def compact_counter(part_key, idle_seconds=7 * 24 * 3600, keep_stations=()):
+    """
+    Folds the slots of stations idle for `idle_seconds` into the base of one
+    counter (transaction). Returns the number of slots folded.
+    """
+    cutoff_ms = (time.time() - idle_seconds) * 1000
+    folded_count = [0]
+
+    def fold(node):
+        folded_count[0] = 0
+        if not isinstance(node, dict) or "base" not in node:
+            return node  # not seeded yet: folding would start its base from zero
+        slots = node.get("slots") or {}
+        base = dict(node.get("base") or {"p": 0, "n": 0})
+        folded = dict(node.get("folded") or {})
+        for station, slot in list(slots.items()):
+            if station in folded:
+                del slots[station]  # stale write from a station that was already folded
+                continue
+            if station in keep_stations or slot.get("t", 0) > cutoff_ms:
+                continue
+            base["p"] = base.get("p", 0) + slot.get("p", 0)
+            base["n"] = base.get("n", 0) + slot.get("n", 0)
+            folded[station] = {"p": slot.get("p", 0), "n": slot.get("n", 0)}
+            del slots[station]
+            folded_count[0] += 1
+        return {**node, "slots": slots, "base": base, "folded": folded}
+
+    backend.reference(f"{COUNTERS_PATH}/{part_key}").transaction(fold)
+    if folded_count[0]:
+        mark_changed(part_key)
+    return folded_count[0]
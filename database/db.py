@@ -1,26 +1,113 @@
 import os
+import json
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from firebase_admin import credentials, initialize_app, db, _apps
+from firebase_admin import credentials, initialize_app, _apps
 
-dotenv_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '.env')
+from database import backend
+from database.aggregates import WarehouseAggregates
+from database.catalogue import PartCatalogue, LABELS_PATH, label_key
+from database.errors import StaleProductError
+from database.integrity import IntegrityChecker, increment_of, merge_repair, repair_plan
+from database import stocktake
+from database import lots
+from database import schema
+from database.crdt import StationCounters, compact_counter, seed_counter
+from utils.helpers import install_root
+
+# Credentials stay in the install root; the code may run from an installed update under versions/<tag>
+dotenv_path = os.path.join(install_root(), '.env')
 load_dotenv(dotenv_path=dotenv_path)
 
+logger = logging.getLogger(__name__)
+
+# Server-side write time, stamped on every node a write through Database changes
+SERVER_TIMESTAMP = backend.SERVER_TIMESTAMP
+# Local copy of /inventory and /products plus the sync high-water marks,
+# and the journal of the delta syncs since that copy was written
+SYNC_STATE_FILE = "sync_state.json"
+SYNC_JOURNAL_FILE = "sync_state.journal"
+# Journal entries after which the next delta sync rewrites the whole copy
+SYNC_JOURNAL_MAX = 500
+# Changes are re-read this far behind the high-water mark (clock skew between write and commit)
+SYNC_OVERLAP_MS = 5000
+# More changed parts than this: one full read is cheaper than a read per part
+DELTA_MAX_KEYS = 200
+DELTA_READ_WORKERS = 8
+# Full resync at least this often, to pick up writes made without change stamps
+FULL_SYNC_INTERVAL_S = 24 * 3600
+# Paths per multi-path update when integrity repairs are written
+REPAIR_BATCH_SIZE = 500
+# Subtrees of /bins: pick-face bins of parts and of products
+BIN_KINDS = ("parts", "products")
+# Shard of the stock changes booked without a location (stations not bound to one)
+DEFAULT_LOCATION = "MAG"
+# "done" once migrate_to_part_ids has run (set in the same write); until then a
+# station's start time, claiming the migration for PART_IDS_CLAIM_S
+PART_IDS_PATH = "part_catalogue/ids_migrated"
+PART_IDS_CLAIM_S = 600
+
+
+def _stamps(values):
+    return [value for value in values if isinstance(value, (int, float))]
+
 class Database:
     def __init__(self):
         self.inventory = {}
         self.products = []
+        # Location this station works at (its inventory shard); None = no locations
+        self.location = os.getenv("EMAG_LOCATION") or None
+        self.location_inventory = {}
+        # Warehouse KPIs kept current by every mutation below
+        self.aggregates = WarehouseAggregates()
+        # Part catalogue: inventory and BOMs are stored under integer part IDs
+        self.catalogue = PartCatalogue()
+        state_dir = install_root()
+        # Local snapshot for delta sync, persisted per Firebase project (not for the in-memory backend)
+        self.sync_state_path = (
+            os.path.join(state_dir, SYNC_STATE_FILE) if backend.memory_backend() is None else None
+        )
+        self.sync_journal_path = os.path.join(state_dir, SYNC_JOURNAL_FILE) if self.sync_state_path else None
+        self.sync_journal_entries = 0
+        self.sync_state = self._load_sync_state()
+        self.sync_lock = threading.Lock()
+        # Open lots per part / product, see database/lots.py
+        self.lot_book = lots.LotBook()
+        # Product schema in use (1, migrating or 2) and the compact product index, see database/schema.py
+        self.schema = schema.SchemaState()
+        self.product_index = schema.ProductIndex()
+        # Replicated per-station stock counters (EMAG_COUNTERS=1), see database/crdt.py
+        self.counters = None
+        if os.getenv("EMAG_COUNTERS") == "1":
+            self.counters = StationCounters(state_dir, station_id=os.getenv("EMAG_STATION_ID"))
         self.initialize_firebase()
+        try:
+            self.catalogue.load()
+            self._ensure_part_ids()
+        except Exception as e:
+            logger.error("Error loading part catalogue from Firebase: %s", e)
 
     def initialize_firebase(self):
         """Initialize Firebase Admin SDK only if it hasn't been initialized."""
+        if backend.memory_backend() is not None:
+            logger.info("Using the in-memory backend, Firebase is not initialized.")
+            return
         try:
             database_url = os.getenv("FIREBASE_DATABASE_URL")
             if not database_url:
                 raise ValueError("FIREBASE_DATABASE_URL is not set or could not be loaded")
 
-            print("Loaded Firebase Database URL:", database_url)
+            logger.info("Loaded Firebase Database URL: %s", database_url)
 
-            if not _apps:  # Check if Firebase is already initialized
+            if not _apps and os.getenv("FIREBASE_DATABASE_EMULATOR_HOST"):
+                # Local stand-in (server/rtdb_emulator.py): firebase_admin talks to it unauthenticated
+                initialize_app(options={"databaseURL": database_url})
+                logger.info("Firebase initialized against the emulator at %s.",
+                            os.getenv("FIREBASE_DATABASE_EMULATOR_HOST"))
+            elif not _apps:  # Check if Firebase is already initialized
                 cred = credentials.Certificate({
                     "type": os.getenv("FIREBASE_TYPE"),
                     "project_id": os.getenv("FIREBASE_PROJECT_ID"),
@@ -35,23 +122,54 @@ class Database:
                 })
 
                 initialize_app(cred, {"databaseURL": database_url})
-                print("Firebase initialized successfully.")
+                logger.info("Firebase initialized successfully.")
             else:
-                print("Firebase already initialized. Skipping re-initialization.")
+                logger.debug("Firebase already initialized. Skipping re-initialization.")
         except Exception as e:
-            print(f"Error initializing Firebase: {e}")
+            logger.error("Error initializing Firebase: %s", e)
+
+
+    # Part key translation
+    #
+    # Callers (GUI, controller, import/export) work with display labels such
+    # as "Śrubki (M4)"; Firebase stores parts under catalogue keys ("p<id>").
+    # Keys not in the catalogue (data written before it existed) pass through
+    # unchanged; the first station started after the catalogue was introduced
+    # moves them to catalogue keys (migrate_to_part_ids). Only explicit part
+    # registration (add_part, add_ean_to_firebase) adds parts to the catalogue,
+    # so a mistyped name in a form never becomes a part.
+    def part_key(self, name, create=False):
+        """Display label -> storage key; `create` registers a label missing from the catalogue."""
+        return self.catalogue.key_for(name, create=create)
+
+    def part_label(self, key):
+        """Storage key -> display label."""
+        return self.catalogue.label_for_key(key)
 
+    def _labels_from_keys(self, data):
+        """{storage_key: qty} -> {label: qty}; legacy and ID keys of one part are summed."""
+        result = {}
+        for key, value in (data or {}).items():
+            label = self.part_label(key)
+            if isinstance(value, int) and isinstance(result.get(label), int):
+                result[label] += value
+            else:
+                result[label] = value
+        return result
+
+    def _keys_from_labels(self, parts):
+        return {self.part_key(name): qty for name, qty in (parts or {}).items()}
 
     def verify_ean_in_firebase(self, ean):
         """Check if an EAN exists in Firebase."""
         try:
-            ref = db.reference("ean_codes")
+            ref = backend.reference("ean_codes")
             ean_data = ref.child(ean).get()
             if ean_data:
                 return ean_data.get("name")
             return None
         except Exception as e:
-            print(f"Error verifying EAN in Firebase: {e}")
+            logger.error("Error verifying EAN in Firebase: %s", e)
             raise
 
     def verify_product_ean_in_firebase(self, ean):
@@ -60,13 +178,19 @@ class Database:
         If found, returns the associated product name. Otherwise returns None.
         """
         try:
-            ref = db.reference("product_ean_codes")
+            mode = self.schema.mode()
+            if mode != schema.MODE_LEGACY:
+                # Schema 2: the EAN is in the product index (local copy, one query on a miss)
+                found = self.product_index.find_ean(ean)
+                if found or mode == schema.MODE_COMPACT:
+                    return found[1] if found else None
+            ref = backend.reference("product_ean_codes")
             ean_data = ref.child(ean).get()
             if ean_data:
                 return ean_data.get("name")  # e.g. "Glowica2"
             return None
         except Exception as e:
-            print(f"Error verifying product EAN in Firebase: {e}")
+            logger.error("Error verifying product EAN in Firebase: %s", e)
             raise
 
     def add_product_ean_to_firebase(self, ean, product_name):
@@ -75,110 +199,436 @@ class Database:
         Example path: /product_ean_codes/123 => {"name": "Glowica2"}
         """
         try:
-            ref = db.reference(f"product_ean_codes/{ean}")
-            ref.set({"name": product_name})
-            print(f"Product EAN '{ean}' with name '{product_name}' added to Firebase.")
+            if self.schema.mode() != schema.MODE_LEGACY:
+                # Schema 2: the EAN goes into the product's index entry (the product may not exist yet)
+                pid = schema.product_id(product_name)
+                backend.reference().update(schema.index_updates(pid, product_name, [ean]))
+                self.product_index.add(pid, product_name, [ean])
+            else:
+                ref = backend.reference(f"product_ean_codes/{ean}")
+                ref.set({"name": product_name})
+            logger.info("Product EAN '%s' with name '%s' added to Firebase.", ean, product_name)
         except Exception as e:
-            print(f"Error adding EAN '{ean}' to Firebase: {e}")
+            logger.error("Error adding EAN '%s' to Firebase: %s", ean, e)
             raise
 
 
     def add_ean_to_firebase(self, ean, name):
         """Add a new EAN code to Firebase."""
         try:
-            ref = db.reference(f"ean_codes/{ean}")
-            ref.set({"name": name})
-            print(f"EAN '{ean}' with name '{name}' added to Firebase.")
+            part_id = self.catalogue.id_from_key(self.part_key(name, create=True))
+            ref = backend.reference(f"ean_codes/{ean}")
+            ref.set({"name": name, "part_id": part_id} if part_id is not None else {"name": name})
+            if part_id is not None:
+                self.catalogue.add_ean(part_id, ean)
+            logger.info("EAN '%s' with name '%s' added to Firebase.", ean, name)
         except Exception as e:
-            print(f"Error adding EAN '{ean}' to Firebase: {e}")
+            logger.error("Error adding EAN '%s' to Firebase: %s", ean, e)
+            raise
+
+    def iter_children(self, path, page_size=1000):
+        """
+        Yields (key, value) for every child of `path`, reading `page_size`
+        children per request (ordered by key), so large trees are never
+        downloaded or held in memory at once.
+        """
+        ref = backend.reference(path)
+        last_key = None
+        while True:
+            query = ref.order_by_key()
+            if last_key is not None:
+                query = query.start_at(last_key)
+            # One extra child when resuming, because start_at is inclusive
+            page = query.limit_to_first(page_size + (1 if last_key is not None else 0)).get()
+            if not page:
+                return
+            items = list(page.items()) if isinstance(page, dict) else list(enumerate(page))
+            if last_key is not None and items and items[0][0] == last_key:
+                items = items[1:]
+            if not items:
+                return
+            for key, value in items:
+                yield key, value
+            last_key = items[-1][0]
+            if len(items) < page_size:
+                return
+
+    # Stock of record: /inventory, or with station counters their merged
+    # totals over it (a part never changed in counter mode, or whose seed
+    # has not landed, still has only its /inventory value).
+    def iter_stock(self, page_size=1000):
+        """Yields (part_key, stock) of every part, /inventory streamed page by page."""
+        if not self.counters:
+            yield from self.iter_children("inventory", page_size)
+            return
+        self.counters.sync()
+        totals = self.counters.totals()
+        for key, value in self.iter_children("inventory", page_size):
+            yield key, totals.pop(key, value)
+        yield from totals.items()
+
+    def read_stock(self, keys):
+        """{part_key: stock or None} of `keys`, one read per part not served by the counters."""
+        keys = list(dict.fromkeys(keys))
+        values = {}
+        if self.counters and keys:
+            self.counters.sync(keys)
+            values = {key: self.counters.value(key) for key in keys if self.counters.value(key) is not None}
+        rest = [key for key in keys if key not in values]
+        with ThreadPoolExecutor(max_workers=DELTA_READ_WORKERS) as pool:
+            values.update(zip(rest, pool.map(lambda key: backend.reference(f"inventory/{key}").get(), rest)))
+        return values
+
+    def load_ean_codes(self):
+        """Returns the whole /ean_codes map as {ean: part_name} (one read)."""
+        try:
+            ean_data = backend.reference("ean_codes").get()
+            if not isinstance(ean_data, dict):
+                return {}
+            return {
+                ean: value.get("name")
+                for ean, value in ean_data.items()
+                if isinstance(value, dict) and value.get("name")
+            }
+        except Exception as e:
+            logger.error("Error loading EAN codes from Firebase: %s", e)
             raise
 
     # Inventory-related methods
-    def add_part(self, name, quantity):
-        """Adds a part to the inventory and syncs with Firebase."""
-        if name in self.inventory:
-            self.inventory[name] += quantity
-        else:
-            self.inventory[name] = quantity
+    def apply_part_deltas(self, deltas, chunk_size=500):
+        """
+        Adds {part_name: delta} to /inventory as multi-path updates, `chunk_size`
+        parts per request. Uses server-side increments, so concurrent stations
+        never overwrite each other and no read is needed first.
+        """
+        items = [(name, delta) for name, delta in deltas.items() if delta]
+        if self.counters:
+            for name, delta in items:
+                self._counter_increment(name, delta, sync=False)
+            self.sync_counters(name for name, _ in items)
+            return
+        # Booked at this station's location (or the default shard), which keeps the shards summing to the totals
+        self.apply_location_deltas(self.location or DEFAULT_LOCATION, dict(items), chunk_size=chunk_size)
 
-        self.update_part_quantity(name, self.inventory[name])
+    def add_part(self, name, quantity):
+        """Adds a part to the inventory (registering it in the catalogue) and syncs with Firebase."""
+        self.part_key(name, create=True)
+        self.update_part_quantity(name, quantity)
 
     def get_part(self, name):
         """Retrieves a part from inventory."""
         return self.inventory.get(name, 0)
 
+    # Location (shard) methods
+    #
+    # /inventory_locations/<location>/<part> holds the stock of one warehouse
+    # location (site, shelf or bin code, e.g. "MAG1-R03-P2"). /inventory/<part>
+    # stays the rolled-up total over all locations: every stock change is
+    # booked at a location - the one given, the station's own (EMAG_LOCATION)
+    # or DEFAULT_LOCATION - and increments the total in the same multi-path
+    # update, so the shards always sum to the total and global checks remain
+    # a single read. Taking stock off a location is a transaction on its
+    # shard, so concurrent takers cannot push it below zero.
+    def _check_location(self, location):
+        if not location or any(c in location for c in ".$#[]/"):
+            raise ValueError(f"Invalid location code: {location!r}")
+
+    def add_stock_change(self, updates, key, delta, location=None, taken=False):
+        """
+        Adds a stock change of one part to a multi-path update: the shard and,
+        without station counters, the total and its change stamp. With
+        counters the total is booked by stock_changed once the write is done.
+        `taken` leaves out the shard, already taken with take_stock.
+        """
+        location = location or self.location or DEFAULT_LOCATION
+        if not taken:
+            updates[f"inventory_locations/{location}/{key}"] = {".sv": {"increment": delta}}
+        if not self.counters:
+            updates[f"inventory/{key}"] = {".sv": {"increment": delta}}
+            updates[f"changes/inventory/{key}"] = SERVER_TIMESTAMP
+
+    def stock_changed(self, name, delta, location=None, sync=True):
+        """
+        Mirrors a written stock change in the local copies (cached shard,
+        inventory, KPIs); with station counters it is the counter increment.
+        Pass sync=False for a batch and push it with sync_counters.
+        """
+        shard = self.location_inventory.get(location or self.location or DEFAULT_LOCATION)
+        if shard is not None:
+            shard[name] = shard.get(name, 0) + delta
+        if self.counters:
+            self._counter_increment(name, delta, sync=sync)
+            return
+        self.inventory[name] = self.inventory.get(name, 0) + delta
+        self.aggregates.apply_part_delta(name, delta)
+
+    def sync_counters(self, names):
+        """Pushes the counter increments of a batch of stock_changed(..., sync=False) calls."""
+        if not self.counters:
+            return
+        names = list(dict.fromkeys(names))
+        self.counters.sync([self.part_key(name) for name in names])
+        for name in names:
+            self._counter_publish(name)
+
+    def _take_from_location(self, location, key, name, quantity):
+        """Takes `quantity` off one shard in a transaction that refuses to go below zero."""
+        available = [0]
+
+        def take(current):
+            available[0] = current if isinstance(current, int) else 0
+            return available[0] - quantity if available[0] >= quantity else current
+
+        backend.reference(f"inventory_locations/{location}/{key}").transaction(take)
+        if available[0] < quantity:
+            raise ValueError(f"Not enough '{name}' at '{location}' (have {available[0]}, need {quantity}).")
+
+    def _return_to_location(self, location, key, quantity):
+        """Gives back what _take_from_location took when the write that followed it failed."""
+        try:
+            backend.reference().update({f"inventory_locations/{location}/{key}": {".sv": {"increment": quantity}}})
+        except Exception as e:
+            logger.error("Could not return %d x '%s' to '%s'; the shard is short: %s", quantity, key, location, e)
+
+    def take_stock(self, needs, location=None):
+        """
+        Takes {part_name: quantity} off one location, all or nothing, in
+        transactions that refuse to go below zero (ValueError). Book the
+        totals with add_stock_change(..., taken=True) or give the units back
+        with return_stock. Returns the location.
+        """
+        location = location or self.location or DEFAULT_LOCATION
+        taken = {}
+        try:
+            for name, quantity in needs.items():
+                self._take_from_location(location, self.part_key(name), name, quantity)
+                taken[name] = quantity
+        except Exception:
+            self.return_stock(taken, location)
+            raise
+        return location
+
+    def return_stock(self, needs, location):
+        """Gives back what take_stock took when the write that followed it failed."""
+        for name, quantity in needs.items():
+            self._return_to_location(location, self.part_key(name), quantity)
+
+    def list_locations(self):
+        """Returns the codes of all locations holding stock (keys only, no quantities)."""
+        data = backend.reference("inventory_locations").get(shallow=True)
+        return sorted(data.keys()) if isinstance(data, dict) else []
+
+    # Bins (pick faces)
+    #
+    # /bins/parts/<part_key> and /bins/products/<product_name> hold the bin an
+    # item is picked from, in the location code format. Pick lists are routed
+    # over these codes (utils/picking.py).
+    def load_bins(self):
+        """{"parts": {part label: bin}, "products": {product name: bin}} in one read."""
+        data = backend.reference("bins").get() or {}
+        return {
+            "parts": self._labels_from_keys(data.get("parts")),
+            "products": dict(data.get("products") or {}),
+        }
+
+    def set_bin(self, kind, name, code):
+        """Assigns (or with an empty `code` clears) the bin of a part or product."""
+        if kind not in BIN_KINDS:
+            raise ValueError(f"Unknown bin kind: {kind!r}")
+        if code:
+            self._check_location(code)
+        key = self.part_key(name) if kind == "parts" else name
+        backend.reference(f"bins/{kind}/{key}").set(code or None)
+        logger.info("Bin of %s '%s' set to %s.", kind[:-1], name, code or "-")
+
+    def load_location(self, location):
+        """Loads and caches the inventory shard of one location."""
+        self._check_location(location)
+        data = backend.reference(f"inventory_locations/{location}").get()
+        self.location_inventory[location] = self._labels_from_keys(data if isinstance(data, dict) else {})
+        return self.location_inventory[location]
+
+    def get_total_quantity(self, name):
+        """Returns the total stock of a part across all locations (one read)."""
+        key = self.part_key(name, create=False)
+        if self.counters and self.counters.sync([key]) and self.counters.value(key) is not None:
+            return self.counters.value(key)
+        return backend.reference(f"inventory/{key}").get() or 0
+
+    def apply_location_deltas(self, location, deltas, chunk_size=250):
+        """
+        Adds {part_name: delta} to the shard of `location` and to the rolled-up
+        totals, each chunk as one atomic multi-path update.
+        """
+        self._check_location(location)
+        items = [(name, delta) for name, delta in deltas.items() if delta]
+        try:
+            for start in range(0, len(items), chunk_size):
+                chunk = items[start:start + chunk_size]
+                updates = {}
+                for name, delta in chunk:
+                    self.add_stock_change(updates, self.part_key(name), delta, location)
+                backend.reference().update(updates)
+                for name, delta in chunk:
+                    self.stock_changed(name, delta, location, sync=False)
+                self.sync_counters(name for name, _ in chunk)
+            logger.debug("Applied quantity changes for %d parts at location '%s'.", len(items), location)
+        except Exception as e:
+            logger.error("Error applying quantity changes at location '%s': %s", location, e)
+            raise
+
+    def adjust_location_quantity(self, location, name, delta):
+        """Changes the stock of one part at one location; refuses to go below zero."""
+        self._check_location(location)
+        if delta >= 0:
+            self.apply_location_deltas(location, {name: delta})
+            return
+        # The shard first (checked in a transaction), then the total (a counter increment with counters)
+        key = self.part_key(name)
+        self._take_from_location(location, key, name, -delta)
+        if not self.counters:
+            try:
+                backend.reference().update({
+                    f"inventory/{key}": {".sv": {"increment": delta}},
+                    f"changes/inventory/{key}": SERVER_TIMESTAMP,
+                })
+            except Exception:
+                self._return_to_location(location, key, -delta)
+                raise
+        self.stock_changed(name, delta, location)
+
+    def transfer_part(self, name, from_location, to_location, quantity):
+        """
+        Moves `quantity` of a part between locations: taken off the source in
+        a transaction (refused if not there), then added to the destination
+        (given back to the source if that write fails). Totals are
+        unchanged, so /inventory is not written.
+        """
+        self._check_location(from_location)
+        self._check_location(to_location)
+        if quantity <= 0:
+            raise ValueError("Transfer quantity must be greater than 0.")
+        if from_location == to_location:
+            return
+
+        key = self.part_key(name)
+        self._take_from_location(from_location, key, name, quantity)
+        try:
+            backend.reference().update({f"inventory_locations/{to_location}/{key}": {".sv": {"increment": quantity}}})
+            for location, delta in ((from_location, -quantity), (to_location, quantity)):
+                shard = self.location_inventory.get(location)
+                if shard is not None:
+                    shard[name] = shard.get(name, 0) + delta
+            logger.info("Moved %d x '%s' from '%s' to '%s'.", quantity, name, from_location, to_location)
+        except Exception as e:
+            logger.error("Error moving '%s' from '%s' to '%s': %s", name, from_location, to_location, e)
+            self._return_to_location(from_location, key, quantity)
+            raise
+
+    # Replicated counter methods (active with EMAG_COUNTERS=1)
+    def _counter_increment(self, name, delta, sync=True):
+        """Records the change in this station's slot at local speed, then syncs (best effort)."""
+        key = self.part_key(name)
+        if key not in self.counters.view:
+            try:
+                seed_counter(key)
+            except Exception as e:
+                # Retried by every sync until it lands; the part has no counter value until then
+                logger.warning("Could not seed counter for '%s' (offline?): %s", name, e)
+                self.counters.mark_unseeded(key)
+        self.counters.increment(key, delta)
+        if sync:
+            self.counters.sync([key])
+        self._counter_publish(name, delta)
+
+    def _counter_publish(self, name, delta=0):
+        """Local copies of a part after a counter change: the merged value, or the last known one plus `delta`."""
+        value = self.counters.value(self.part_key(name))
+        if value is None:
+            self.inventory[name] = self.inventory.get(name, 0) + delta
+            self.aggregates.apply_part_delta(name, delta)
+        else:
+            self.inventory[name] = value
+            self.aggregates.set_part(name, value)
+
+    def merged_quantity(self, name):
+        """Merged stock of a part from the last synced view plus local changes (no network)."""
+        value = self.counters.value(self.part_key(name, create=False)) if self.counters else None
+        return self.get_part(name) if value is None else value
+
+    def compact_counters(self, idle_days=7):
+        """Folds slots of stations idle for `idle_days` into each counter's base."""
+        if not self.counters:
+            return 0
+        self.counters.sync()
+        folded = 0
+        for key in list(self.counters.view):
+            folded += compact_counter(key, idle_days * 24 * 3600, keep_stations=self.counters.all_slot_ids())
+        logger.info("Compacted %d counter slots.", folded)
+        return folded
+
     def load_inventory_from_firebase(self):
         """Load inventory from Firebase."""
         try:
-            ref = db.reference("inventory")
+            ref = backend.reference("inventory")
             inventory_data = ref.get()
             if inventory_data:
-                self.inventory = inventory_data
+                self.inventory = self._labels_from_keys(inventory_data)
             else:
-                print("No inventory data found in Firebase.")
-            print("Inventory loaded successfully from Firebase.")
+                logger.info("No inventory data found in Firebase.")
+            logger.debug("Inventory loaded successfully from Firebase.")
         except Exception as e:
-            print(f"Error loading inventory from Firebase: {e}")
+            logger.error("Error loading inventory from Firebase: %s", e)
             raise
 
     def load_products_from_firebase(self):
         """Load products from Firebase, including parts."""
         try:
-            ref = db.reference("products")
-            products_data = ref.get()
+            products_data = self._read_all_products(self.schema.mode())
             if products_data:
                 self.products = [
                     {
                         "ean": value.get("ean"),
-                        "name": value.get("name"),
+                        "name": value.get("name", key),
                         "quantity": value.get("quantity", 0),
-                        "parts": value.get("parts", {}),
+                        "parts": self._labels_from_keys(value.get("parts", {})),
                     }
-                    for value in products_data.values()
+                    for key, value in products_data.items()
                 ]
-                print(f"Loaded {len(self.products)} products from Firebase.")
+                logger.debug("Loaded %d products from Firebase.", len(self.products))
             else:
-                print("No products data found in Firebase.")
+                logger.info("No products data found in Firebase.")
         except Exception as e:
-            print(f"Error loading products from Firebase: {e}")
+            logger.error("Error loading products from Firebase: %s", e)
             raise
 
     def update_part_quantity(self, name, quantity_change):
         """Correctly adjust part quantity instead of overwriting."""
+        if self.counters:
+            self._counter_increment(name, quantity_change)
+            return
         try:
-            ref = db.reference(f"inventory/{name}")
-            current_quantity = ref.get() or 0  # Get current stock, default to 0
-            new_quantity = current_quantity + quantity_change  # Apply adjustment
-
-            if new_quantity < 0:
-                new_quantity = 0  # Prevent negative values
-
-            ref.set(new_quantity)  # Save updated quantity
-            print(f"Part '{name}' updated to {new_quantity} in Firebase.")
-        except Exception as e:
-            print(f"Error updating part '{name}' in Firebase: {e}")
-
-    
-    # In db.py
-    def update_product_in_firebase(self, product):
-        try:
-            product_name = product["name"]
-            ref = db.reference("products")
-            product_node = ref.child(product_name)
-            if not product_node.get():
-                print(f"[WARNING] No product named '{product_name}' in /products.")
+            key = self.part_key(name)
+            current_quantity = backend.reference(f"inventory/{key}").get() or 0  # Get current stock, default to 0
+            if current_quantity + quantity_change < 0:
+                logger.warning(
+                    "Part '%s' would go negative (%d %+d); stock set to 0, the difference is lost.",
+                    name, current_quantity, quantity_change,
+                )
+                quantity_change = -current_quantity  # Prevent negative values
+            if not quantity_change:
                 return
 
-            # Update only the fields you want
-            product_node.update({
-                "quantity": product["quantity"],
-                "parts": product.get("parts", {})
-            })
-            print(f"Updated product '{product_name}' => quantity={product['quantity']} in Firebase.")
+            # Written as an increment (with its shard), so concurrent changes are never overwritten
+            updates = {}
+            self.add_stock_change(updates, key, quantity_change)
+            backend.reference().update(updates)
+            self.stock_changed(name, quantity_change)
+            logger.debug("Part '%s' changed by %+d in Firebase.", name, quantity_change)
         except Exception as e:
-            print(f"Error updating product '{product['name']}' in Firebase: {e}")
-
+            logger.error("Error updating part '%s' in Firebase: %s", name, e)
 
+    
     # Product-related methods
     def add_product(self, product):
         """Adds a product to the products list and syncs with Firebase."""
@@ -199,27 +649,250 @@ class Database:
             self.products.append(product)
             self.add_product_to_firebase(product)
 
+    # Delta sync
+    #
+    # Writes through Database stamp what they change: products get an
+    # "updated_at" server timestamp, inventory entries (plain numbers) are
+    # stamped under /changes/inventory/<part_key>, and deleted products leave
+    # a tombstone under /changes/products/<name>. The station keeps its last
+    # copy of /inventory and /products, with the newest stamp seen (the
+    # high-water mark), in sync_state.json and afterwards reads only what
+    # changed since. Firebase rules need ".indexOn": "updated_at" on /products
+    # and ".indexOn": ".value" on /changes/inventory and /changes/products.
+    # Under schema 2 products come from /products_v2, whose "u" stamps cover
+    # deletions too; the snapshot keeps them in the /products node shape.
+    # A delta sync only appends the entries it changed to sync_state.journal;
+    # the full copy is rewritten by a full sync or once the journal is long.
+    def _load_sync_state(self):
+        empty = {
+            "database_url": os.getenv("FIREBASE_DATABASE_URL"),
+            "inventory": {}, "products": {}, "high_water": {}, "full_sync_at": 0,
+        }
+        if not self.sync_state_path:
+            return empty
+        try:
+            with open(self.sync_state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return empty
+        # A snapshot of another Firebase project is useless
+        if state.get("database_url") != empty["database_url"]:
+            return empty
+        state = {**empty, **state}
+        self._replay_sync_journal(state)
+        return state
+
+    def _replay_sync_journal(self, state):
+        """Applies the journal entries written since `state` was saved (same generation)."""
+        try:
+            with open(self.sync_journal_path, "rb") as f:
+                lines = f.readlines()
+        except OSError:
+            return
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                break  # torn last line of a crash mid-append
+            if entry.get("g") != state.get("generation"):
+                continue
+            for section in ("inventory", "products"):
+                for key, value in entry.get(section, {}).items():
+                    if value is None:
+                        state[section].pop(key, None)
+                    else:
+                        state[section][key] = value
+            state["high_water"] = entry.get("high_water", state["high_water"])
+            self.sync_journal_entries += 1
+
+    def _save_sync_state(self):
+        """Writes the whole local copy and starts a new (empty) journal generation."""
+        if not self.sync_state_path:
+            return
+        self.sync_state["generation"] = self.sync_state.get("generation", 0) + 1
+        tmp_path = self.sync_state_path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.sync_state, f)
+            os.replace(tmp_path, self.sync_state_path)
+            # Entries of the previous generation are skipped on load, so losing this is harmless
+            with open(self.sync_journal_path, "w", encoding="utf-8"):
+                pass
+            self.sync_journal_entries = 0
+        except OSError as e:
+            logger.warning("Could not save the sync state: %s", e)
+
+    def _journal_sync_state(self, inventory_keys, product_names):
+        """Appends the entries one delta sync changed (None: removed) to the journal."""
+        if not self.sync_state_path:
+            return
+        if self.sync_journal_entries >= SYNC_JOURNAL_MAX:
+            self._save_sync_state()
+            return
+        state = self.sync_state
+        entry = {
+            "g": state.get("generation"),
+            "inventory": {key: state["inventory"].get(key) for key in inventory_keys},
+            "products": {name: state["products"].get(name) for name in product_names},
+            "high_water": state["high_water"],
+        }
+        try:
+            with open(self.sync_journal_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+            self.sync_journal_entries += 1
+        except OSError as e:
+            logger.warning("Could not save the sync state: %s", e)
+
+    def newest_stamp(self, path, child=None):
+        """Largest change stamp under `path` (by value, or by `child`); 0 if none."""
+        ref = backend.reference(path)
+        query = ref.order_by_child(child) if child else ref.order_by_value()
+        latest = query.limit_to_last(1).get() or {}
+        return max(
+            _stamps(value.get(child) if child and isinstance(value, dict) else value for value in latest.values()),
+            default=0,
+        )
+
+    def full_sync(self):
+        """Downloads /inventory and the products whole and resets the high-water marks."""
+        mode = self.schema.mode()
+        # Stamps first: anything written during the download is newer and comes with the next delta
+        high_water = {"inventory": self.newest_stamp("changes/inventory")}
+        if mode != schema.MODE_COMPACT:
+            high_water["products"] = max(
+                self.newest_stamp("products", "updated_at"), self.newest_stamp("changes/products")
+            )
+        if mode != schema.MODE_LEGACY:
+            high_water["products_v2"] = self.newest_stamp(schema.PRODUCTS_PATH, "u")
+        inventory = backend.reference("inventory").get()
+        state = self.sync_state
+        state["inventory"] = inventory if isinstance(inventory, dict) else {}
+        state["products"] = self._read_all_products(mode)
+        state["high_water"] = high_water
+        state["schema"] = mode
+        state["full_sync_at"] = time.time()
+        self._save_sync_state()
+        logger.info("Full sync: %d parts, %d products.", len(state["inventory"]), len(state["products"]))
+        return {"full": True, "inventory": len(state["inventory"]), "products": len(state["products"])}
+
+    def delta_sync(self):
+        """
+        Brings the local snapshot up to date, reading only the nodes changed
+        since the high-water mark (a full sync on first use and once a day).
+        Returns {"full": bool, "inventory": <changed>, "products": <changed>}.
+        """
+        with self.sync_lock:
+            state = self.sync_state
+            mode = self.schema.mode()
+            if (not state["high_water"] or time.time() - state["full_sync_at"] > FULL_SYNC_INTERVAL_S
+                    or state.get("schema", schema.MODE_LEGACY) != mode):
+                return self.full_sync()
+            high_water = dict(state["high_water"])
+            since_parts = high_water.get("inventory", 0) - SYNC_OVERLAP_MS
+            since_products = high_water.get("products", 0) - SYNC_OVERLAP_MS
+            since_compact = high_water.get("products_v2", 0) - SYNC_OVERLAP_MS
+
+            changed_parts = (
+                backend.reference("changes/inventory").order_by_value().start_at(since_parts).get() or {}
+            )
+            if len(changed_parts) > DELTA_MAX_KEYS:
+                return self.full_sync()
+            changed_products, deleted_products, changed_compact = {}, {}, {}
+            if mode != schema.MODE_COMPACT:
+                changed_products = (
+                    backend.reference("products").order_by_child("updated_at").start_at(since_products).get() or {}
+                )
+                deleted_products = (
+                    backend.reference("changes/products").order_by_value().start_at(since_products).get() or {}
+                )
+            if mode != schema.MODE_LEGACY:
+                changed_compact = (
+                    backend.reference(schema.PRODUCTS_PATH).order_by_child("u").start_at(since_compact).get() or {}
+                )
+
+            keys = list(changed_parts)
+            with ThreadPoolExecutor(max_workers=DELTA_READ_WORKERS) as pool:
+                values = list(pool.map(lambda key: backend.reference(f"inventory/{key}").get(), keys))
+            for key, value in zip(keys, values):
+                if value is None:
+                    state["inventory"].pop(key, None)
+                else:
+                    state["inventory"][key] = value
+            for name, node in changed_products.items():
+                if isinstance(node, dict):
+                    state["products"][name] = node
+            for name in deleted_products:
+                if name not in changed_products:  # re-created after the deletion
+                    state["products"].pop(name, None)
+            # Compact nodes last: in dual mode they replace the legacy copy of a moved product
+            self.product_index.fetch(pid for pid, node in changed_compact.items() if schema.is_product(node))
+            for pid, node in changed_compact.items():
+                if schema.is_product(node):
+                    state["products"][node["n"]] = schema.legacy_view(node, self.product_index.eans(pid))
+                elif schema.is_tombstone(node):
+                    state["products"].pop(node.get("n"), None)
+                    self.product_index.remove(pid)
+
+            high_water["inventory"] = max(_stamps(changed_parts.values()), default=high_water.get("inventory", 0))
+            if mode != schema.MODE_COMPACT:
+                high_water["products"] = max(
+                    _stamps(node.get("updated_at") for node in changed_products.values() if isinstance(node, dict))
+                    + _stamps(deleted_products.values()),
+                    default=high_water.get("products", 0),
+                )
+            if mode != schema.MODE_LEGACY:
+                high_water["products_v2"] = max(
+                    _stamps(node.get("u") for node in changed_compact.values() if isinstance(node, dict)),
+                    default=high_water.get("products_v2", 0),
+                )
+            state["high_water"] = high_water
+            if changed_parts or changed_products or deleted_products or changed_compact:
+                self._journal_sync_state(keys, {
+                    *changed_products, *deleted_products,
+                    *(node.get("n") for node in changed_compact.values() if isinstance(node, dict) and node.get("n")),
+                })
+            logger.debug(
+                "Delta sync: %d parts, %d products changed, %d deleted.",
+                len(changed_parts), len(changed_products) + len(changed_compact), len(deleted_products),
+            )
+            return {
+                "full": False,
+                "inventory": len(changed_parts),
+                "products": len(changed_products) + len(deleted_products) + len(changed_compact),
+            }
+
+    def _sync_snapshot(self):
+        """Delta sync, falling back to the last snapshot while Firebase is unreachable."""
+        try:
+            self.delta_sync()
+        except Exception as e:
+            if not self.sync_state["high_water"]:
+                raise
+            logger.warning("Sync failed, showing the last synced data: %s", e)
+
     def load_inventory(self):
-        """Load inventory from Firebase and print debug info."""
-        ref = db.reference("inventory")
-        inventory_data = ref.get()
-        print("Loaded Inventory Data:", inventory_data)  # Debugging
-        if isinstance(inventory_data, dict):
-            return inventory_data
-        return {}
+        """Inventory as {part label: quantity}, brought up to date by delta sync."""
+        self._sync_snapshot()
+        inventory_data = dict(self.sync_state["inventory"])
+        if self.counters:
+            self.counters.sync()
+            inventory_data = {**inventory_data, **self.counters.totals()}
+        inventory_data = self._labels_from_keys(inventory_data)
+        self.aggregates.load_inventory(inventory_data)
+        return inventory_data
 
     def load_parts(self):
         """Load parts (inventory) from Firebase."""
         try:
-            ref = db.reference("inventory")
+            ref = backend.reference("inventory")
             inventory_data = ref.get()
             if inventory_data:
-                self.inventory = inventory_data
+                self.inventory = self._labels_from_keys(inventory_data)
             else:
-                print("No parts data found in Firebase.")
-            print("Parts loaded successfully from Firebase.")
+                logger.info("No parts data found in Firebase.")
+            logger.debug("Parts loaded successfully from Firebase.")
         except Exception as e:
-            print(f"Error loading parts from Firebase: {e}")
+            logger.error("Error loading parts from Firebase: %s", e)
             raise
 
     def sync_with_firebase(self):
@@ -227,29 +900,98 @@ class Database:
         try:
             self.load_parts()
             self.load_products()
-            print("Data synchronized successfully with Firebase.")
+            logger.debug("Data synchronized successfully with Firebase.")
         except Exception as e:
-            print(f"Error during Firebase synchronization: {e}")
+            logger.error("Error during Firebase synchronization: %s", e)
             raise
 
     def add_product_to_firebase(self, product):
         """
-        Store the product at /products/<product_name>.
+        Store the product at /products/<product_name> (/products_v2/<id> under schema 2).
         Example path: /products/Glowica2
         """
+        product_name = product["name"]  # e.g. "Glowica2"
+        mode = self.schema.mode()
+        if mode != schema.MODE_LEGACY:
+            return self._add_compact_product(product, mode)
+        try:
+            ref = backend.reference("products")
+            ref.child(product_name).set({
+                **product,
+                "parts": self._keys_from_labels(product.get("parts", {})),
+                "updated_at": SERVER_TIMESTAMP,
+            })
+            self.aggregates.set_product(product_name, product.get("quantity", 0))
+            logger.info("Product '%s' added to Firebase.", product_name)
+        except Exception as e:
+            logger.error("Error adding product '%s' to Firebase: %s", product_name, e)
+            raise
+
+
+    def _add_compact_product(self, product, mode):
+        """Schema 2 version of add_product_to_firebase: node and index entry in one update."""
+        product_name = product["name"]
+        pid = schema.product_id(product_name)
         try:
-            ref = db.reference("products")
-            product_name = product["name"]  # e.g. "Glowica2"
-            ref.child(product_name).set(product)
-            print(f"Product '{product_name}' added to Firebase.")
+            eans = product.get("eans", []) + [product.get("ean")]
+            node = schema.encode_product(self, product_name, product.get("quantity", 0), product.get("parts", {}))
+            updates = {f"{schema.PRODUCTS_PATH}/{pid}": node, **schema.index_updates(pid, product_name, eans)}
+            if mode == schema.MODE_DUAL:
+                updates[f"products/{product_name}"] = None   # a legacy copy must not be migrated over it
+            backend.reference().update(updates)
+            self.product_index.add(pid, product_name, eans)
+            self.aggregates.set_product(product_name, product.get("quantity", 0))
+            logger.info("Product '%s' added to Firebase as %s.", product_name, pid)
         except Exception as e:
-            print(f"Error adding product '{product_name}' to Firebase: {e}")
+            logger.error("Error adding product '%s' to Firebase: %s", product_name, e)
             raise
 
+    def _product_eans(self, pid):
+        """EANs the product index knows for `pid` (the index is loaded on first use)."""
+        if not self.product_index.loaded:
+            self.product_index.load()
+        return self.product_index.eans(pid)
+
+    def _read_all_products(self, mode):
+        """{name: node in the /products shape} of every product, read whole from the trees `mode` uses."""
+        products = {}
+        if mode != schema.MODE_COMPACT:
+            data = backend.reference("products").get()
+            if isinstance(data, dict):
+                products.update({name: node for name, node in data.items() if isinstance(node, dict)})
+        if mode != schema.MODE_LEGACY:
+            data = backend.reference(schema.PRODUCTS_PATH).get()
+            self.product_index.load()
+            for pid, node in (data.items() if isinstance(data, dict) else ()):
+                if schema.is_product(node):
+                    products[node["n"]] = schema.legacy_view(node, self.product_index.eans(pid))
+                elif schema.is_tombstone(node):
+                    products.pop(node.get("n"), None)
+        return products
+
+    def iter_products(self, page_size=1000):
+        """
+        Yields (name, node in the /products shape, storage path) of every
+        product, page by page: /products_v2 first, then (before schema 2)
+        the legacy products not moved yet.
+        """
+        mode = self.schema.mode()
+        moved = set()
+        if mode != schema.MODE_LEGACY:
+            for pid, node in self.iter_children(schema.PRODUCTS_PATH, page_size):
+                if schema.is_product(node) or schema.is_tombstone(node):
+                    moved.add(node.get("n"))
+                if schema.is_product(node):
+                    view = schema.legacy_view(node, self._product_eans(pid))
+                    yield node["n"], view, f"{schema.PRODUCTS_PATH}/{pid}"
+        if mode != schema.MODE_COMPACT:
+            for name, node in self.iter_children("products", page_size):
+                if isinstance(node, dict) and name not in moved:
+                    yield name, node, f"products/{name}"
 
     def load_products(self):
         """
-        Reads all products under /products and returns a list of dicts:
+        Returns all products (the delta-synced copy of /products) as a list of dicts:
         [
         {
             "name": "<product_key>",
@@ -259,71 +1001,404 @@ class Database:
         ...
         ]
         """
-        ref = db.reference("products")
-        products_data = ref.get()
-        print("Loaded Products Data:", products_data)  # Debugging
+        self._sync_snapshot()
+        products_data = self.sync_state["products"]
 
+        products = []
         if isinstance(products_data, dict):
             # Each top-level key is the product's name
-            return [
+            products = [
                 {
                     "name": key,
                     "ean": value.get("ean"),
                     "quantity": value.get("quantity", 0),
-                    "parts": value.get("parts", {})
+                    "parts": self._labels_from_keys(value.get("parts", {}))
                 }
                 for key, value in products_data.items()
             ]
-        return []
+        self.aggregates.load_products(products)
+        return products
 
 
+    def _product_from_node(self, name, node, etag=None):
+        product = {
+            **node,  # keep fields this class does not know about, a conditional write replaces the node
+            "name": name,
+            "ean": node.get("ean"),
+            "quantity": node.get("quantity", 0),
+            "parts": self._labels_from_keys(node.get("parts", {})),
+        }
+        if etag is not None:
+            product["_etag"] = etag
+        return product
+
+    def load_product(self, product_name):
+        """
+        Reads one product together with its ETag, for a later conditional
+        write through update_product_in_firebase. Returns None if missing.
+        """
+        mode = self.schema.mode()
+        if mode != schema.MODE_LEGACY:
+            node, etag = schema.read_product(self, product_name, mode)
+            if node is None:
+                return None
+            eans = self._product_eans(schema.product_id(product_name))
+            return self._product_from_node(product_name, {**schema.legacy_view(node, eans), "eans": eans}, etag)
+        node, etag = backend.reference("products").child(product_name).get(etag=True)
+        if not isinstance(node, dict):
+            return None
+        return self._product_from_node(product_name, node, etag)
+
     def update_product_in_firebase(self, product):
         """
-        Locates /products/<product_name> and updates its 'quantity' and 'parts' fields.
-        No more queries needed; we directly address the product name as the node key.
+        Writes 'quantity' and 'parts' of /products/<product_name>.
+        A product read with load_product carries its ETag: the write is then
+        conditional (one round-trip, no existence read) and raises
+        StaleProductError with the refreshed product if another station
+        changed or deleted it in the meantime. On success the ETag in
+        `product` is updated (and the product returned), so the same dict
+        can be written again.
         """
-        try:
-            ref = db.reference("products")
-            product_name = product["name"]
-            product_node = ref.child(product_name)
+        product_name = product["name"]
+        mode = self.schema.mode()
+        if mode != schema.MODE_LEGACY:
+            return self._update_compact_product(product, mode)
+        product_node = backend.reference("products").child(product_name)
+        fields = {
+            "quantity": product["quantity"],
+            "parts": self._keys_from_labels(product.get("parts", {})),
+            "updated_at": SERVER_TIMESTAMP,
+        }
 
-            if not product_node.get():
-                print(f"[WARNING] No product named '{product_name}' in /products.")
-                return
+        if "_etag" not in product:
+            # Legacy callers without an ETag: plain field update
+            try:
+                product_node.update(fields)
+                self.aggregates.set_product(product_name, product["quantity"])
+                logger.debug("Updated product '%s' => quantity=%s in Firebase.", product_name, product["quantity"])
+            except Exception as e:
+                logger.error("Error updating product '%s' in Firebase: %s", product_name, e)
+            return
 
-            product_node.update({
-                "quantity": product["quantity"],
-                "parts": product.get("parts", {})
-            })
-            print(f"Updated product '{product_name}' => quantity={product['quantity']} in Firebase.")
+        node = {"name": product_name, **{k: v for k, v in product.items() if not k.startswith("_")}, **fields}
+        if node.get("ean") is None:
+            node.pop("ean", None)
+        success, current_node, etag = product_node.set_if_unchanged(product["_etag"], node)
+        if not success:
+            current = (
+                self._product_from_node(product_name, current_node, etag)
+                if isinstance(current_node, dict) else None
+            )
+            logger.warning("Product '%s' changed concurrently; write rejected.", product_name)
+            raise StaleProductError(product_name, current)
 
-        except Exception as e:
-            print(f"Error updating product '{product['name']}' in Firebase: {e}")
+        product["_etag"] = etag
+        self.aggregates.set_product(product_name, product["quantity"])
+        logger.debug("Updated product '%s' => quantity=%s in Firebase.", product_name, product["quantity"])
+        return product
 
+    def _update_compact_product(self, product, mode):
+        """Schema 2 version of update_product_in_firebase (same ETag semantics)."""
+        product_name = product["name"]
+        product_node = backend.reference(f"{schema.PRODUCTS_PATH}/{schema.product_id(product_name)}")
+        if "_etag" not in product:
+            # Plain field update (with the name, in case the product is not there yet)
+            try:
+                product_node.update({
+                    "n": product_name,
+                    "q": product["quantity"],
+                    "b": schema.encode_bom(self, product.get("parts", {})) or None,
+                    "u": SERVER_TIMESTAMP,
+                })
+                self.aggregates.set_product(product_name, product["quantity"])
+                logger.debug("Updated product '%s' => quantity=%s in Firebase.", product_name, product["quantity"])
+            except Exception as e:
+                logger.error("Error updating product '%s' in Firebase: %s", product_name, e)
+            return
+
+        node = schema.encode_product(self, product_name, product["quantity"], product.get("parts", {}))
+        success, _, etag = product_node.set_if_unchanged(product["_etag"], node)
+        if not success:
+            logger.warning("Product '%s' changed concurrently; write rejected.", product_name)
+            raise StaleProductError(product_name, self.load_product(product_name))
+
+        product["_etag"] = etag
+        self.aggregates.set_product(product_name, product["quantity"])
+        logger.debug("Updated product '%s' => quantity=%s in Firebase.", product_name, product["quantity"])
+        return product
 
     def delete_product(self, product_name):
         """
-        Deletes the product at /products/<product_name> and returns any used parts to inventory.
+        Deletes the product at /products/<product_name> and returns its parts
+        to inventory as return lots, closing the product's build lots.
         """
-        ref = db.reference("products")
-        product_node = ref.child(product_name)
-        product_data = product_node.get()
+        mode = self.schema.mode()
+        if mode != schema.MODE_LEGACY:
+            node, _ = schema.read_product(self, product_name, mode)
+            product_data = schema.legacy_view(node) if node else None
+            pid = schema.product_id(product_name)
+            # Schema 2: a tombstone (seen by delta sync, and never migrated over) instead of the node
+            updates = {
+                f"{schema.PRODUCTS_PATH}/{pid}": {"n": product_name, "d": SERVER_TIMESTAMP, "u": SERVER_TIMESTAMP},
+                f"{schema.INDEX_PATH}/{pid}": None,
+            }
+            for ean in schema.split_eans(backend.reference(f"{schema.INDEX_PATH}/{pid}/e").get()):
+                updates[f"{schema.EAN_INDEX_PATH}/{ean}"] = None
+        else:
+            product_data = backend.reference("products").child(product_name).get()
+            # The tombstone under /changes/products lets delta sync see the deletion
+            updates = {f"products/{product_name}": None, f"changes/products/{product_name}": SERVER_TIMESTAMP}
 
         if not product_data:
-            print(f"Product '{product_name}' not found in database.")
+            logger.warning("Product '%s' not found in database.", product_name)
+            return
+
+        # Parts back as return lots, build lots closed and the product deleted in one multi-path update
+        parts = product_data.get("parts") if isinstance(product_data.get("parts"), dict) else {}
+        quantity = max(product_data.get("quantity", 0), 0)
+        lots.dismantle(
+            self, product_name, quantity, self._labels_from_keys(parts),
+            return_parts=True, close=True, updates=updates,
+        )
+        if mode != schema.MODE_LEGACY:
+            self.product_index.remove(schema.product_id(product_name))
+        self.aggregates.remove_product(product_name)
+        logger.info("Product '%s' deleted from database, and parts returned to inventory.", product_name)
+
+    def load_aggregates(self):
+        """Loads the part KPIs from the stock of record, for stations that never load the whole inventory."""
+        self.aggregates.load_inventory(self._labels_from_keys(dict(self.iter_stock())))
+
+    def check_aggregates(self):
+        """
+        Full recompute of the warehouse KPIs from Firebase as a consistency
+        check. Returns the mismatches found (empty dict if none).
+        """
+        inventory = self._labels_from_keys(dict(self.iter_stock()))
+        products_data = self._read_all_products(self.schema.mode())
+        products = [{"name": key, "quantity": value.get("quantity", 0)} for key, value in products_data.items()]
+        mismatches = self.aggregates.verify(inventory, products)
+        if mismatches:
+            logger.warning("Aggregates out of sync, recomputed: %s", mismatches)
+        return mismatches
+
+    def check_integrity(self, incremental=False):
+        """
+        Checks the cross-tree invariants (see database/integrity.py), either
+        everywhere or only where something changed since the previous check.
+        Returns the issues found.
+        """
+        # Station counters keep the totals outside /inventory, so the location sums are only checked without them
+        checker = IntegrityChecker(
+            self, overlap_ms=SYNC_OVERLAP_MS, default_location=None if self.counters else DEFAULT_LOCATION,
+        )
+        issues = checker.run_incremental() if incremental else checker.run()
+        for issue in issues:
+            logger.warning("Integrity: %s at %s (%s).", issue["check"], issue["path"], issue["detail"])
+        return issues
+
+    def repair_integrity(self, issues):
+        """
+        Applies the automatic repairs of `issues` in batched multi-path
+        updates, stamped for delta sync. Returns the number of paths written.
+        """
+        plan = repair_plan(issues)
+        # Stock corrections are booked at the default location like any stock change (counter-aware)
+        corrections = {}
+        for path in [path for path in plan if path.startswith("inventory/")]:
+            delta = increment_of(plan[path])
+            if delta:
+                corrections[path.partition("/")[2]] = delta
+                del plan[path]
+        for key, delta in corrections.items():
+            booking = {}
+            self.add_stock_change(booking, key, delta, DEFAULT_LOCATION)
+            merge_repair(plan, booking)
+        for path in list(plan):
+            tree, _, rest = path.partition("/")
+            if tree == "inventory":
+                plan[f"changes/inventory/{rest}"] = SERVER_TIMESTAMP
+            elif tree == "products":
+                plan[f"products/{rest.split('/', 1)[0]}/updated_at"] = SERVER_TIMESTAMP
+            elif tree == schema.PRODUCTS_PATH:
+                plan[f"{schema.PRODUCTS_PATH}/{rest.split('/', 1)[0]}/u"] = SERVER_TIMESTAMP
+        items = list(plan.items())
+        for start in range(0, len(items), REPAIR_BATCH_SIZE):
+            backend.reference().update(dict(items[start:start + REPAIR_BATCH_SIZE]))
+        names = [self.part_label(key) for key in corrections]
+        for name, delta in zip(names, corrections.values()):
+            self.stock_changed(name, delta, DEFAULT_LOCATION, sync=False)
+        self.sync_counters(names)
+        logger.info("Integrity repairs applied: %d paths written.", len(items))
+        if corrections or any(path.startswith(("inventory/", "products/", f"{schema.PRODUCTS_PATH}/")) for path in plan):
+            self.check_aggregates()
+        return len(items)
+
+    # Stocktake (cycle count), see database/stocktake.py
+    def start_stocktake(self):
+        """Freezes the current stock for a count. Returns the stocktake ID."""
+        return stocktake.start(self)
+
+    def list_open_stocktakes(self):
+        return stocktake.list_open()
+
+    def record_stocktake_counts(self, stocktake_id, counts, replace=False):
+        """Adds (or with `replace` sets) counted {part_name: qty}."""
+        return stocktake.record_counts(self, stocktake_id, counts, replace=replace)
+
+    def stocktake_diff(self, stocktake_id, uncounted_as_zero=False):
+        return stocktake.diff(self, stocktake_id, uncounted_as_zero=uncounted_as_zero)
+
+    def commit_stocktake(self, stocktake_id, uncounted_as_zero=False):
+        """Applies all corrections and adjustment records in one write. Returns a summary."""
+        return stocktake.commit(self, stocktake_id, uncounted_as_zero=uncounted_as_zero)
+
+    # Lots (batch tracking), see database/lots.py
+    def receive_lots(self, deltas, expires=None, location=None):
+        """Books a delivery {part_name: qty} into the stock with one lot per part. Returns {part_name: lot_id}."""
+        return lots.receive(self, deltas, expires=expires, location=location)
+
+    def build_with_lots(self, product_name, units, bom):
+        """Deducts the parts of `units` builds FIFO/FEFO from their lots and records the build."""
+        return lots.build(self, product_name, units, bom)
+
+    def change_product_quantity(self, product, delta, return_parts=False):
+        """
+        Builds (delta > 0) or takes apart (delta < 0) units of a product read
+        with load_product. The quantity is written conditionally first
+        (StaleProductError, nothing written) and put back if the build or
+        dismantle that follows fails. Returns (updated product, build or None).
+        """
+        updated = {**product, "quantity": product["quantity"] + delta}
+        self.update_product_in_firebase(updated)
+        try:
+            if delta > 0:
+                return updated, lots.build(self, product["name"], delta, product["parts"])
+            if delta < 0:
+                lots.dismantle(self, product["name"], -delta, product["parts"], return_parts=return_parts)
+            return updated, None
+        except Exception:
+            self._revert_product_quantity(updated, delta)
+            raise
+
+    def _revert_product_quantity(self, product, delta, attempts=3):
+        """Takes `delta` back off a product whose quantity was written ahead of a failed build."""
+        for _ in range(attempts):
+            try:
+                self.update_product_in_firebase({**product, "quantity": product["quantity"] - delta})
+                return
+            except StaleProductError as e:
+                if e.current is None:
+                    return
+                product = e.current
+            except Exception as e:
+                logger.error("Error reverting product '%s': %s", product["name"], e)
+                break
+        logger.error("Could not take %+d back off product '%s'; its quantity is off.", delta, product["name"])
+
+    def ship_lots(self, product_name, units):
+        """Records which builds a shipment of `units` came from. Returns the shipment ID."""
+        return lots.ship(self, product_name, units)
+
+    def dismantle_lots(self, product_name, units, bom, return_parts=False):
+        return lots.dismantle(self, product_name, units, bom, return_parts=return_parts)
+
+    def open_lots(self, part_name):
+        return lots.open_lots(self, part_name)
+
+    def trace_build(self, product_name, build_id):
+        return lots.trace_build(self, product_name, build_id)
+
+    def trace_shipment(self, shipment_id):
+        return lots.trace_shipment(self, shipment_id)
+
+    def where_used(self, part_name, lot_id):
+        return lots.where_used(self, part_name, lot_id)
+
+    # Product schema, see database/schema.py
+    def schema_status(self):
+        """{"mode", "version", "migration"} of the product schema."""
+        node = self.schema.refresh()
+        return {"mode": self.schema.mode(), "version": self.schema.version, "migration": node.get("migration") or {}}
+
+    def migrate_schema(self, batch_size=schema.MIGRATION_BATCH_SIZE, workers=schema.MIGRATION_WORKERS,
+                       grace_s=schema.MIGRATION_GRACE_S, pause_s=0.0, progress=None):
+        """Moves every product to the compact schema 2 while stations keep working (dual mode)."""
+        return schema.migrate(self, batch_size=batch_size, workers=workers, grace_s=grace_s,
+                              pause_s=pause_s, progress=progress)
+
+    def _ensure_part_ids(self):
+        """Runs migrate_to_part_ids once per database, claimed by the first station that starts."""
+        if backend.reference(PART_IDS_PATH).get() == "done":
             return
+        started = time.time()
+        claimed = [False]
+
+        def claim(current):
+            claimed[0] = current != "done" and not (
+                isinstance(current, (int, float)) and started - current < PART_IDS_CLAIM_S
+            )
+            return started if claimed[0] else current
+
+        backend.reference(PART_IDS_PATH).transaction(claim)
+        if claimed[0]:
+            logger.info("Name-keyed stock not migrated yet; moving it to catalogue keys.")
+            self.migrate_to_part_ids()
+
+    def migrate_to_part_ids(self):
+        """
+        Rewrites name-keyed data ("Śrubki (M4)") to catalogue keys ("p<id>"):
+        /inventory, /inventory_locations, product BOMs and /ean_codes, in one
+        atomic multi-path update that also marks the migration done. Parts
+        unknown to the catalogue are registered. Returns the number of paths written.
+        """
+        updates = {}
 
-        # Return used parts to inventory
-        if "parts" in product_data and isinstance(product_data["parts"], dict):
-            inventory_ref = db.reference("inventory")
-            quantity = product_data.get("quantity", 0)
+        def rekey(path, data, increments=False):
+            for key, value in (data or {}).items():
+                new_key = self.part_key(key, create=True)
+                if new_key == key:
+                    continue
+                updates[f"{path}/{key}"] = None
+                if increments and isinstance(value, int):
+                    # Stock: an increment keeps what stations booked under the ID key meanwhile
+                    updates[f"{path}/{new_key}"] = {".sv": {"increment": value}}
+                    continue
+                # Merge with anything already stored under the ID key
+                existing = updates.get(f"{path}/{new_key}", data.get(new_key, 0))
+                if isinstance(value, int) and isinstance(existing, int):
+                    updates[f"{path}/{new_key}"] = existing + value
+                else:
+                    updates[f"{path}/{new_key}"] = value
 
-            for part_name, part_qty in product_data["parts"].items():
-                if part_qty > 0:
-                    current_stock = inventory_ref.child(part_name).get() or 0
-                    new_stock = current_stock + (part_qty * quantity)
-                    inventory_ref.child(part_name).set(new_stock)
+        rekey("inventory", backend.reference("inventory").get(), increments=True)
+        for location, shard in (backend.reference("inventory_locations").get() or {}).items():
+            rekey(f"inventory_locations/{location}", shard, increments=True)
+        for product_name, product in (backend.reference("products").get() or {}).items():
+            if isinstance(product, dict):
+                rekey(f"products/{product_name}/parts", product.get("parts"))
+        for ean, value in (backend.reference("ean_codes").get() or {}).items():
+            if isinstance(value, dict) and value.get("name") and "part_id" not in value:
+                part_id = self.catalogue.id_from_key(self.part_key(value["name"], create=True))
+                updates[f"ean_codes/{ean}/part_id"] = part_id
+                self.catalogue.add_ean(part_id, ean)
+        # Parts registered before the label index existed
+        labels = backend.reference(LABELS_PATH).get() or {}
+        for part_id in list(self.catalogue.parts):
+            key = label_key(self.catalogue.label(part_id))
+            if key not in labels:
+                updates[f"{LABELS_PATH}/{key}"] = part_id
 
-        product_node.delete()
-        print(f"Product '{product_name}' deleted from database, and parts returned to inventory.")
+        # Stamp every rewritten node so other stations pick the migration up by delta sync
+        for path in list(updates):
+            tree, _, rest = path.partition("/")
+            if tree == "inventory":
+                updates[f"changes/inventory/{rest}"] = SERVER_TIMESTAMP
+            elif tree == "products":
+                updates[f"products/{rest.split('/', 1)[0]}/updated_at"] = SERVER_TIMESTAMP
 
+        written = len(updates)
+        updates[PART_IDS_PATH] = "done"
+        backend.reference().update(updates)
+        logger.info("Migrated part keys to catalogue IDs (%d paths written).", written)
+        return written
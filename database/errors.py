@@ -0,0 +1,18 @@
+class StaleProductError(Exception):
+    """
+    A conditional product write was rejected because the product changed
+    (or was deleted) since it was read. `current` holds the refreshed
+    product (with its new ETag), or None if it no longer exists.
+    """
+
+    def __init__(self, product_name, current):
+        self.product_name = product_name
+        self.current = current
+        if current is None:
+            message = f"Product '{product_name}' was deleted by another station."
+        else:
+            message = (
+                f"Product '{product_name}' was changed by another station "
+                f"(quantity is now {current.get('quantity', 0)})."
+            )
+        super().__init__(message)
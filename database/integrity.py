@@ -0,0 +1,339 @@
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from database import backend
+from database import schema
+from database.catalogue import PartCatalogue
+from database.crdt import CHANGES_PATH as COUNTER_CHANGES_PATH
+
+logger = logging.getLogger(__name__)
+
+# -------------------------------------------------------------------------
+#                  DATA INTEGRITY CHECKS AND REPAIR PLANS
+# -------------------------------------------------------------------------
+# Invariants over /inventory, /products (or /products_v2), /product_ean_codes and /ean_codes:
+#
+#   invalid_stock              stock is not an integer
+#   negative_stock             stock below zero                 -> raised to 0 at the default location
+#   negative_product_quantity  product quantity below zero      -> raised to 0
+#   invalid_bom_quantity       BOM entry not a positive integer -> removed from the BOM
+#   missing_part               BOM part in the catalogue but not in /inventory -> stock entry created
+#   unknown_part               BOM part neither in the catalogue nor in /inventory (manual)
+#   orphan_product_ean         product EAN pointing to a missing product -> mapping removed
+#   orphan_part_ean            part EAN pointing to an unknown part (manual)
+#   unlocated_stock            total differs from the sum of its location shards
+#                              -> the difference booked at the default location
+#
+# A full run streams every tree page by page, the trees in parallel, and
+# checks the cross-tree invariants in parallel chunks. An incremental run
+# only checks the keys stamped since the previous run (see delta sync in
+# database/db.py); references into data that did not change are left to
+# the next full run (the location sums are checked by full runs only, and
+# not with station counters, whose totals are not in /inventory). Stock is
+# read through Database.iter_stock / read_stock, so with station counters
+# the checks see the counter totals and the changed parts come from their
+# change stamps. Deleted products are looked up in /product_ean_codes
+# by name, which needs ".indexOn": "name" there. Compact products (schema 2)
+# are checked in the same pass; their BOM is one list, so a bad entry is
+# repaired by rewriting the list. Every issue carries its repair as
+# multi-path update entries; Database.repair_integrity stamps and writes
+# them in batches. Counts are repaired with server increments by the
+# difference seen, never set, because repairs are written after the user
+# confirms them and deliveries or builds booked in between must survive;
+# stock corrections (inventory/<key> increments) are booked at a location
+# like any other stock change, so the location sums stay whole.
+STATE_PATH = "integrity/high_water"
+DEFAULT_WORKERS = 4
+
+
+def _issue(check, path, detail, repair=None):
+    return {"check": check, "path": path, "detail": detail, "repair": repair}
+
+
+def increment(delta):
+    return {".sv": {"increment": delta}}
+
+
+def increment_of(value):
+    """The delta of a server increment, None for any other value."""
+    if isinstance(value, dict) and isinstance(value.get(".sv"), dict):
+        return value[".sv"].get("increment")
+    return None
+
+
+def _is_count(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _chunks(items, size):
+    items = list(items)
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def check_stock(key, value):
+    if not _is_count(value):
+        return [_issue("invalid_stock", f"inventory/{key}", f"stock is {value!r}")]
+    if value < 0:
+        return [_issue("negative_stock", f"inventory/{key}", f"stock is {value}", {f"inventory/{key}": increment(-value)})]
+    return []
+
+
+def check_location_sum(key, total, shards, default_location):
+    """Stock of one part at its locations ({location: qty}) against its total."""
+    if not _is_count(total):
+        return []   # reported as invalid_stock
+    located = sum(value for value in shards.values() if _is_count(value))
+    if located == total:
+        return []
+    return [_issue(
+        "unlocated_stock", f"inventory/{key}", f"total {total}, at locations {located}",
+        {f"inventory_locations/{default_location}/{key}": increment(total - located)},
+    )]
+
+
+def _bom_path(path, part_key):
+    compact = path.startswith(f"{schema.PRODUCTS_PATH}/")
+    return f"{path}/b/{part_key}" if compact else f"{path}/parts/{part_key}"
+
+
+def check_product(name, node, path=None):
+    """Checks of one product (a node in the /products shape, stored at `path`) that need no other tree."""
+    path = path or f"products/{name}"
+    compact = path.startswith(f"{schema.PRODUCTS_PATH}/")
+    issues = []
+    quantity = node.get("quantity", 0)
+    if _is_count(quantity) and quantity < 0:
+        field = "q" if compact else "quantity"
+        issues.append(_issue(
+            "negative_product_quantity", f"{path}/{field}", f"quantity is {quantity}", {f"{path}/{field}": increment(-quantity)},
+        ))
+    parts = node.get("parts") or {}
+    parts = parts if isinstance(parts, dict) else {}
+    valid = {key: per_unit for key, per_unit in parts.items() if _is_count(per_unit) and per_unit > 0}
+    for part_key, per_unit in parts.items():
+        if part_key in valid:
+            continue
+        if compact:
+            pairs = sorted((PartCatalogue.id_from_key(key), count) for key, count in valid.items())
+            repair = {f"{path}/b": [value for pair in pairs for value in pair] or None}
+        else:
+            repair = {f"{path}/parts/{part_key}": None}
+        issues.append(_issue("invalid_bom_quantity", _bom_path(path, part_key), f"{per_unit!r} per unit", repair))
+    return issues
+
+
+class IntegrityChecker:
+    """Runs the checks for one Database; `workers` threads stream and check in parallel."""
+
+    def __init__(self, db, page_size=1000, chunk_size=500, workers=DEFAULT_WORKERS, overlap_ms=0,
+                 default_location=None):
+        self.db = db
+        self.default_location = default_location   # shard that takes unlocated stock; None = no location check
+        self.overlap_ms = overlap_ms   # re-check window before the previous high-water mark
+        self.page_size = page_size
+        self.chunk_size = chunk_size
+        self.workers = workers
+
+    # ---- streaming -----------------------------------------------------
+    def _scan_inventory(self):
+        stock, issues = {}, []
+        for key, value in self.db.iter_stock(self.page_size):
+            stock[key] = value
+            issues.extend(check_stock(key, value))
+        return stock, issues
+
+    def _scan_locations(self):
+        """{part_key: {location: qty}} over every shard."""
+        shards = {}
+        for location, shard in self.db.iter_children("inventory_locations", self.page_size):
+            for key, value in (shard.items() if isinstance(shard, dict) else ()):
+                shards.setdefault(key, {})[location] = value
+        return shards
+
+    def _scan_products(self):
+        boms, issues = {}, []
+        for name, node, path in self.db.iter_products(self.page_size):
+            parts = node.get("parts")
+            boms[name] = (path, parts if isinstance(parts, dict) else {})
+            issues.extend(check_product(name, node, path))
+        return boms, issues
+
+    def _scan_map(self, path):
+        return dict(self.db.iter_children(path, self.page_size))
+
+    # ---- cross-tree checks ---------------------------------------------
+    def _part_known(self, part_key):
+        return self.db.catalogue.id_from_key(part_key) in self.db.catalogue.parts
+
+    def _check_boms(self, inventory_keys, boms):
+        issues = []
+        for name, (product_path, parts) in boms:
+            for part_key in parts:
+                if part_key in inventory_keys:
+                    continue
+                path = _bom_path(product_path, part_key)
+                label = self.db.part_label(part_key)
+                if self._part_known(part_key):
+                    issues.append(_issue(
+                        "missing_part", path, f"'{label}' has no stock entry", {f"inventory/{part_key}": increment(0)}
+                    ))
+                else:
+                    issues.append(_issue("unknown_part", path, f"'{label}' is not in the catalogue"))
+        return issues
+
+    def _check_locations(self, stock, shards, keys):
+        issues = []
+        for key in keys:
+            issues.extend(check_location_sum(key, stock.get(key, 0), shards.get(key, {}), self.default_location))
+        return issues
+
+    def _check_product_eans(self, product_names, mappings):
+        issues = []
+        for ean, value in mappings:
+            name = value.get("name") if isinstance(value, dict) else None
+            if name not in product_names:
+                issues.append(_issue(
+                    "orphan_product_ean", f"product_ean_codes/{ean}", f"points to missing product {name!r}",
+                    {f"product_ean_codes/{ean}": None},
+                ))
+        return issues
+
+    def _check_part_eans(self, inventory_keys, mappings):
+        issues = []
+        for ean, value in mappings:
+            value = value if isinstance(value, dict) else {}
+            part_id = value.get("part_id")
+            if part_id is not None:
+                known = part_id in self.db.catalogue.parts
+            else:
+                key = self.db.part_key(value.get("name") or "", create=False)
+                known = self._part_known(key) or key in inventory_keys
+            if not known:
+                issues.append(_issue(
+                    "orphan_part_ean", f"ean_codes/{ean}", f"points to unknown part {value.get('name')!r}"
+                ))
+        return issues
+
+    # ---- runs ----------------------------------------------------------
+    def _stock_changes_path(self):
+        return COUNTER_CHANGES_PATH if self.db.counters else "changes/inventory"
+
+    def _high_water(self):
+        stamps = [
+            self.db.newest_stamp(self._stock_changes_path()),
+            self.db.newest_stamp("products", "updated_at"),
+            self.db.newest_stamp("changes/products"),
+        ]
+        if self.db.schema.mode() != schema.MODE_LEGACY:
+            stamps.append(self.db.newest_stamp(schema.PRODUCTS_PATH, "u"))
+        return max(stamps)
+
+    def run(self):
+        """Full check of every tree. Returns the list of issues."""
+        started = time.perf_counter()
+        high_water = self._high_water()
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            inventory_future = pool.submit(self._scan_inventory)
+            products_future = pool.submit(self._scan_products)
+            product_eans_future = pool.submit(self._scan_map, "product_ean_codes")
+            part_eans_future = pool.submit(self._scan_map, "ean_codes")
+            locations_future = pool.submit(self._scan_locations) if self.default_location else None
+
+            stock, issues = inventory_future.result()
+            inventory_keys = set(stock)
+            boms, product_issues = products_future.result()
+            issues.extend(product_issues)
+            product_names = set(boms)
+
+            jobs = [pool.submit(self._check_boms, inventory_keys, chunk)
+                    for chunk in _chunks(boms.items(), self.chunk_size)]
+            jobs += [pool.submit(self._check_product_eans, product_names, chunk)
+                     for chunk in _chunks(product_eans_future.result().items(), self.chunk_size)]
+            jobs += [pool.submit(self._check_part_eans, inventory_keys, chunk)
+                     for chunk in _chunks(part_eans_future.result().items(), self.chunk_size)]
+            if locations_future:
+                shards = locations_future.result()
+                jobs += [pool.submit(self._check_locations, stock, shards, chunk)
+                         for chunk in _chunks(inventory_keys | set(shards), self.chunk_size)]
+            for job in jobs:
+                issues.extend(job.result())
+
+        backend.reference(STATE_PATH).set(high_water)
+        logger.info(
+            "Integrity check (full): %d issues in %d parts, %d products (%.1f s).",
+            len(issues), len(inventory_keys), len(boms), time.perf_counter() - started,
+        )
+        return issues
+
+    def run_incremental(self):
+        """Checks only what changed since the previous run (a full run the first time)."""
+        previous = backend.reference(STATE_PATH).get()
+        if not isinstance(previous, (int, float)):
+            return self.run()
+        started = time.perf_counter()
+        high_water = self._high_water()
+        since = previous - self.overlap_ms
+
+        changed_parts = backend.reference(self._stock_changes_path()).order_by_value().start_at(since).get() or {}
+        changed_products = backend.reference("products").order_by_child("updated_at").start_at(since).get() or {}
+        deleted_products = backend.reference("changes/products").order_by_value().start_at(since).get() or {}
+
+        changed = {
+            name: (f"products/{name}", node) for name, node in changed_products.items() if isinstance(node, dict)
+        }
+        if self.db.schema.mode() != schema.MODE_LEGACY:
+            compact = backend.reference(schema.PRODUCTS_PATH).order_by_child("u").start_at(since).get() or {}
+            changed.update({
+                node["n"]: (f"{schema.PRODUCTS_PATH}/{pid}", schema.legacy_view(node))
+                for pid, node in compact.items() if schema.is_product(node)
+            })
+
+        issues = []
+        boms = {}
+        for name, (path, node) in changed.items():
+            parts = node.get("parts")
+            boms[name] = (path, parts if isinstance(parts, dict) else {})
+            issues.extend(check_product(name, node, path))
+
+        # Stock of changed parts and of every part the changed BOMs use
+        keys = sorted(set(changed_parts) | {key for _, parts in boms.values() for key in parts})
+        values = self.db.read_stock(keys)
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            gone = [name for name in deleted_products if name not in changed_products]
+            orphaned = pool.map(
+                lambda name: backend.reference("product_ean_codes").order_by_child("name").equal_to(name).get() or {},
+                gone,
+            )
+            for mappings in orphaned:
+                issues.extend(self._check_product_eans(set(), mappings.items()))
+
+        for key in changed_parts:
+            if values.get(key) is not None:
+                issues.extend(check_stock(key, values[key]))
+        inventory_keys = {key for key, value in values.items() if value is not None}
+        issues.extend(self._check_boms(inventory_keys, boms.items()))
+
+        backend.reference(STATE_PATH).set(high_water)
+        logger.info(
+            "Integrity check (incremental): %d issues in %d changed parts, %d changed and %d deleted products (%.1f s).",
+            len(issues), len(changed_parts), len(changed), len(deleted_products),
+            time.perf_counter() - started,
+        )
+        return issues
+
+
+def merge_repair(plan, repair):
+    """Adds `repair` entries to `plan`; increments of one path add up."""
+    for path, value in repair.items():
+        delta, previous = increment_of(value), increment_of(plan.get(path))
+        plan[path] = increment(previous + delta) if delta is not None and previous is not None else value
+    return plan
+
+
+def repair_plan(issues):
+    """Merges the repairs of `issues` into one {path: value} multi-path update."""
+    plan = {}
+    for issue in issues:
+        merge_repair(plan, issue.get("repair") or {})
+    return plan
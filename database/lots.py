@@ -0,0 +1,370 @@
+import heapq
+import time
+import uuid
+import logging
+import threading
+from datetime import date
+
+from database import backend
+from database.backend import SERVER_TIMESTAMP
+
+logger = logging.getLogger(__name__)
+
+# -------------------------------------------------------------------------
+#                  LOTS (BATCH TRACKING) WITH FIFO / FEFO
+# -------------------------------------------------------------------------
+#   /lots/parts/<part_key>/<lot_id>      {"received_at", "expires", "received",
+#                                         "quantity" (remaining), "delivery" | "returned_from"}
+#   /lots/products/<product>/<build_id>  {"built_at", "built", "quantity" (not shipped yet),
+#                                         "parts": {<part_key>: {<lot_id>: qty}}}
+#   /lots/shipments/<shipment_id>        {"product", "quantity", "shipped_at", "builds": {<build_id>: qty}}
+#   /lots/usage/<part_key>/<lot_id>/<build_id>   {"product", "quantity"}  (where-used index)
+#   /lots/shipped/<build_id>/<shipment_id>       qty                      (where-shipped index)
+#   /lot_versions/<kind>/<item>          write counter of an item's lots
+#
+# /inventory stays the stock of record; lots say which delivery the units
+# came from. Every delivery line opens a lot, builds consume part lots and
+# open a build lot of the product, shipments consume build lots. Each item
+# keeps its open lots in a heap ordered by (expiry, receipt time): dated
+# lots go first-expired-first-out, undated ones first-in-first-out, and a
+# consumption costs O(log n) per lot it touches. The heaps stay in memory
+# and are only re-read when the item's version counter shows that another
+# station changed its lots. Lot quantities are server-side increments, so
+# concurrent writers never lose units; two stations taking the last units
+# of one lot at the same moment overdraw it, and a negative lot is simply
+# not loaded again. Units that no lot covers (stock older than lot
+# tracking) are booked as "untracked". Loading open lots needs
+# ".indexOn": "quantity" on /lots/parts/$part and /lots/products/$product.
+LOTS_PATH = "lots"
+VERSIONS_PATH = "lot_versions"
+UNTRACKED = "untracked"
+FAR_FUTURE = "9999-12-31"
+
+
+def new_lot_id(prefix):
+    return prefix + time.strftime("%Y%m%d-%H%M%S") + "-" + uuid.uuid4().hex[:6]
+
+
+def _part_priority(node):
+    return node.get("expires") or FAR_FUTURE, node.get("received_at") or 0
+
+
+def _build_priority(node):
+    return "", node.get("built_at") or 0
+
+
+class LotQueue:
+    """Open lots of one item as a min-heap; take() serves them from the front."""
+
+    def __init__(self, lots, priority):
+        self.priority = priority
+        self.nodes = {lot_id: node for lot_id, node in lots.items() if isinstance(node, dict)}
+        self.remaining = {
+            lot_id: node.get("quantity", 0) for lot_id, node in self.nodes.items() if node.get("quantity", 0) > 0
+        }
+        self.heap = [(priority(self.nodes[lot_id]), lot_id) for lot_id in self.remaining]
+        heapq.heapify(self.heap)
+
+    def __len__(self):
+        return len(self.remaining)
+
+    def push(self, lot_id, node):
+        self.nodes[lot_id] = node
+        self.remaining[lot_id] = self.remaining.get(lot_id, 0) + node["quantity"]
+        heapq.heappush(self.heap, (self.priority(node), lot_id))
+
+    def take(self, quantity):
+        """Consumes `quantity` from the front lots. Returns ([(lot_id, taken)], shortfall)."""
+        taken = []
+        while quantity > 0 and self.heap:
+            lot_id = self.heap[0][1]
+            available = self.remaining.get(lot_id, 0)
+            used = min(available, quantity)
+            if used:
+                taken.append((lot_id, used))
+                quantity -= used
+            if used == available:
+                heapq.heappop(self.heap)
+                self.remaining.pop(lot_id, None)
+            else:
+                self.remaining[lot_id] = available - used
+        return taken, quantity
+
+    def ordered(self):
+        """Open lots in consumption order (for display)."""
+        return [
+            {"lot": lot_id, **self.nodes[lot_id], "quantity": self.remaining[lot_id]}
+            for _, lot_id in sorted(self.heap) if lot_id in self.remaining
+        ]
+
+
+class LotBook:
+    """In-memory lot heaps of one station, refreshed by the items' version counters."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.queues = {}   # (kind, item) -> (version, LotQueue)
+
+    def queue(self, kind, item):
+        """The open lots of `item` ("parts" or "products"); one small read when nothing changed."""
+        version = backend.reference(f"{VERSIONS_PATH}/{kind}/{item}").get() or 0
+        cached = self.queues.get((kind, item))
+        if cached and cached[0] == version:
+            return cached[1]
+        lots = backend.reference(f"{LOTS_PATH}/{kind}/{item}").order_by_child("quantity").start_at(1).get() or {}
+        queue = LotQueue(lots, _part_priority if kind == "parts" else _build_priority)
+        self.queues[(kind, item)] = (version, queue)
+        logger.debug("Lots of %s '%s' loaded: %d open (version %s).", kind, item, len(queue), version)
+        return queue
+
+    def push(self, kind, item, lot_id, node):
+        """Adds a new lot to a heap already in memory; a heap not loaded yet is read when first needed."""
+        cached = self.queues.get((kind, item))
+        if cached:
+            cached[1].push(lot_id, node)
+        else:
+            self.forget(kind, item)
+
+    def written(self, kind, item):
+        """Our own write bumped the version by one; the heap already reflects it."""
+        cached = self.queues.get((kind, item))
+        if cached:
+            self.queues[(kind, item)] = (cached[0] + 1, cached[1])
+
+    def forget(self, kind, item):
+        self.queues.pop((kind, item), None)
+
+
+# ---- stock of record -----------------------------------------------------
+def _write(db, book, updates, touched, deltas=None, location=None, taken=False):
+    """
+    One multi-path update of the lot records and of the stock changes
+    `deltas`, booked at `location` (station counters take the totals after it).
+    With `taken` the shard was already taken with db.take_stock and is given
+    back if the write fails.
+    """
+    deltas = {name: delta for name, delta in (deltas or {}).items() if delta}
+    touched = list(dict.fromkeys(touched))
+    for name, delta in deltas.items():
+        db.add_stock_change(updates, db.part_key(name), delta, location, taken=taken)
+    for kind, item in touched:
+        updates[f"{VERSIONS_PATH}/{kind}/{item}"] = {".sv": {"increment": 1}}
+    try:
+        backend.reference().update(updates)
+    except Exception:
+        # The heaps were changed ahead of the write; re-read them next time
+        for kind, item in touched:
+            book.forget(kind, item)
+        if taken:
+            db.return_stock({name: -delta for name, delta in deltas.items() if delta < 0}, location)
+        raise
+    for kind, item in touched:
+        book.written(kind, item)
+    for name, delta in deltas.items():
+        db.stock_changed(name, delta, location, sync=False)
+    db.sync_counters(deltas)
+
+
+# ---- deliveries, builds, shipments ---------------------------------------
+def receive(db, deltas, expires=None, delivery_id=None, location=None):
+    """
+    Books a delivery {part_name: quantity}: the stock and one lot per part.
+    `expires` is {part_name: "YYYY-MM-DD"} for dated parts. Returns {part_name: lot_id}.
+    """
+    book = db.lot_book
+    expires = expires or {}
+    delivery_id = delivery_id or new_lot_id("D")
+    updates, lot_ids, touched = {}, {}, []
+    with book.lock:
+        for name, quantity in deltas.items():
+            if quantity <= 0:
+                continue
+            key = db.part_key(name)
+            lot_id = f"{delivery_id}-{key}"
+            node = {
+                "received_at": int(time.time() * 1000), "expires": expires.get(name),
+                "received": quantity, "quantity": quantity, "delivery": delivery_id,
+            }
+            updates[f"{LOTS_PATH}/parts/{key}/{lot_id}"] = {**node, "received_at": SERVER_TIMESTAMP}
+            book.push("parts", key, lot_id, node)
+            lot_ids[name] = lot_id
+            touched.append(("parts", key))
+        _write(db, book, updates, touched, deltas, location)
+    logger.info("Delivery '%s': %d lots opened.", delivery_id, len(lot_ids))
+    return lot_ids
+
+
+def build(db, product_name, units, bom, build_id=None):
+    """
+    Builds `units` of a product with BOM {part_name: per_unit}: takes the parts
+    from their lots FIFO/FEFO, deducts the stock and opens a build lot. The
+    parts are taken off the station's location first, so a build never takes
+    more than is there (ValueError, nothing written).
+    Returns {"build_id", "parts": {part_name: {lot_id: qty}}, "expired": [lot ids past expiry]}.
+    """
+    book = db.lot_book
+    build_id = build_id or new_lot_id("B")
+    today = date.today().isoformat()
+    updates, touched, used, expired, deltas = {}, [], {}, [], {}
+    needs = {name: units * per_unit for name, per_unit in bom.items() if units * per_unit > 0}
+    location = db.take_stock(needs)
+    with book.lock:
+        try:
+            for name, required in needs.items():
+                key = db.part_key(name)
+                touched.append(("parts", key))
+                queue = book.queue("parts", key)
+                taken, shortfall = queue.take(required)
+                allocation = dict(taken)
+                for lot_id, quantity in taken:
+                    updates[f"{LOTS_PATH}/parts/{key}/{lot_id}/quantity"] = {".sv": {"increment": -quantity}}
+                    updates[f"{LOTS_PATH}/usage/{key}/{lot_id}/{build_id}"] = {"product": product_name, "quantity": quantity}
+                    if (queue.nodes[lot_id].get("expires") or FAR_FUTURE) < today:
+                        expired.append(lot_id)
+                if shortfall:
+                    allocation[UNTRACKED] = shortfall
+                used[name] = allocation
+                deltas[name] = -required
+            node = {
+                "built_at": int(time.time() * 1000), "built": units, "quantity": units,
+                "parts": {db.part_key(name): allocation for name, allocation in used.items()},
+            }
+            updates[f"{LOTS_PATH}/products/{product_name}/{build_id}"] = {**node, "built_at": SERVER_TIMESTAMP}
+            book.push("products", product_name, build_id, node)
+            touched.append(("products", product_name))
+        except Exception:
+            # Nothing written yet: the parts go back and the heaps are re-read
+            db.return_stock(needs, location)
+            for kind, item in touched:
+                book.forget(kind, item)
+            raise
+        _write(db, book, updates, touched, deltas, location, taken=True)
+    if expired:
+        logger.warning("Build '%s' of '%s' used expired lots: %s", build_id, product_name, ", ".join(expired))
+    logger.info("Build '%s': %d x '%s' from %d parts.", build_id, units, product_name, len(used))
+    return {"build_id": build_id, "parts": used, "expired": expired}
+
+
+def _take_builds(db, book, product_name, units, updates):
+    queue = book.queue("products", product_name)
+    taken, shortfall = queue.take(units)
+    for build_id, quantity in taken:
+        updates[f"{LOTS_PATH}/products/{product_name}/{build_id}/quantity"] = {".sv": {"increment": -quantity}}
+    builds = dict(taken)
+    if shortfall:
+        builds[UNTRACKED] = shortfall
+    return builds
+
+
+def ship(db, product_name, units, shipment_id=None):
+    """Records a shipment of `units`, taken from the product's build lots FIFO. Returns the shipment ID."""
+    book = db.lot_book
+    shipment_id = shipment_id or new_lot_id("S")
+    updates = {}
+    with book.lock:
+        builds = _take_builds(db, book, product_name, units, updates)
+        updates[f"{LOTS_PATH}/shipments/{shipment_id}"] = {
+            "product": product_name, "quantity": units, "shipped_at": SERVER_TIMESTAMP, "builds": builds,
+        }
+        for build_id, quantity in builds.items():
+            if build_id != UNTRACKED:
+                updates[f"{LOTS_PATH}/shipped/{build_id}/{shipment_id}"] = quantity
+        _write(db, book, updates, [("products", product_name)])
+    logger.info("Shipment '%s': %d x '%s' from %d builds.", shipment_id, units, product_name, len(builds))
+    return shipment_id
+
+
+def dismantle(db, product_name, units, bom, return_parts=False, close=False, updates=None):
+    """
+    Takes `units` of a product out of its build lots (scrapped or taken apart).
+    With `return_parts` the parts go back to stock as return lots, dated like
+    the earliest-expiring lot they were built from. `close` also empties the
+    build lots left open (the product is deleted); `updates` are written in
+    the same multi-path update. Returns the builds taken.
+    """
+    book = db.lot_book
+    updates, touched, deltas = dict(updates or {}), [("products", product_name)], {}
+    with book.lock:
+        builds = _take_builds(db, book, product_name, units, updates)
+        if close:
+            queue = book.queue("products", product_name)
+            for build_id, quantity in queue.take(sum(queue.remaining.values()))[0]:
+                quantity += builds.get(build_id, 0)  # the same lot's path, so one increment for both
+                updates[f"{LOTS_PATH}/products/{product_name}/{build_id}/quantity"] = {".sv": {"increment": -quantity}}
+        if return_parts:
+            queue = book.queue("products", product_name)
+            sources = [queue.nodes[build_id] for build_id in builds if build_id in queue.nodes]
+            return_id = new_lot_id("R")
+            for name, per_unit in bom.items():
+                quantity = units * per_unit
+                if quantity <= 0:
+                    continue
+                key = db.part_key(name)
+                dates = [
+                    backend.reference(f"{LOTS_PATH}/parts/{key}/{lot_id}/expires").get()
+                    for source in sources for lot_id in (source.get("parts") or {}).get(key, {})
+                    if lot_id != UNTRACKED
+                ]
+                node = {
+                    "received_at": int(time.time() * 1000), "expires": min(filter(None, dates), default=None),
+                    "received": quantity, "quantity": quantity, "returned_from": sorted(builds),
+                }
+                lot_id = f"{return_id}-{key}"
+                updates[f"{LOTS_PATH}/parts/{key}/{lot_id}"] = {**node, "received_at": SERVER_TIMESTAMP}
+                book.push("parts", key, lot_id, node)
+                touched.append(("parts", key))
+                deltas[name] = quantity
+        _write(db, book, updates, touched, deltas)
+    logger.info("%d x '%s' taken out of builds %s (parts returned: %s).",
+                units, product_name, ", ".join(builds), return_parts)
+    return builds
+
+
+# ---- traceability --------------------------------------------------------
+def open_lots(db, part_name):
+    """Open lots of a part in the order they will be consumed."""
+    with db.lot_book.lock:
+        return db.lot_book.queue("parts", db.part_key(part_name, create=False)).ordered()
+
+
+def trace_build(db, product_name, build_id):
+    """The part lots a build was made from: [{"part", "lot", "quantity", "expires", "delivery"}]."""
+    node = backend.reference(f"{LOTS_PATH}/products/{product_name}/{build_id}").get()
+    if not isinstance(node, dict):
+        raise ValueError(f"Build '{build_id}' of '{product_name}' does not exist.")
+    rows = []
+    for key, allocation in (node.get("parts") or {}).items():
+        for lot_id, quantity in allocation.items():
+            lot = backend.reference(f"{LOTS_PATH}/parts/{key}/{lot_id}").get() if lot_id != UNTRACKED else None
+            lot = lot if isinstance(lot, dict) else {}
+            rows.append({
+                "part": db.part_label(key), "lot": lot_id, "quantity": quantity,
+                "expires": lot.get("expires"), "delivery": lot.get("delivery") or lot.get("returned_from"),
+            })
+    return {"product": product_name, "build_id": build_id, "built_at": node.get("built_at"),
+            "built": node.get("built"), "parts": rows}
+
+
+def trace_shipment(db, shipment_id):
+    """Shipment -> builds -> part lots."""
+    node = backend.reference(f"{LOTS_PATH}/shipments/{shipment_id}").get()
+    if not isinstance(node, dict):
+        raise ValueError(f"Shipment '{shipment_id}' does not exist.")
+    builds = [
+        {**trace_build(db, node["product"], build_id), "shipped": quantity}
+        for build_id, quantity in (node.get("builds") or {}).items() if build_id != UNTRACKED
+    ]
+    return {"shipment_id": shipment_id, "product": node["product"], "quantity": node["quantity"],
+            "untracked": (node.get("builds") or {}).get(UNTRACKED, 0), "builds": builds}
+
+
+def where_used(db, part_name, lot_id):
+    """Builds made with a part lot and the shipments they went out in (recalls)."""
+    key = db.part_key(part_name, create=False)
+    usage = backend.reference(f"{LOTS_PATH}/usage/{key}/{lot_id}").get() or {}
+    rows = []
+    for build_id, entry in sorted(usage.items()):
+        shipped = backend.reference(f"{LOTS_PATH}/shipped/{build_id}").get() or {}
+        rows.append({"build_id": build_id, "product": entry.get("product"), "quantity": entry.get("quantity"),
+                     "shipments": shipped})
+    return rows
@@ -0,0 +1,285 @@
+import copy
+import json
+import time
+import hashlib
+import threading
+from collections import Counter
+
+from firebase_admin.db import TransactionAbortedError
+
+# -------------------------------------------------------------------------
+#                 IN-MEMORY REALTIME DATABASE (LOCAL BACKEND)
+# -------------------------------------------------------------------------
+# Implements the part of the firebase_admin.db Reference API this app uses
+# (get/set/update/delete, multi-path updates with server values, ETags,
+# transactions, ordered queries) over a dict tree, so several stations
+# can be simulated in one process without a Firebase project. `latency`
+# adds a simulated round-trip per request; the effect of a request lands in
+# the middle of it, which is what makes read-modify-write races show up.
+TRANSACTION_RETRIES = 25
+
+
+def _split(path):
+    return [part for part in (path or "").split("/") if part]
+
+
+def _normalize(value):
+    """Firebase does not store nulls or empty objects."""
+    if isinstance(value, dict):
+        cleaned = {}
+        for key, child in value.items():
+            child = _normalize(child)
+            if child is not None:
+                cleaned[str(key)] = child
+        return cleaned or None
+    if isinstance(value, (list, tuple)):
+        return _normalize({str(i): v for i, v in enumerate(value)})
+    return value
+
+
+def _etag(value):
+    return hashlib.md5(json.dumps(value, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def _key_order(key):
+    # Integer-like keys sort first (numerically), then the rest lexicographically
+    return (0, int(key), "") if key.isdigit() else (1, 0, key)
+
+
+def _value_order(value):
+    # Realtime Database ordering: null, false, true, numbers, strings, objects
+    if value is None:
+        return (0, 0, "")
+    if isinstance(value, bool):
+        return (1, int(value), "")
+    if isinstance(value, (int, float)):
+        return (2, value, "")
+    if isinstance(value, str):
+        return (3, 0, value)
+    return (4, 0, "")
+
+
+class MemoryBackend:
+    """A Realtime Database tree held in memory; thread-safe."""
+
+    def __init__(self, data=None, latency=0.0):
+        self.root = _normalize(copy.deepcopy(data)) or {}
+        self.latency = latency
+        self.lock = threading.RLock()
+        self.stats = Counter()   # requests by kind, plus etag_conflicts / transaction_retries
+
+    def reference(self, path="/"):
+        return MemoryReference(self, _split(path))
+
+    # ---- tree access (callers hold the lock) ----------------------------
+    def _round_trip(self):
+        if self.latency:
+            time.sleep(self.latency / 2)
+
+    def _get(self, parts):
+        node = self.root
+        for part in parts:
+            if not isinstance(node, dict) or part not in node:
+                return None
+            node = node[part]
+        return node
+
+    def _set(self, parts, value):
+        value = _normalize(value)
+        if not parts:
+            self.root = value if isinstance(value, dict) else {}
+            return
+        path = [self.root]
+        node = self.root
+        for part in parts[:-1]:
+            child = node.get(part)
+            if not isinstance(child, dict):
+                if value is None:
+                    return
+                child = node[part] = {}
+            node = child
+            path.append(node)
+        if value is None:
+            node.pop(parts[-1], None)
+            # Remove parents left empty
+            for depth in range(len(path) - 1, 0, -1):
+                if path[depth]:
+                    break
+                del path[depth - 1][parts[depth - 1]]
+        else:
+            node[parts[-1]] = value
+
+    def _resolve(self, value, current):
+        """Replaces server values ({".sv": ...}) against the current data."""
+        if isinstance(value, dict):
+            server_value = value.get(".sv")
+            if server_value == "timestamp":
+                return int(time.time() * 1000)
+            if isinstance(server_value, dict) and "increment" in server_value:
+                base = current if isinstance(current, (int, float)) and not isinstance(current, bool) else 0
+                return base + server_value["increment"]
+            current = current if isinstance(current, dict) else {}
+            return {key: self._resolve(child, current.get(key)) for key, child in value.items()}
+        return value
+
+    # ---- requests ------------------------------------------------------
+    def request(self, kind, operation):
+        """Runs `operation` atomically, halfway through a simulated round-trip."""
+        self._round_trip()
+        with self.lock:
+            self.stats[kind] += 1
+            result = operation()
+        self._round_trip()
+        return result
+
+    def snapshot(self):
+        with self.lock:
+            return copy.deepcopy(self.root)
+
+
+class MemoryReference:
+    def __init__(self, backend, parts):
+        self._backend = backend
+        self._parts = parts
+
+    @property
+    def key(self):
+        return self._parts[-1] if self._parts else None
+
+    @property
+    def path(self):
+        return "/" + "/".join(self._parts)
+
+    @property
+    def parent(self):
+        return MemoryReference(self._backend, self._parts[:-1]) if self._parts else None
+
+    def child(self, path):
+        return MemoryReference(self._backend, self._parts + _split(path))
+
+    def get(self, etag=False, shallow=False):
+        backend = self._backend
+
+        def read():
+            value = copy.deepcopy(backend._get(self._parts))
+            if shallow and isinstance(value, dict):
+                value = {key: True if isinstance(child, dict) else child for key, child in value.items()}
+            return (value, _etag(value)) if etag else value
+
+        return backend.request("get", read)
+
+    def set(self, value):
+        backend = self._backend
+        backend.request("set", lambda: backend._set(self._parts, backend._resolve(value, backend._get(self._parts))))
+
+    def update(self, value):
+        if not isinstance(value, dict) or not value:
+            raise ValueError("Value argument must be a non-empty dictionary.")
+        backend = self._backend
+
+        def write():
+            # Every path of a multi-path update is applied under one lock: all or nothing
+            for path, child in value.items():
+                parts = self._parts + _split(path)
+                backend._set(parts, backend._resolve(child, backend._get(parts)))
+
+        backend.request("update", write)
+
+    def delete(self):
+        backend = self._backend
+        backend.request("delete", lambda: backend._set(self._parts, None))
+
+    def set_if_unchanged(self, expected_etag, value):
+        backend = self._backend
+
+        def write():
+            current = backend._get(self._parts)
+            if _etag(current) != expected_etag:
+                backend.stats["etag_conflicts"] += 1
+                return False, copy.deepcopy(current), _etag(current)
+            backend._set(self._parts, backend._resolve(value, current))
+            stored = copy.deepcopy(backend._get(self._parts))
+            return True, stored, _etag(stored)
+
+        return backend.request("set_if_unchanged", write)
+
+    def transaction(self, transaction_update):
+        """Optimistic like the real client: read, compute, compare-and-set, retry."""
+        for _ in range(TRANSACTION_RETRIES):
+            value, etag = self.get(etag=True)
+            new_value = transaction_update(value)
+            success, stored, _ = self.set_if_unchanged(etag, new_value)
+            if success:
+                return stored
+            self._backend.stats["transaction_retries"] += 1
+        raise TransactionAbortedError("Transaction aborted after failed retries.")
+
+    def order_by_key(self):
+        return MemoryQuery(self)
+
+    def order_by_value(self):
+        return MemoryQuery(self, by_value=True)
+
+    def order_by_child(self, path):
+        return MemoryQuery(self, child=_split(path))
+
+
+class MemoryQuery:
+    """Ordered queries (by key, value or child): start_at / end_at / equal_to / limit_to_first / limit_to_last."""
+
+    def __init__(self, reference, by_value=False, child=None):
+        self._reference = reference
+        self._by_value = by_value
+        self._child = child
+        self._start = None
+        self._end = None
+        self._limit_first = None
+        self._limit_last = None
+
+    def start_at(self, start):
+        self._start = start
+        return self
+
+    def end_at(self, end):
+        self._end = end
+        return self
+
+    def equal_to(self, value):
+        self._start = self._end = value
+        return self
+
+    def limit_to_first(self, limit):
+        self._limit_first = limit
+        return self
+
+    def limit_to_last(self, limit):
+        self._limit_last = limit
+        return self
+
+    def _sort_value(self, data, key):
+        if self._by_value:
+            return _value_order(data[key])
+        if self._child is not None:
+            node = data[key]
+            for part in self._child:
+                node = node.get(part) if isinstance(node, dict) else None
+            return _value_order(node)
+        return _key_order(key)
+
+    def _bound(self, bound):
+        return _value_order(bound) if self._by_value or self._child is not None else _key_order(str(bound))
+
+    def get(self):
+        data = self._reference.get()
+        if not isinstance(data, dict):
+            return {}
+        keys = sorted(data, key=lambda k: (self._sort_value(data, k), _key_order(k)))
+        if self._start is not None:
+            keys = [k for k in keys if self._sort_value(data, k) >= self._bound(self._start)]
+        if self._end is not None:
+            keys = [k for k in keys if self._sort_value(data, k) <= self._bound(self._end)]
+        if self._limit_first is not None:
+            keys = keys[:self._limit_first]
+        if self._limit_last is not None:
+            keys = keys[-self._limit_last:]
+        return {key: data[key] for key in keys}
@@ -0,0 +1,457 @@
+import json
+import time
+import base64
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from database import backend
+from database.backend import SERVER_TIMESTAMP
+from database.catalogue import PartCatalogue
+
+logger = logging.getLogger(__name__)
+
+# -------------------------------------------------------------------------
+#              COMPACT PRODUCT SCHEMA (v2) AND ONLINE MIGRATION
+# -------------------------------------------------------------------------
+# Schema 1 keeps products under their display name, every node repeating
+# the name and the long field names, and EAN -> product needs
+# /product_ean_codes and /products (two reads). Schema 2:
+#
+#   /schema                  {"version": 1|2, "migration": {"state": "running"|"done",
+#                             "started_at", "finished_at", "cursor", "migrated"}}
+#   /products_v2/<id>        {"n": name, "q": quantity,
+#                             "b": [part_id, per_unit, part_id, per_unit, ...], "u": stamp}
+#                            a deleted product leaves {"n": name, "d": stamp, "u": stamp}
+#   /product_index/<id>      {"n": name, "e": {<ean>: true, ...}}
+#   /product_eans/<ean>      <id>
+#
+# IDs are "P" + 10 base32 characters of the SHA-1 of the name: derived, not
+# allocated, so a station and the migrator converting the same product at
+# the same time agree on where it goes without a lock or a counter. The
+# BOM is a flat list of catalogue part IDs and quantities (an object with
+# small integer keys would come back from Firebase as an array anyway).
+# The EANs live in the index only, so a station resolves EAN -> product
+# from its local copy and reads only the product node. Every EAN is its own
+# child of the entry plus one key of /product_eans, so adding an EAN is a
+# write of those two keys that never touches the EANs other stations added,
+# and an EAN the local copy does not know is two direct reads (map, entry).
+# Deletions are tombstones stamped like any change, so delta sync needs one
+# query ("u") instead of two, and a late migration of the same product
+# cannot resurrect it. Firebase rules need ".indexOn": "u" on /products_v2.
+#
+# Migration is online: the migrator marks it running, waits until every
+# station has re-read /schema (dual mode), then streams /products page by
+# page. Each product is created in /products_v2 by a transaction that
+# keeps a node already there (a station migrates a product itself before
+# writing it in dual mode, and its write must win), then one multi-path
+# update per batch writes the index entries and removes the legacy nodes
+# and their /product_ean_codes mappings. In dual mode stations read
+# /products_v2 first and fall back to /products; at the end /schema
+# version 2 switches them to the compact tree only.
+SCHEMA_PATH = "schema"
+PRODUCTS_PATH = "products_v2"
+INDEX_PATH = "product_index"
+EAN_INDEX_PATH = "product_eans"
+LEGACY_VERSION = 1
+COMPACT_VERSION = 2
+MODE_LEGACY = "legacy"
+MODE_DUAL = "dual"
+MODE_COMPACT = "compact"
+# Stations re-read /schema at most this often (until it says version 2)
+SCHEMA_REFRESH_S = 10
+# The migrator waits this long after announcing the migration before moving anything
+MIGRATION_GRACE_S = 3 * SCHEMA_REFRESH_S
+MIGRATION_BATCH_SIZE = 200
+MIGRATION_WORKERS = 8
+ID_PREFIX = "P"
+ID_LENGTH = 10
+
+
+def product_id(name):
+    """Storage ID of the product called `name`."""
+    digest = base64.b32encode(hashlib.sha1(name.encode("utf-8")).digest()).decode("ascii")
+    return ID_PREFIX + digest[:ID_LENGTH].lower()
+
+
+def split_eans(value):
+    """EANs of an index entry's "e": per-EAN children (or the space-separated form of early entries)."""
+    if isinstance(value, dict):
+        return list(value)
+    return value.split() if isinstance(value, str) else []
+
+
+def is_product(node):
+    return isinstance(node, dict) and "n" in node and "d" not in node
+
+
+def is_tombstone(node):
+    return isinstance(node, dict) and "d" in node
+
+
+# ---- encoding ------------------------------------------------------------
+def encode_bom(db, parts):
+    """{part label or storage key: per unit} -> [part_id, per_unit, ...] sorted by ID."""
+    pairs = []
+    for name, per_unit in (parts or {}).items():
+        part_id = db.catalogue.id_from_key(db.part_key(name))
+        if part_id is None:
+            raise ValueError(f"Part '{name}' is not in the part catalogue.")
+        pairs.append((part_id, per_unit))
+    return [value for pair in sorted(pairs) for value in pair]
+
+
+def decode_bom(value):
+    """[part_id, per_unit, ...] -> {"p<id>": per_unit}."""
+    if isinstance(value, dict):   # an array as stored, {"0": ..., "1": ...}
+        value = [item for _, item in sorted((int(k), v) for k, v in value.items() if str(k).isdigit())]
+    if not isinstance(value, list):
+        return {}
+    return {
+        PartCatalogue.key(value[i]): value[i + 1]
+        for i in range(0, len(value) - 1, 2)
+        if isinstance(value[i], int)
+    }
+
+
+def encode_product(db, name, quantity, parts):
+    node = {"n": name, "q": quantity, "u": SERVER_TIMESTAMP}
+    bom = encode_bom(db, parts)
+    if bom:
+        node["b"] = bom
+    return node
+
+
+def index_entry(name, eans=()):
+    entry = {"n": name}
+    eans = dict.fromkeys(ean for ean in eans if ean)
+    if eans:
+        entry["e"] = {ean: True for ean in eans}
+    return entry
+
+
+def index_updates(pid, name, eans=()):
+    """Multi-path writes adding `eans` to the index entry of `pid` (other EANs are left alone)."""
+    updates = {f"{INDEX_PATH}/{pid}/n": name}
+    for ean in dict.fromkeys(ean for ean in eans if ean):
+        updates[f"{INDEX_PATH}/{pid}/e/{ean}"] = True
+        updates[f"{EAN_INDEX_PATH}/{ean}"] = pid
+    return updates
+
+
+def legacy_view(node, eans=()):
+    """Compact node (and the EANs from its index entry) -> the node shape of /products."""
+    eans = list(eans)
+    return {
+        "name": node["n"],
+        "ean": eans[0] if eans else None,
+        "quantity": node.get("q", 0),
+        "parts": decode_bom(node.get("b")),
+        "updated_at": node.get("u"),
+    }
+
+
+def read_product(db, name, mode):
+    """
+    (compact node or None, ETag) of the product called `name`. In dual mode a
+    product still in /products is moved first (it is about to be written,
+    and writes only go to the compact tree), which costs two more reads and
+    two writes once per product.
+    """
+    ref = backend.reference(f"{PRODUCTS_PATH}/{product_id(name)}")
+    node, etag = ref.get(etag=True)
+    if mode == MODE_DUAL and not is_product(node) and not is_tombstone(node):
+        legacy = backend.reference("products").child(name).get()
+        if isinstance(legacy, dict):
+            mappings = backend.reference("product_ean_codes").order_by_child("name").equal_to(name).get() or {}
+            migrate_one(db, name, legacy, list(mappings))
+            node, etag = ref.get(etag=True)
+    if not is_product(node):
+        return None, etag
+    if node["n"] != name:
+        logger.error("Product ID %s belongs to '%s', not '%s'.", product_id(name), node["n"], name)
+        return None, etag
+    return node, etag
+
+
+# ---- schema state --------------------------------------------------------
+class SchemaState:
+    """Cached /schema: which product trees this station reads and writes."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = LEGACY_VERSION
+        self.migration = {}
+        self.fetched_at = 0
+
+    def refresh(self):
+        node = backend.reference(SCHEMA_PATH).get()
+        node = node if isinstance(node, dict) else {}
+        with self.lock:
+            self.version = node.get("version") or LEGACY_VERSION
+            self.migration = node.get("migration") if isinstance(node.get("migration"), dict) else {}
+            self.fetched_at = time.time()
+        return node
+
+    def mode(self):
+        """MODE_LEGACY, MODE_DUAL (migration running) or MODE_COMPACT."""
+        if self.version < COMPACT_VERSION and time.time() - self.fetched_at > SCHEMA_REFRESH_S:
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.warning("Could not read the schema version, keeping '%s': %s", self._mode(), e)
+                self.fetched_at = time.time()
+        return self._mode()
+
+    def _mode(self):
+        if self.version >= COMPACT_VERSION:
+            return MODE_COMPACT
+        return MODE_DUAL if self.migration.get("state") == "running" else MODE_LEGACY
+
+
+class ProductIndex:
+    """Local copy of /product_index (ID -> name, EANs) with the reverse EAN map; loaded on first use."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.loaded = False
+        self.entries = {}   # id -> {"n", "e"}
+        self.by_ean = {}    # ean -> id
+
+    def load(self):
+        data = backend.reference(INDEX_PATH).get()
+        with self.lock:
+            self.entries.clear()
+            self.by_ean.clear()
+            for pid, entry in (data.items() if isinstance(data, dict) else ()):
+                self._put_locked(pid, entry)
+            self.loaded = True
+
+    def _put_locked(self, pid, entry):
+        if not isinstance(entry, dict) or "n" not in entry:
+            return
+        self._remove_locked(pid)
+        self.entries[pid] = entry
+        for ean in split_eans(entry.get("e")):
+            self.by_ean[ean] = pid
+
+    def _remove_locked(self, pid):
+        old = self.entries.pop(pid, None)
+        for ean in split_eans(old.get("e")) if old else ():
+            if self.by_ean.get(ean) == pid:
+                del self.by_ean[ean]
+
+    def put(self, pid, entry):
+        with self.lock:
+            self._put_locked(pid, entry)
+
+    def add(self, pid, name, eans=()):
+        """Mirrors index_updates locally: the EANs join the ones already known."""
+        with self.lock:
+            known = split_eans(self.entries.get(pid, {}).get("e"))
+            self._put_locked(pid, index_entry(name, known + list(eans)))
+
+    def remove(self, pid):
+        with self.lock:
+            self._remove_locked(pid)
+
+    def eans(self, pid):
+        entry = self.entries.get(pid)
+        return split_eans(entry.get("e")) if entry else []
+
+    def fetch(self, pids, workers=8):
+        """Re-reads the entries of `pids` (products changed by other stations)."""
+        pids = list(dict.fromkeys(pids))
+        if not pids:
+            return
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            entries = list(pool.map(lambda pid: backend.reference(f"{INDEX_PATH}/{pid}").get(), pids))
+        for pid, entry in zip(pids, entries):
+            if isinstance(entry, dict):
+                self.put(pid, entry)
+            else:
+                self.remove(pid)
+
+    def find_ean(self, ean):
+        """(id, name) of the product with `ean`, or None; two direct reads on a local miss."""
+        if not self.loaded:
+            self.load()
+        pid = self.by_ean.get(ean)
+        if pid is None:
+            found = backend.reference(f"{EAN_INDEX_PATH}/{ean}").get()
+            if isinstance(found, str):
+                self.fetch([found])
+            pid = self.by_ean.get(ean)
+        return (pid, self.entries[pid]["n"]) if pid is not None else None
+
+
+# ---- migration -----------------------------------------------------------
+def status():
+    """The /schema node ({} before any migration)."""
+    node = backend.reference(SCHEMA_PATH).get()
+    return node if isinstance(node, dict) else {}
+
+
+def migrate_one(db, name, legacy_node, eans=()):
+    """
+    Moves one legacy product to /products_v2 (a node already there wins)
+    and removes the legacy node. Returns the compact node now stored, or
+    None if the product was deleted in the compact tree meanwhile.
+    """
+    updates = {}
+    _, stored = _move(db, updates, name, legacy_node, eans)
+    backend.reference().update(updates)
+    return stored if is_product(stored) else None
+
+
+def _create_if_absent(db, name, legacy_node):
+    """
+    (ID, compact node, index entry) of `name` after creating the node from
+    `legacy_node` unless one exists (or was deleted).
+    """
+    pid = product_id(name)
+    node = encode_product(db, name, legacy_node.get("quantity", 0), legacy_node.get("parts"))
+
+    def create(current):
+        # A node written by a station in dual mode (or a tombstone) wins over the legacy copy
+        return current if is_product(current) or is_tombstone(current) else node
+
+    stored = backend.reference(f"{PRODUCTS_PATH}/{pid}").transaction(create)
+    # EANs registered in dual mode are in the index already
+    return pid, stored, backend.reference(f"{INDEX_PATH}/{pid}").get()
+
+
+def _move(db, updates, name, legacy_node, eans, created=None):
+    """Adds the index entry and the removal of the legacy data of one product to `updates`."""
+    pid, stored, entry = created or _create_if_absent(db, name, legacy_node)
+    updates[f"products/{name}"] = None
+    for ean in eans:
+        updates[f"product_ean_codes/{ean}"] = None
+    if is_product(stored):
+        # The known EANs are written again too: an early entry keeps them in one string
+        eans = (split_eans(entry.get("e")) if isinstance(entry, dict) else []) + list(eans) + [legacy_node.get("ean")]
+        updates.update(index_updates(pid, name, eans))
+        db.product_index.put(pid, index_entry(name, eans))
+    return pid, stored
+
+
+def _legacy_eans():
+    """{product name: [EANs]} from /product_ean_codes."""
+    eans = {}
+    data = backend.reference("product_ean_codes").get()
+    for ean, value in (data.items() if isinstance(data, dict) else ()):
+        if isinstance(value, dict) and value.get("name"):
+            eans.setdefault(value["name"], []).append(ean)
+    return eans
+
+
+def start_migration():
+    """Announces the migration (dual mode). Returns False if it was already running or done."""
+    def start(current):
+        current = current if isinstance(current, dict) else {}
+        if (current.get("version") or LEGACY_VERSION) >= COMPACT_VERSION or \
+                (current.get("migration") or {}).get("state") == "running":
+            return current
+        return {**current, "version": LEGACY_VERSION,
+                "migration": {"state": "running", "started_at": time.time(), "cursor": None, "migrated": 0}}
+
+    before = status()
+    after = backend.reference(SCHEMA_PATH).transaction(start)
+    return (after or {}).get("migration") != before.get("migration")
+
+
+def migrate(db, batch_size=MIGRATION_BATCH_SIZE, workers=MIGRATION_WORKERS, grace_s=MIGRATION_GRACE_S,
+            pause_s=0.0, progress=None):
+    """
+    Runs (or resumes) the online migration to schema 2 and finishes it.
+    `pause_s` between batches leaves bandwidth to the stations; `progress`
+    is called with the running total after every batch. Returns
+    {"migrated", "batches", "seconds"}.
+    """
+    started = time.perf_counter()
+    if (status().get("version") or LEGACY_VERSION) >= COMPACT_VERSION:
+        logger.info("Schema is already at version %d.", COMPACT_VERSION)
+        return {"migrated": 0, "batches": 0, "seconds": 0.0}
+    if start_migration() and grace_s > 0:
+        logger.info("Migration announced; waiting %.0f s for the stations to switch to dual mode.", grace_s)
+        time.sleep(grace_s)
+    db.schema.refresh()
+
+    eans = _legacy_eans()
+    totals = {"migrated": 0, "batches": 0}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # Stations still writing the old tree (clock or network trouble) are caught by the next pass
+        while True:
+            moved = 0
+            batch = []
+            for name, node in db.iter_children("products", batch_size):
+                if isinstance(node, dict):
+                    batch.append((name, node))
+                if len(batch) >= batch_size:
+                    moved += _migrate_batch(db, pool, batch, eans, totals, progress)
+                    batch = []
+                    if pause_s:
+                        time.sleep(pause_s)
+            if batch:
+                moved += _migrate_batch(db, pool, batch, eans, totals, progress)
+            if not moved:
+                break
+
+    backend.reference(SCHEMA_PATH).update({
+        "version": COMPACT_VERSION,
+        "migration/state": "done",
+        "migration/finished_at": time.time(),
+    })
+    db.schema.refresh()
+    totals["seconds"] = time.perf_counter() - started
+    logger.info("Migrated %d products to schema %d in %d batches (%.1f s).",
+                totals["migrated"], COMPACT_VERSION, totals["batches"], totals["seconds"])
+    return totals
+
+
+def _migrate_batch(db, pool, batch, eans, totals, progress):
+    """Converts one batch: a transaction per product, then one multi-path update."""
+    stored = list(pool.map(lambda item: _create_if_absent(db, *item), batch))
+    updates = {}
+    for (name, node), created in zip(batch, stored):
+        _move(db, updates, name, node, eans.get(name, ()), created)
+    totals["migrated"] += len(batch)
+    totals["batches"] += 1
+    updates[f"{SCHEMA_PATH}/migration/cursor"] = batch[-1][0]
+    updates[f"{SCHEMA_PATH}/migration/migrated"] = {".sv": {"increment": len(batch)}}
+    backend.reference().update(updates)
+    logger.debug("Migration batch %d: %d products, up to '%s'.", totals["batches"], len(batch), batch[-1][0])
+    if progress:
+        progress(totals["migrated"])
+    return len(batch)
+
+
+def _size(value):
+    return len(json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+
+def payload_report(db, page_size=1000):
+    """
+    Streams /products and compares what schema 1 and schema 2 store and
+    transfer per product. Returns {"products", "legacy_bytes",
+    "compact_bytes", "legacy_index_bytes", "compact_index_bytes"}.
+    """
+    eans = _legacy_eans()
+    report = dict.fromkeys(
+        ("products", "legacy_bytes", "compact_bytes", "legacy_index_bytes", "compact_index_bytes"), 0
+    )
+    for name, node in db.iter_children("products", page_size):
+        if not isinstance(node, dict):
+            continue
+        compact = encode_product(db, name, node.get("quantity", 0), node.get("parts"))
+        stamp = node.get("updated_at", 0)
+        compact["u"] = stamp if isinstance(stamp, int) else 0
+        report["products"] += 1
+        report["legacy_bytes"] += _size({name: node})
+        report["compact_bytes"] += _size({product_id(name): compact})
+        report["legacy_index_bytes"] += sum(_size({ean: {"name": name}}) for ean in eans.get(name, ()))
+        report["compact_index_bytes"] += _size(
+            {product_id(name): index_entry(name, eans.get(name, []) + [node.get("ean")])}
+        )
+    return report
@@ -0,0 +1,175 @@
+import time
+import uuid
+import logging
+
+from database import backend
+from database.backend import SERVER_TIMESTAMP
+from database.crdt import CHANGES_PATH as COUNTER_CHANGES_PATH
+
+logger = logging.getLogger(__name__)
+
+# -------------------------------------------------------------------------
+#                      STOCKTAKE (CYCLE COUNT) SESSIONS
+# -------------------------------------------------------------------------
+#   /stocktakes/<id>   {"status": "starting" | "open" | "committing" | "committed" | "superseded",
+#                       "started_at": <ms>, "station": ..., "expected": {<part_key>: qty},
+#                       "counts": {<part_key>: qty}, "committed_at": <ms>, "superseded_by": <id>}
+#   /adjustments/<id>/<part_key>   {"expected", "counted", "delta"}
+#
+# Starting a stocktake freezes the book stock (the station counters' totals
+# when they are on) and supersedes the stocktakes still open, which can no
+# longer be committed. started_at is stamped before the stock is read, so a
+# part that changes while the pages stream in shows up as moved in the diff.
+# Counts are taken as of that moment and may come from several stations
+# (scans add, imports replace).
+# The correction of a part is counted - frozen, applied as a server-side
+# increment: deliveries and builds booked while the count was running stay
+# in the stock instead of being overwritten. Parts that moved during the
+# count are flagged in the diff for a second look. Committing writes every
+# correction, its adjustment record and the closed status in one multi-path
+# update, however many parts were counted. Listing open stocktakes needs
+# ".indexOn": "status" on /stocktakes.
+STOCKTAKES_PATH = "stocktakes"
+ADJUSTMENTS_PATH = "adjustments"
+
+
+def new_stocktake_id():
+    return time.strftime("%Y%m%d-%H%M%S") + "-" + uuid.uuid4().hex[:6]
+
+
+def start(db, stocktake_id=None, page_size=1000):
+    """
+    Freezes the current stock (streamed page by page) as a new open
+    stocktake and supersedes the open ones. Returns its ID.
+    """
+    stocktake_id = stocktake_id or new_stocktake_id()
+    previous = list_open()
+    # The stamp goes first: every change from here on is newer than started_at
+    backend.reference(f"{STOCKTAKES_PATH}/{stocktake_id}").set({
+        "status": "starting",
+        "started_at": SERVER_TIMESTAMP,
+        "station": db.location or "",
+    })
+    expected = {key: value for key, value in db.iter_stock(page_size) if isinstance(value, int)}
+    backend.reference(f"{STOCKTAKES_PATH}/{stocktake_id}").update({"status": "open", "expected": expected})
+    for old_id in previous:
+        _supersede(old_id, stocktake_id)
+    logger.info("Stocktake '%s' started: %d parts frozen.", stocktake_id, len(expected))
+    return stocktake_id
+
+
+def _supersede(stocktake_id, by):
+    """Closes an open stocktake replaced by a newer one (left alone if a commit got to it first)."""
+    def close(status):
+        return "superseded" if status == "open" else status
+
+    if backend.reference(f"{STOCKTAKES_PATH}/{stocktake_id}/status").transaction(close) == "superseded":
+        backend.reference(f"{STOCKTAKES_PATH}/{stocktake_id}/superseded_by").set(by)
+        logger.info("Stocktake '%s' superseded by '%s'.", stocktake_id, by)
+
+
+def list_open():
+    """{id: started_at} of the stocktakes not yet committed."""
+    open_stocktakes = backend.reference(STOCKTAKES_PATH).order_by_child("status").equal_to("open").get() or {}
+    return {stocktake_id: node.get("started_at") for stocktake_id, node in open_stocktakes.items()}
+
+
+def record_counts(db, stocktake_id, counts, replace=False):
+    """
+    Records {part_name: counted} in one multi-path update. Scans add to what
+    other stations counted; `replace` sets the totals (file imports).
+    """
+    updates = {}
+    for name, quantity in counts.items():
+        path = f"{STOCKTAKES_PATH}/{stocktake_id}/counts/{db.part_key(name)}"
+        updates[path] = quantity if replace else {".sv": {"increment": quantity}}
+    if updates:
+        backend.reference().update(updates)
+    logger.debug("Stocktake '%s': counts recorded for %d parts.", stocktake_id, len(updates))
+    return len(updates)
+
+
+def _load(stocktake_id):
+    node = backend.reference(f"{STOCKTAKES_PATH}/{stocktake_id}").get()
+    if not isinstance(node, dict):
+        raise ValueError(f"Stocktake '{stocktake_id}' does not exist.")
+    return node
+
+
+def diff(db, stocktake_id, uncounted_as_zero=False):
+    """
+    Rows {"part", "key", "expected", "counted", "delta", "moved"} for every
+    counted part whose count differs from the frozen stock (and, with
+    `uncounted_as_zero`, for frozen parts nobody counted). "moved" is the
+    change booked since the freeze, or None if the part did not move.
+    """
+    node = _load(stocktake_id)
+    expected = node.get("expected") or {}
+    counts = dict(node.get("counts") or {})
+    if uncounted_as_zero:
+        for key in expected:
+            counts.setdefault(key, 0)
+    started_at = node.get("started_at") or 0
+    changes_path = COUNTER_CHANGES_PATH if db.counters else "changes/inventory"
+    stamped = backend.reference(changes_path).order_by_value().start_at(started_at).get() or {}
+    moved_keys = [key for key in counts if key in stamped]
+    current = db.read_stock(moved_keys)
+
+    rows = []
+    for key, counted in counts.items():
+        delta = counted - expected.get(key, 0)
+        if not delta:
+            continue
+        moved = (current[key] or 0) - expected.get(key, 0) if key in current else None
+        rows.append({
+            "part": db.part_label(key), "key": key, "expected": expected.get(key, 0),
+            "counted": counted, "delta": delta, "moved": moved or None,
+        })
+    rows.sort(key=lambda row: abs(row["delta"]), reverse=True)
+    return rows
+
+
+def commit(db, stocktake_id, uncounted_as_zero=False):
+    """
+    Applies the corrections of an open stocktake in one multi-path update
+    together with its adjustment records and closes it. Returns a summary.
+    """
+    def claim(status):
+        # Only one station gets to commit: open -> committing inside a transaction
+        return "committing" if status == "open" else status
+
+    status_ref = backend.reference(f"{STOCKTAKES_PATH}/{stocktake_id}/status")
+    if status_ref.transaction(claim) != "committing":
+        raise ValueError(f"Stocktake '{stocktake_id}' is not open.")
+    try:
+        rows = diff(db, stocktake_id, uncounted_as_zero=uncounted_as_zero)
+        updates = {
+            f"{STOCKTAKES_PATH}/{stocktake_id}/status": "committed",
+            f"{STOCKTAKES_PATH}/{stocktake_id}/committed_at": SERVER_TIMESTAMP,
+        }
+        for row in rows:
+            updates[f"{ADJUSTMENTS_PATH}/{stocktake_id}/{row['key']}"] = {
+                "expected": row["expected"], "counted": row["counted"], "delta": row["delta"],
+            }
+        for row in rows:
+            db.add_stock_change(updates, row["key"], row["delta"])
+        backend.reference().update(updates)
+    except Exception:
+        status_ref.set("open")
+        raise
+
+    # With station counters this books the totals, after the records are in
+    for row in rows:
+        db.stock_changed(row["part"], row["delta"], sync=False)
+    db.sync_counters(row["part"] for row in rows)
+    summary = {
+        "parts": len(rows),
+        "units_added": sum(row["delta"] for row in rows if row["delta"] > 0),
+        "units_removed": -sum(row["delta"] for row in rows if row["delta"] < 0),
+        "moved": sum(1 for row in rows if row["moved"]),
+    }
+    logger.info(
+        "Stocktake '%s' committed: %d corrections (+%d / -%d units).",
+        stocktake_id, summary["parts"], summary["units_added"], summary["units_removed"],
+    )
+    return summary
@@ -0,0 +1,30 @@
+import sys
+import argparse
+
+from database.db import Database
+from utils.export import DATASETS, export_dataset
+from utils.logging_config import setup_logging
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="EMAG - eksport magazynu, produktów, BOM i kodów EAN do CSV/Parquet/Arrow."
+    )
+    parser.add_argument("dataset", choices=sorted(DATASETS), help="zbiór danych do eksportu")
+    parser.add_argument("output", help="plik wynikowy (.csv, .parquet, .arrow)")
+    parser.add_argument("--format", dest="fmt", help="wymuś format (csv, parquet, arrow)")
+    parser.add_argument("--page-size", type=int, default=1000, help="liczba węzłów pobieranych na zapytanie")
+    args = parser.parse_args(argv)
+    setup_logging()
+
+    try:
+        count = export_dataset(Database(), args.dataset, args.output, fmt=args.fmt, page_size=args.page_size)
+    except Exception as e:
+        print(f"Błąd eksportu: {e}")
+        return 1
+    print(f"Wyeksportowano {count} wierszy ({args.dataset}) do '{args.output}'.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
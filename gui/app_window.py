@@ -1,11 +1,27 @@
+import os
+import logging
 import tkinter as tk
-from tkinter import messagebox, simpledialog
+from tkinter import messagebox, simpledialog, filedialog
+import time
+import threading
+from datetime import date
 import customtkinter as ctk
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-from firebase_admin import db
+from database import backend
 from controllers.product_controller import ProductController
 from database.db import Database
+from database.errors import StaleProductError
+from server.client import RemoteDatabase
+from utils.scanner import ScanSession, STATUS_KNOWN
+from utils.search_index import SearchIndex
+from gui.search_picker import SearchPicker
+from gui.bom_editor import BomEditor
+from gui.stall_monitor import StallMonitor
+from config.config import STALL_THRESHOLD_MS, DATED_CATEGORIES
+from database.aggregates import part_category
+from utils.logging_config import setup_logging, set_level, current_level, ring_buffer, LEVELS
+from utils.labels import LabelRenderer, delivery_report, order_report
 
 #
 # Optional placeholders for update logic
@@ -23,15 +39,48 @@ def install_update(zip_path):
     """Placeholder for install logic."""
     return False
 
+# How often the maintained KPIs are checked against a full recompute
+AGGREGATE_CHECK_INTERVAL_MS = 15 * 60 * 1000
+KPI_REFRESH_MS = 1000
+REMOTE_POLL_MS = 500
+# Log lines shown in the settings view
+LOG_VIEW_LINES = 500
+
+logger = logging.getLogger(__name__)
+
+
 class EMAGApp:
     def __init__(self, root):
         self.root = root
         self.root.title("EMAG - Zarządzanie Magazynem")
         self.root.geometry("1200x700")
 
-        # Controller and DB
-        self.controller = ProductController()
-        self.db = Database()  # This class interacts with Firebase
+        # UI stall watchdog: slow Tk callbacks and the database calls they made
+        self.stall_monitor = StallMonitor(root, threshold_ms=STALL_THRESHOLD_MS)
+        self.stall_monitor.start()
+
+        # Controller and DB - one Database per process, or the shared EMAG service if configured
+        service_url = os.getenv("EMAG_SERVICE_URL")
+        if service_url:
+            db = RemoteDatabase(service_url)
+        else:
+            db = Database()  # This class interacts with Firebase
+        self.db = self.stall_monitor.trace_calls(db)
+        self.controller = ProductController(self.db)
+        self.remote_changed = threading.Event()
+        self.kpi_after_id = None
+        # Labels and reports are rendered in a process pool, started on first use
+        self.renderer = LabelRenderer()
+
+        # Type-ahead indexes for the part/product pickers, kept in sync with every reload
+        self.part_index = SearchIndex()
+        self.product_index = SearchIndex()
+        self.part_eans = {}  # part name -> [EAN, ...]
+        try:
+            for ean, name in self.db.load_ean_codes().items():
+                self.part_eans.setdefault(name, []).append(ean)
+        except Exception as e:
+            logger.warning("Could not load EAN codes for search: %s", e)
 
         # CustomTkinter settings
         ctk.set_appearance_mode("System")        # or "Dark", "Light"
@@ -45,8 +94,20 @@ class EMAGApp:
         # Initial data load from Firebase
         # - update_parts_list() calls self.db.load_inventory()
         # - update_products_list() calls self.db.load_products()
-        self.update_parts_list()
-        self.update_products_list()
+        with self.stall_monitor.span("initial load"):
+            self.update_parts_list()
+            self.update_products_list()
+
+        if self.db.location:
+            # A station bound to a location only loads its shard; the part KPIs come from a full read
+            threading.Thread(target=self.db.load_aggregates, daemon=True).start()
+        self.refresh_kpis()
+        if service_url:
+            # Changes made by other stations are pushed by the service
+            self.db.subscribe(lambda event: self.remote_changed.set())
+            self.root.after(REMOTE_POLL_MS, self.poll_remote_changes)
+        # Periodic full recompute of the dashboard KPIs as a consistency check
+        self.root.after(AGGREGATE_CHECK_INTERVAL_MS, self.schedule_aggregate_check)
 
     # -------------------------------------------------------------------------
     #                           LAYOUT METHODS
@@ -67,6 +128,10 @@ class EMAGApp:
             ("Dodaj Produkt", self.show_add_product_form),
             ("Edytuj Produkt", self.show_edit_product_form),
             ("Wysyłka", self.show_orders_form),
+            ("Przesunięcia", self.show_transfer_form),
+            ("Partie", self.show_lots_view),
+            ("Inwentaryzacja", self.show_stocktake_view),
+            ("Kompletacja", self.show_picking_view),
             ("Raporty (Wizualizacja)", self.show_visualization),
             ("Zgłoś Problem", self.show_feedback_form),
             ("Sprawdź Aktualizacje", self.check_for_updates_button),
@@ -100,6 +165,10 @@ class EMAGApp:
             value="products", command=self.toggle_view
         ).pack(side=tk.LEFT, padx=5)
 
+        # Live KPIs (maintained incrementally by Database, nothing is scanned here)
+        self.kpi_label = ctk.CTkLabel(toggle_frame, text="", font=("Arial", 12))
+        self.kpi_label.pack(side=tk.RIGHT, padx=10)
+
         # Table Area
         self.tree_frame = ctk.CTkFrame(self.main_content)
         self.tree_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
@@ -159,8 +228,12 @@ class EMAGApp:
         for widget in self.parts_tree.list_frame.winfo_children():
             widget.destroy()
 
-        # Load from DB
-        inventory = self.db.load_inventory()  # returns a dict from Firebase
+        # Load from DB - a station bound to a location only syncs its own shard
+        if self.db.location:
+            inventory = self.db.load_location(self.db.location)
+        else:
+            inventory = self.db.load_inventory()  # returns a dict from Firebase
+        self.sync_part_index(inventory)
         for part, quantity in inventory.items():
             row = ctk.CTkFrame(self.parts_tree.list_frame)
             row.pack(fill=tk.X)
@@ -174,6 +247,7 @@ class EMAGApp:
             widget.destroy()
 
         products = self.db.load_products()  # returns list of product dicts from Firebase
+        self.sync_product_index(products)
         for product in products:
             # product typically: {"name": <>, "quantity": <>, "parts": {...}}
             parts_data = product.get("parts", {})
@@ -186,6 +260,23 @@ class EMAGApp:
             ctk.CTkLabel(row, text=str(product.get('quantity', 0)), width=20).pack(side=tk.LEFT, padx=5)
             ctk.CTkLabel(row, text=parts_str, width=40).pack(side=tk.LEFT, padx=5)
 
+    def sync_part_index(self, inventory):
+        """Add/remove only the parts that changed since the last reload."""
+        for key in [k for k in self.part_index.entries if k not in inventory]:
+            self.part_index.remove(key)
+        for key in inventory:
+            if key not in self.part_index:
+                self.part_index.add(key, *self.part_eans.get(key, []))
+
+    def sync_product_index(self, products):
+        """Add/remove only the products that changed since the last reload."""
+        eans = {p["name"]: p.get("ean") for p in products}
+        for key in [k for k in self.product_index.entries if k not in eans]:
+            self.product_index.remove(key)
+        for name, ean in eans.items():
+            if name not in self.product_index:
+                self.product_index.add(name, ean or "")
+
     # -------------------------------------------------------------------------
     #                            SIDEBAR VIEWS
     # -------------------------------------------------------------------------
@@ -217,6 +308,11 @@ class EMAGApp:
             command=self.toggle_view
         ).pack(side=tk.LEFT, padx=5)
 
+        # Live KPIs (maintained incrementally by Database, nothing is scanned here)
+        self.kpi_label = ctk.CTkLabel(toggle_frame, text="", font=("Arial", 12))
+        self.kpi_label.pack(side=tk.RIGHT, padx=10)
+        self.refresh_kpis()
+
         # Re-create the table area
         self.tree_frame = ctk.CTkFrame(self.main_content)
         self.tree_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
@@ -229,6 +325,63 @@ class EMAGApp:
         self.toggle_var.set("parts")
         self.toggle_view()
 
+    def refresh_kpis(self):
+        """Redraw the dashboard KPIs every second while the dashboard is shown."""
+        if self.kpi_after_id:
+            self.root.after_cancel(self.kpi_after_id)
+            self.kpi_after_id = None
+        if not self.kpi_label.winfo_exists():
+            return
+        kpis = self.db.aggregates.snapshot()
+        top_categories = sorted(kpis["units_by_category"].items(), key=lambda kv: -kv[1])[:3]
+        categories_str = ", ".join(f"{name}: {units}" for name, units in top_categories)
+        self.kpi_label.configure(
+            text=(
+                f"Części: {kpis['total_units']} szt. | Niski stan: {kpis['low_stock_count']} | "
+                f"Produkty: {kpis['product_count']} ({kpis['product_units']} szt.)"
+                + (f" | {categories_str}" if categories_str else "")
+            )
+        )
+        self.kpi_after_id = self.root.after(KPI_REFRESH_MS, self.refresh_kpis)
+
+    def poll_remote_changes(self):
+        """Refresh the tables on the Tk thread after the service pushed a change."""
+        if self.remote_changed.is_set():
+            self.remote_changed.clear()
+            if self.parts_tree.winfo_ismapped():
+                self.update_parts_list()
+            if self.products_tree.winfo_ismapped():
+                self.update_products_list()
+        self.root.after(REMOTE_POLL_MS, self.poll_remote_changes)
+
+    def run_in_background(self, work, on_done, poll_ms=200):
+        """
+        Runs `work()` on a worker thread and calls `on_done(result, error)` on
+        the Tk thread when it finishes (polled with after, Tk is not thread-safe).
+        """
+        outcome = {}
+
+        def worker():
+            try:
+                outcome["result"] = work()
+            except Exception as e:
+                logger.exception("Background task failed")
+                outcome["error"] = e
+
+        def poll():
+            if not outcome:
+                self.root.after(poll_ms, poll)
+                return
+            on_done(outcome.get("result"), outcome.get("error"))
+
+        threading.Thread(target=worker, daemon=True).start()
+        self.root.after(poll_ms, poll)
+
+    def schedule_aggregate_check(self):
+        """Run the KPI consistency check off the Tk thread, then re-arm."""
+        threading.Thread(target=self.db.check_aggregates, daemon=True).start()
+        self.root.after(AGGREGATE_CHECK_INTERVAL_MS, self.schedule_aggregate_check)
+
     def show_inventory_view(self):
         """Switch back to normal 'Inventory' (parts/products) view."""
         self.update_status("Widok: Zarządzanie magazynem")
@@ -284,9 +437,9 @@ class EMAGApp:
             self.inventory[name] = new_qty
 
             # Write that final absolute value to Firebase
-            ref = db.reference("inventory")
+            ref = backend.reference("inventory")
             ref.child(name).set(new_qty)
-            print(f"Part '{name}' updated to {new_qty} in Firebase.")
+            logger.debug("Part '%s' updated to %d in Firebase.", name, new_qty)
 
 
         ctk.CTkButton(frame, text="Dodaj", command=add_part).pack(pady=10)
@@ -302,16 +455,13 @@ class EMAGApp:
 
         # Reload inventory from Firebase
         inventory = self.db.load_inventory()
-        part_options = list(inventory.keys())
+        self.sync_part_index(inventory)
 
         part_name_var = tk.StringVar()
-        if part_options:
-            part_name_var.set(part_options[0])
 
         ctk.CTkLabel(frame, text="Wybierz część:").pack(anchor="w", padx=5)
-        if part_options:
-            dropdown = ctk.CTkOptionMenu(frame, values=part_options, variable=part_name_var)
-            dropdown.pack(pady=5)
+        if inventory:
+            SearchPicker(frame, self.part_index, part_name_var).pack(pady=5)
         else:
             ctk.CTkLabel(frame, text="Brak części w bazie.").pack(pady=5)
 
@@ -364,7 +514,34 @@ class EMAGApp:
         # ----- EAN Entry -----
         ean_var = tk.StringVar()
         ctk.CTkLabel(frame, text="Kod EAN produktu:").pack(anchor="w", padx=5)
-        ctk.CTkEntry(frame, textvariable=ean_var, width=300).pack(pady=5)
+        ean_entry = ctk.CTkEntry(frame, textvariable=ean_var, width=300)
+        ean_entry.pack(pady=5)
+        found_label = ctk.CTkLabel(frame, text="")
+        found_label.pack(anchor="w", padx=5)
+
+        # The product behind a known EAN, read with its ETag when the EAN is
+        # entered (scanners end with Enter); saving is conditional on it
+        selected = {"ean": None, "name": None, "product": None}
+
+        def show_selected():
+            product = selected["product"]
+            if product:
+                found_label.configure(text=f"Produkt: {product['name']}, ilość: {product['quantity']}")
+            elif selected["name"]:
+                found_label.configure(text=f"EAN wskazuje na '{selected['name']}' (brak produktu)")
+            else:
+                found_label.configure(text="Nowy EAN" if selected["ean"] else "")
+
+        def look_up_ean(*args):
+            ean = ean_var.get().strip()
+            if ean == (selected["ean"] or ""):
+                return
+            name = self.db.verify_product_ean_in_firebase(ean) if ean else None
+            selected.update(ean=ean or None, name=name, product=self.db.load_product(name) if name else None)
+            show_selected()
+
+        ean_entry.bind("<Return>", look_up_ean)
+        ean_entry.bind("<FocusOut>", look_up_ean)
 
         # ----- Quantity Entry -----
         quantity_var = tk.StringVar()
@@ -375,19 +552,10 @@ class EMAGApp:
         ctk.CTkLabel(frame, text="Części składowe (użycie na 1 szt.):").pack(anchor="w", padx=5, pady=10)
 
         inventory = self.db.load_inventory()  # dict: {partName: quantityInStock, ...}
-        parts_scroll_frame = ctk.CTkScrollableFrame(frame, width=400, height=200)
-        parts_scroll_frame.pack(pady=5, fill=tk.X)
-
-        # For each known part, let the user specify how many are needed PER product item
-        parts_entries = {}
-        for part_name, stock_qty in inventory.items():
-            row = ctk.CTkFrame(parts_scroll_frame)
-            row.pack(fill=tk.X)
-
-            ctk.CTkLabel(row, text=f"{part_name} (Dost.: {stock_qty})").pack(side=tk.LEFT, padx=5)
-            used_var = tk.StringVar(value="0")
-            parts_entries[part_name] = used_var
-            ctk.CTkEntry(row, textvariable=used_var, width=60).pack(side=tk.LEFT, padx=5)
+        self.sync_part_index(inventory)
+        # Only the parts picked for this BOM get widgets, however big the catalogue is
+        bom_editor = BomEditor(frame, self.part_index, inventory, quantity_var)
+        bom_editor.pack(pady=5, fill=tk.X, padx=5)
 
         def add_or_update_product_via_ean():
             ean = ean_var.get().strip()
@@ -405,18 +573,23 @@ class EMAGApp:
                 messagebox.showerror("Błąd", "Ilość produktu musi być > 0.")
                 return
 
-            # Check if EAN is already in Firebase
-            existing_name = self.db.verify_product_ean_in_firebase(ean)
+            # Check if EAN is already in Firebase (read when it was entered, unless saved straight away)
+            look_up_ean()
+            existing_name = selected["name"]
             if existing_name:
                 # This EAN is already associated with some product
-                products = self.db.load_products()
-                product_data = next((p for p in products if p["name"] == existing_name), None)
+                product_data = selected["product"]
                 if product_data:
-                    # Just increase its quantity
-                    old_qty = product_data["quantity"]
-                    new_qty = old_qty + q_int
-                    product_data["quantity"] = new_qty
-                    self.db.update_product_in_firebase(product_data)
+                    # Just increase its quantity - conditional on the version read with the EAN
+                    new_qty = product_data["quantity"] + q_int
+                    updated = {**product_data, "quantity": new_qty}
+                    try:
+                        self.db.update_product_in_firebase(updated)
+                    except StaleProductError as e:
+                        selected["product"] = e.current
+                        show_selected()
+                        messagebox.showerror("Konflikt", f"{e}\nSprawdź ilość i zapisz ponownie.")
+                        return
 
                     messagebox.showinfo(
                         "Sukces",
@@ -431,27 +604,29 @@ class EMAGApp:
                     new_product = {
                         "name": existing_name,
                         "quantity": q_int,
-                        "parts": {},  # or gather from parts_entries if you want
+                        "parts": {},  # or take bom_editor.get_bom() if you want
                     }
                     self.db.add_product_to_firebase(new_product)
                     messagebox.showinfo("Sukces", f"Produkt '{existing_name}' utworzony z ilością {q_int}.")
             else:
-                # EAN unknown -> ask for new product name
+                # EAN unknown -> check the BOM, then ask for new product name
+                invalid, short = bom_editor.validate()
+                if invalid:
+                    messagebox.showerror("Błąd", "Popraw ilości części: " + ", ".join(invalid))
+                    return
+                if short and not messagebox.askyesno(
+                    "Braki na stanie",
+                    "Za mało na stanie: " + ", ".join(short) + "\nUtworzyć produkt mimo to?"
+                ):
+                    return
                 new_name = simpledialog.askstring("Nowy produkt", f"Podaj nazwę produktu dla EAN: {ean}")
                 if not new_name:
                     messagebox.showerror("Błąd", "Nie podano nazwy produktu. Anulowano.")
                     return
 
-                # Build the 'parts usage' dict from user entries
-                parts_usage = {}
-                for part_name, var in parts_entries.items():
-                    val_str = var.get().strip()
-                    if val_str.isdigit():
-                        per_item = int(val_str)
-                        if per_item > 0:
-                            parts_usage[part_name] = per_item
+                parts_usage = bom_editor.get_bom()
 
-                # 1) Store the EAN => new_name in /product_ean_codes
+                # 1) Store the EAN => new_name mapping (/product_ean_codes, or the product index under schema 2)
                 self.db.add_product_ean_to_firebase(ean, new_name)
 
                 # 2) Create a brand-new product
@@ -461,15 +636,19 @@ class EMAGApp:
                     "parts": parts_usage,
                 }
                 self.db.add_product_to_firebase(new_product)
-                messagebox.showinfo("Sukces", f"Utworzono nowy produkt '{new_name}' (EAN: {ean}), ilość: {q_int}.")
+                if messagebox.askyesno(
+                    "Sukces",
+                    f"Utworzono nowy produkt '{new_name}' (EAN: {ean}), ilość: {q_int}.\nWydrukować {q_int} etykiet?"
+                ):
+                    self.print_labels([{"ean": ean, "text": new_name, "copies": q_int}], f"etykiety-{ean}.pdf")
 
             # Finally, refresh product list & clear fields
             self.update_products_list()
             ean_var.set("")
+            selected.update(ean=None, name=None, product=None)
+            show_selected()
             quantity_var.set("")
-            # Optionally reset the parts usage fields to "0"
-            for var in parts_entries.values():
-                var.set("0")
+            bom_editor.clear()
 
         ctk.CTkButton(frame, text="Dodaj / Zaktualizuj przez EAN", command=add_or_update_product_via_ean).pack(pady=10)
 
@@ -484,32 +663,32 @@ class EMAGApp:
 
         # Reload from Firebase
         products = self.db.load_products()
-        product_names = [p["name"] for p in products]
+        self.sync_product_index(products)
 
         product_var = tk.StringVar()
-        if product_names:
-            product_var.set(product_names[0])
 
         ctk.CTkLabel(frame, text="Wybierz produkt:").pack(anchor="w", padx=5)
-        if product_names:
-            dropdown = ctk.CTkOptionMenu(frame, values=product_names, variable=product_var)
-            dropdown.pack(pady=5)
+        if products:
+            SearchPicker(frame, self.product_index, product_var).pack(pady=5)
         else:
             ctk.CTkLabel(frame, text="Brak produktów w bazie.").pack(pady=5)
 
         current_qty_label = ctk.CTkLabel(frame, text="Ilość: 0")
         current_qty_label.pack(anchor="w", padx=5, pady=5)
 
+        # The picked product, read fresh with its ETag; saving is conditional on it
+        selected = {"product": None}
+
         def update_current_quantity(*args):
             name = product_var.get()
-            product = next((p for p in products if p["name"] == name), None)
+            product = self.db.load_product(name) if name else None
+            selected["product"] = product
             if product:
                 current_qty_label.configure(text=f"Ilość: {product['quantity']}")
             else:
                 current_qty_label.configure(text="Ilość: 0")
 
         product_var.trace_add("write", update_current_quantity)
-        update_current_quantity()
 
         delta_var = tk.StringVar()
         ctk.CTkLabel(frame, text="Zmień ilość (+/-):").pack(anchor="w", padx=5)
@@ -525,8 +704,8 @@ class EMAGApp:
                 messagebox.showerror("Błąd", "Podaj poprawną liczbę całkowitą.")
                 return
 
-            product = next((p for p in products if p["name"] == name), None)
-            if not product:
+            product = selected["product"]
+            if not product or product["name"] != name:
                 messagebox.showerror("Błąd", f"Nie znaleziono produktu '{name}'.")
                 return
 
@@ -536,6 +715,7 @@ class EMAGApp:
                 return
 
             # If increasing quantity, check if we have enough parts
+            should_return = False
             if delta > 0:
                 inventory = self.db.load_inventory()
                 for part_name, part_qty in product["parts"].items():
@@ -548,25 +728,29 @@ class EMAGApp:
                             f"(potrzeba {required}, dostępne {available})."
                         )
                         return
-                # Deduct parts from inventory
-                for part_name, part_qty in product["parts"].items():
-                    self.db.update_part_quantity(part_name, -delta * part_qty)
-
-            # If decreasing, optionally return parts
-            # If decreasing quantity
             elif delta < 0:
                 should_return = messagebox.askyesno("Zwrot części", "Zwrot części do magazynu?")
-                if should_return:
-                    for part_name, part_qty in product["parts"].items():
-                        # part_qty is assumed to be how many of that part per 1 product item
-                        # returned is how many total to return for the 'delta' items
-                        returned = abs(delta) * part_qty
-                        self.db.update_part_quantity(part_name, returned)
 
-
-            # Update product quantity in Firebase
-            product["quantity"] = new_quantity
-            self.db.update_product_in_firebase(product)
+            # The quantity is written conditionally on the version read when the
+            # product was picked, then the parts are taken (never below zero);
+            # a failed build puts the quantity back
+            try:
+                updated, build = self.db.change_product_quantity(product, delta, return_parts=should_return)
+            except StaleProductError as e:
+                selected["product"] = e.current
+                current_qty_label.configure(text=f"Ilość: {e.current['quantity'] if e.current else 0}")
+                messagebox.showerror("Konflikt", f"{e}\nSprawdź ilość i spróbuj ponownie.")
+                return
+            except ValueError as e:
+                selected["product"] = self.db.load_product(name)
+                messagebox.showerror("Błąd", f"Nie zmieniono ilości produktu '{name}':\n{e}")
+                return
+            selected["product"] = updated
+            if build and build["expired"]:
+                messagebox.showwarning(
+                    "Partie", "Użyto partii po terminie ważności: " + ", ".join(build["expired"])
+                )
+            current_qty_label.configure(text=f"Ilość: {new_quantity}")
 
             self.update_products_list()
             self.update_parts_list()
@@ -611,10 +795,14 @@ class EMAGApp:
             ctk.CTkLabel(header, text=col, font=("Arial", 12, "bold"), width=20).pack(side=tk.LEFT, padx=5)
 
         # Body
-        self.delivery_table_body = ctk.CTkFrame(table_frame)
+        self.delivery_table_body = ctk.CTkScrollableFrame(table_frame)
         self.delivery_table_body.pack(fill=tk.BOTH, expand=True)
 
-        self.scanned_items = []  # list of (ean, quantity)
+        # One coalesced line per EAN; names are resolved in the background
+        if getattr(self, "scan_session", None):
+            self.scan_session.close()
+        self.scan_session = ScanSession(self.db.verify_ean_in_firebase)
+        self.scan_rows = {}  # ean -> (name_label, qty_label)
 
         # Input fields
         input_frame = ctk.CTkFrame(frame)
@@ -622,7 +810,11 @@ class EMAGApp:
 
         ctk.CTkLabel(input_frame, text="Scan EAN:").pack(side=tk.LEFT, padx=5)
         self.ean_var = tk.StringVar()
-        ctk.CTkEntry(input_frame, textvariable=self.ean_var, width=150).pack(side=tk.LEFT, padx=5)
+        ean_entry = ctk.CTkEntry(input_frame, textvariable=self.ean_var, width=150)
+        ean_entry.pack(side=tk.LEFT, padx=5)
+        # Keyboard-wedge scanners terminate every code with Enter
+        ean_entry.bind("<Return>", lambda event: self.add_scanned_item())
+        ean_entry.focus_set()
 
         ctk.CTkLabel(input_frame, text="Quantity:").pack(side=tk.LEFT, padx=5)
         self.qty_var = tk.StringVar()
@@ -630,51 +822,529 @@ class EMAGApp:
 
         ctk.CTkButton(input_frame, text="Dodaj", command=self.add_scanned_item).pack(side=tk.LEFT, padx=5)
 
+        self.scan_summary_label = ctk.CTkLabel(frame, text="Pozycje: 0, sztuk: 0")
+        self.scan_summary_label.pack(anchor="w", padx=5)
+
         ctk.CTkButton(frame, text="Zamknij Dostawę", fg_color="red", command=self.close_delivery).pack(pady=10)
 
+        self.poll_scan_results()
+
     def add_scanned_item(self):
-        """Add scanned item to the internal table."""
-        ean = self.ean_var.get().strip()
+        """
+        Register one scan (Enter from the scanner or the "Dodaj" button).
+        An empty quantity field counts as 1, so plain scanning needs no typing.
+        """
+        code = self.ean_var.get().strip()
         qty_str = self.qty_var.get().strip()
-        if not ean or not qty_str.isdigit():
-            messagebox.showerror("Błąd", "Niepoprawny EAN lub ilość.")
+        self.ean_var.set("")
+        if not code:
+            return
+        if qty_str and not qty_str.isdigit():
+            messagebox.showerror("Błąd", "Niepoprawna ilość.")
             return
-        qty = int(qty_str)
+        qty = int(qty_str) if qty_str else 1
         if qty <= 0:
             messagebox.showerror("Błąd", "Ilość musi być większa od 0.")
             return
 
-        self.scanned_items.append((ean, qty))
-
-        row = ctk.CTkFrame(self.delivery_table_body)
-        row.pack(fill=tk.X)
-        ctk.CTkLabel(row, text=ean, width=20).pack(side=tk.LEFT, padx=5)
-        ctk.CTkLabel(row, text="Pending Verification", width=20).pack(side=tk.LEFT, padx=5)
-        ctk.CTkLabel(row, text=str(qty), width=20).pack(side=tk.LEFT, padx=5)
+        ean, is_new = self.scan_session.add_scan(code, qty)
+        if ean is None:
+            # Invalid check digit - signal without a blocking dialog so scanning can continue
+            self.root.bell()
+            self.update_status(f"Niepoprawny kod EAN: {code}")
+            return
 
-        self.ean_var.set("")
+        if is_new:
+            row = ctk.CTkFrame(self.delivery_table_body)
+            row.pack(fill=tk.X)
+            ctk.CTkLabel(row, text=ean, width=20).pack(side=tk.LEFT, padx=5)
+            name_label = ctk.CTkLabel(row, text="Pending Verification", width=20)
+            name_label.pack(side=tk.LEFT, padx=5)
+            qty_label = ctk.CTkLabel(row, width=20)
+            qty_label.pack(side=tk.LEFT, padx=5)
+            self.scan_rows[ean] = (name_label, qty_label)
+
+        self.scan_rows[ean][1].configure(text=str(self.scan_session.items[ean]["quantity"]))
         self.qty_var.set("")
+        self.scan_summary_label.configure(
+            text=f"Pozycje: {len(self.scan_session.items)}, sztuk: {self.scan_session.total_units()}"
+        )
+
+    def poll_scan_results(self):
+        """Show names resolved in the background while the delivery view is open."""
+        if not self.delivery_table_body.winfo_exists():
+            return
+        for ean in self.scan_session.drain_results():
+            item = self.scan_session.items[ean]
+            text = item["name"] if item["name"] else "Nowy EAN"
+            self.scan_rows[ean][0].configure(text=text)
+        self.root.after(100, self.poll_scan_results)
 
     def close_delivery(self):
-        """Verify all scanned items and update inventory in Firebase."""
-        for ean, quantity in self.scanned_items:
-            name = self.db.verify_ean_in_firebase(ean)
+        """Verify all scanned items and update inventory in Firebase with one batched write."""
+        self.scan_session.drain_results()
+        deltas = {}
+        received = {}  # part name -> (quantity, [eans]) for the receipt
+        labels = []    # one label per unit received
+        for ean, item in self.scan_session.items.items():
+            name = item["name"]
+            if item["status"] != STATUS_KNOWN:
+                # Lookup still running or failed - resolve it now
+                name = self.db.verify_ean_in_firebase(ean)
             if not name:
                 # Prompt user for a new EAN
                 name = simpledialog.askstring("Nowy EAN", f"Podaj nazwę dla EAN: {ean}")
                 if name:
                     self.db.add_ean_to_firebase(ean, name)
+                    self.part_eans.setdefault(name, []).append(ean)
+                    self.part_index.add(name, *self.part_eans[name])
                 else:
                     messagebox.showerror("Błąd", f"Pomijanie EAN {ean}.")
                     continue
-            # Add part to inventory
-            self.db.add_part(name, quantity)
+            deltas[name] = deltas.get(name, 0) + item["quantity"]
+            quantity, eans = received.get(name, (0, []))
+            received[name] = (quantity + item["quantity"], eans + [ean])
+            labels.append({"ean": ean, "text": name, "copies": item["quantity"]})
+
+        # Dated parts (e.g. gaskets) get an expiry date on their lot
+        expires = {}
+        for name in deltas:
+            if part_category(name) not in DATED_CATEGORIES:
+                continue
+            while True:
+                value = simpledialog.askstring(
+                    "Data ważności", f"Data ważności partii '{name}' (RRRR-MM-DD, puste = brak):"
+                )
+                try:
+                    if value and value.strip():
+                        expires[name] = date.fromisoformat(value.strip()).isoformat()
+                    break
+                except ValueError:
+                    messagebox.showerror("Błąd", "Podaj datę w formacie RRRR-MM-DD.")
 
-        self.scanned_items.clear()
+        # Add parts to inventory (to this station's location if it has one), one lot per part
+        self.db.receive_lots(deltas, expires=expires, location=self.db.location)
+
+        self.scan_session.clear()
         self.update_parts_list()
-        messagebox.showinfo("Sukces", "Dostawa przetworzona pomyślnie.")
+        if received and messagebox.askyesno(
+            "Sukces", "Dostawa przetworzona pomyślnie.\nWydrukować etykiety i potwierdzenie dostawy?"
+        ):
+            self.print_delivery(received, labels)
         self.show_inventory_view()
 
+    def print_labels(self, labels, name):
+        """Label sheet rendered in the process pool off the Tk thread."""
+        def done(result, error):
+            if error:
+                messagebox.showerror("Błąd", f"Nie udało się wygenerować etykiet: {error}")
+                return
+            sheet, count = result
+            if not count:
+                messagebox.showwarning("Wydruki", "Brak poprawnych kodów EAN-13/EAN-8 do wydrukowania.")
+                return
+            self.update_status(f"Etykiety gotowe: {count}")
+            messagebox.showinfo("Wydruki", f"Etykiety ({count}): {sheet}")
+
+        self.update_status("Generowanie etykiet...")
+        self.run_in_background(lambda: self.renderer.render_label_sheet(labels, name), done)
+
+    def print_report(self, report, name):
+        """A report (delivery receipt, shipment note) rendered in the process pool."""
+        def done(path, error):
+            if error:
+                messagebox.showerror("Błąd", f"Nie udało się wygenerować dokumentu: {error}")
+            else:
+                self.update_status(f"Dokument zapisany: {path}")
+
+        self.run_in_background(lambda: self.renderer.render_report(report, name), done)
+
+    def print_delivery(self, received, labels):
+        """Label sheet and delivery receipt, rendered in the process pool off the Tk thread."""
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+
+        def work():
+            sheet, count = self.renderer.render_label_sheet(labels, f"etykiety-{stamp}.pdf")
+            report = self.renderer.render_report(delivery_report(received, station=self.db.location),
+                                                 f"dostawa-{stamp}.pdf")
+            return sheet, count, report
+
+        def done(result, error):
+            if error:
+                messagebox.showerror("Błąd", f"Nie udało się wygenerować wydruków: {error}")
+                return
+            sheet, count, report = result
+            self.update_status(f"Wydruki gotowe: {count} etykiet")
+            messagebox.showinfo("Wydruki", f"Etykiety ({count}): {sheet}\nPotwierdzenie dostawy: {report}")
+
+        self.update_status("Generowanie etykiet...")
+        self.run_in_background(work, done)
+
+    # -------------------------------------------------------------------------
+    #                      TRANSFERS BETWEEN LOCATIONS
+    # -------------------------------------------------------------------------
+    def show_transfer_form(self):
+        """Move parts between warehouse locations (the source is checked in a transaction)."""
+        self.update_status("Przesunięcia między lokalizacjami")
+        self.clear_main_content()
+
+        frame = ctk.CTkFrame(self.main_content)
+        frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+
+        ctk.CTkLabel(frame, text="Przesunięcie części", font=("Arial", 18, "bold")).pack(pady=10)
+
+        locations = self.db.list_locations()
+        ctk.CTkLabel(frame, text=f"Lokalizacje: {', '.join(locations) or 'brak'}").pack(anchor="w", padx=5)
+
+        part_var = tk.StringVar()
+        from_var = tk.StringVar(value=self.db.location or "")
+        to_var = tk.StringVar()
+        qty_var = tk.StringVar()
+        for label, var, width in (
+            ("Część:", part_var, 300),
+            ("Z lokalizacji:", from_var, 200),
+            ("Do lokalizacji:", to_var, 200),
+            ("Ilość:", qty_var, 100),
+        ):
+            ctk.CTkLabel(frame, text=label).pack(anchor="w", padx=5)
+            ctk.CTkEntry(frame, textvariable=var, width=width).pack(pady=5)
+
+        def transfer():
+            qty_str = qty_var.get().strip()
+            if not qty_str.isdigit() or int(qty_str) <= 0:
+                messagebox.showerror("Błąd", "Podaj prawidłową ilość.")
+                return
+            try:
+                self.db.transfer_part(
+                    part_var.get().strip(), from_var.get().strip(), to_var.get().strip(), int(qty_str)
+                )
+            except ValueError as e:
+                messagebox.showerror("Błąd", str(e))
+                return
+            self.update_parts_list()
+            messagebox.showinfo("Sukces", "Przesunięcie zapisane.")
+
+        ctk.CTkButton(frame, text="Przesuń", command=transfer).pack(pady=10)
+
+    # -------------------------------------------------------------------------
+    #                      LOTS (TRACEABILITY)
+    # -------------------------------------------------------------------------
+    def show_lots_view(self):
+        """Open lots of a part in consumption order, where a lot was used, what a shipment contained."""
+        self.update_status("Partie i śledzenie pochodzenia")
+        self.clear_main_content()
+
+        frame = ctk.CTkFrame(self.main_content)
+        frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        ctk.CTkLabel(frame, text="Partie (FIFO / FEFO)", font=("Arial", 18, "bold")).pack(pady=10)
+
+        self.sync_part_index(self.db.load_inventory())
+        part_var = tk.StringVar()
+        ctk.CTkLabel(frame, text="Część:").pack(anchor="w", padx=5)
+        SearchPicker(frame, self.part_index, part_var).pack(pady=5)
+
+        query = ctk.CTkFrame(frame)
+        query.pack(fill=tk.X, padx=5, pady=5)
+        lot_var = tk.StringVar()
+        shipment_var = tk.StringVar()
+        result_box = ctk.CTkTextbox(frame, height=320, wrap="none")
+
+        def show(lines):
+            result_box.configure(state="normal")
+            result_box.delete("1.0", tk.END)
+            result_box.insert(tk.END, "\n".join(lines))
+            result_box.configure(state="disabled")
+
+        def show_open_lots(*args):
+            name = part_var.get()
+            if not name:
+                return
+            rows = self.db.open_lots(name)
+            lines = [f"Otwarte partie '{name}' w kolejności pobierania: {len(rows)}"]
+            for row in rows:
+                lines.append(
+                    f"  {row['lot']:<40} {row['quantity']:>8} szt.  ważność: {row.get('expires') or '-'}"
+                )
+            show(lines)
+
+        def show_where_used():
+            name, lot_id = part_var.get(), lot_var.get().strip()
+            if not name or not lot_id:
+                messagebox.showerror("Błąd", "Wybierz część i podaj numer partii.")
+                return
+            rows = self.db.where_used(name, lot_id)
+            lines = [f"Partia {lot_id} ({name}) użyta w {len(rows)} kompletacjach:"]
+            for row in rows:
+                shipments = ", ".join(f"{sid} ({qty})" for sid, qty in row["shipments"].items()) or "-"
+                lines.append(f"  {row['build_id']}  {row['product']}  {row['quantity']} szt.  wysyłki: {shipments}")
+            show(lines)
+
+        def show_shipment():
+            shipment_id = shipment_var.get().strip()
+            if not shipment_id:
+                return
+            try:
+                trace = self.db.trace_shipment(shipment_id)
+            except ValueError as e:
+                messagebox.showerror("Błąd", str(e))
+                return
+            lines = [f"Wysyłka {shipment_id}: {trace['quantity']} x {trace['product']}"]
+            if trace["untracked"]:
+                lines.append(f"  bez partii: {trace['untracked']} szt.")
+            for build in trace["builds"]:
+                lines.append(f"  kompletacja {build['build_id']} ({build['shipped']} szt.)")
+                for row in build["parts"]:
+                    lines.append(
+                        f"    {row['part']:<30} partia {row['lot']}  {row['quantity']} szt.  "
+                        f"ważność: {row['expires'] or '-'}  dostawa: {row['delivery'] or '-'}"
+                    )
+            show(lines)
+
+        part_var.trace_add("write", show_open_lots)
+        ctk.CTkLabel(query, text="Partia:").pack(side=tk.LEFT, padx=5)
+        ctk.CTkEntry(query, textvariable=lot_var, width=260).pack(side=tk.LEFT, padx=5)
+        ctk.CTkButton(query, text="Gdzie użyta", command=show_where_used).pack(side=tk.LEFT, padx=5)
+        ctk.CTkLabel(query, text="Wysyłka:").pack(side=tk.LEFT, padx=5)
+        ctk.CTkEntry(query, textvariable=shipment_var, width=220).pack(side=tk.LEFT, padx=5)
+        ctk.CTkButton(query, text="Pochodzenie", command=show_shipment).pack(side=tk.LEFT, padx=5)
+        result_box.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+
+    # -------------------------------------------------------------------------
+    #                      STOCKTAKE (CYCLE COUNT)
+    # -------------------------------------------------------------------------
+    def show_stocktake_view(self):
+        """Freeze the stock, collect counts (scans or a file), review the differences, commit them at once."""
+        self.update_status("Inwentaryzacja")
+        self.clear_main_content()
+
+        frame = ctk.CTkFrame(self.main_content)
+        frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        ctk.CTkLabel(frame, text="Inwentaryzacja", font=("Arial", 18, "bold")).pack(pady=10)
+
+        open_stocktakes = self.db.list_open_stocktakes()
+        stocktake_var = tk.StringVar(value=max(open_stocktakes) if open_stocktakes else "")
+        ean_to_part = self.db.load_ean_codes()
+        pending = {}  # part -> units scanned and not yet saved
+
+        top = ctk.CTkFrame(frame)
+        top.pack(fill=tk.X, padx=5, pady=5)
+        ctk.CTkLabel(top, text="Inwentaryzacja:").pack(side=tk.LEFT, padx=5)
+        ctk.CTkLabel(top, textvariable=stocktake_var).pack(side=tk.LEFT, padx=5)
+
+        def start_stocktake():
+            if stocktake_var.get() and not messagebox.askyesno(
+                "Inwentaryzacja", "Jest otwarta inwentaryzacja. Rozpocząć nową?"
+            ):
+                return
+            stocktake_var.set(self.db.start_stocktake())
+            pending.clear()
+            update_pending()
+
+        ctk.CTkButton(top, text="Rozpocznij (zamroź stany)", command=start_stocktake).pack(side=tk.LEFT, padx=5)
+
+        scan_frame = ctk.CTkFrame(frame)
+        scan_frame.pack(fill=tk.X, padx=5, pady=5)
+        ctk.CTkLabel(scan_frame, text="Scan EAN:").pack(side=tk.LEFT, padx=5)
+        ean_var = tk.StringVar()
+        ean_entry = ctk.CTkEntry(scan_frame, textvariable=ean_var, width=150)
+        ean_entry.pack(side=tk.LEFT, padx=5)
+        ctk.CTkLabel(scan_frame, text="Ilość:").pack(side=tk.LEFT, padx=5)
+        qty_var = tk.StringVar()
+        ctk.CTkEntry(scan_frame, textvariable=qty_var, width=60).pack(side=tk.LEFT, padx=5)
+        pending_label = ctk.CTkLabel(frame, text="")
+        pending_label.pack(anchor="w", padx=5)
+
+        def update_pending():
+            pending_label.configure(
+                text=f"Niezapisane liczenia: {len(pending)} części, {sum(pending.values())} szt."
+            )
+
+        def add_count():
+            code, qty_str = ean_var.get().strip(), qty_var.get().strip()
+            ean_var.set("")
+            if not code:
+                return
+            if not stocktake_var.get():
+                messagebox.showerror("Błąd", "Najpierw rozpocznij inwentaryzację.")
+                return
+            if qty_str and not qty_str.isdigit():
+                messagebox.showerror("Błąd", "Niepoprawna ilość.")
+                return
+            part = ean_to_part.get(code)
+            if not part:
+                # Unknown code - signal without a dialog so counting can continue
+                self.root.bell()
+                self.update_status(f"Nieznany kod EAN: {code}")
+                return
+            pending[part] = pending.get(part, 0) + (int(qty_str) if qty_str else 1)
+            qty_var.set("")
+            update_pending()
+
+        ean_entry.bind("<Return>", lambda event: add_count())
+        ctk.CTkButton(scan_frame, text="Dodaj", command=add_count).pack(side=tk.LEFT, padx=5)
+
+        def save_counts():
+            if pending and stocktake_var.get():
+                self.db.record_stocktake_counts(stocktake_var.get(), pending)
+                pending.clear()
+                update_pending()
+
+        def import_counts():
+            if not stocktake_var.get():
+                messagebox.showerror("Błąd", "Najpierw rozpocznij inwentaryzację.")
+                return
+            path = filedialog.askopenfilename(
+                title="Plik z wynikami liczenia",
+                filetypes=[("Pliki liczenia", "*.csv *.json *.jsonl"), ("Wszystkie pliki", "*.*")]
+            )
+            if path:
+                summary = self.controller.import_stocktake_file(stocktake_var.get(), path)
+                messagebox.showinfo(
+                    "Import", f"Wczytano {summary['accepted']}/{summary['rows']} wierszy "
+                              f"({summary['parts']} części, odrzucone: {summary['rejected']})."
+                )
+
+        uncounted_var = tk.BooleanVar(value=False)
+        diff_box = ctk.CTkTextbox(frame, height=260, wrap="none")
+
+        def show_diff():
+            save_counts()
+            if not stocktake_var.get():
+                return []
+            rows = self.db.stocktake_diff(stocktake_var.get(), uncounted_as_zero=uncounted_var.get())
+            lines = [
+                f"{row['part']}: stan {row['expected']}, policzono {row['counted']}, korekta {row['delta']:+d}"
+                + (f"  (ruch w trakcie liczenia: {row['moved']:+d})" if row["moved"] else "")
+                for row in rows
+            ]
+            diff_box.configure(state="normal")
+            diff_box.delete("1.0", tk.END)
+            diff_box.insert(tk.END, "\n".join(lines) if lines else "Brak różnic.")
+            diff_box.configure(state="disabled")
+            return rows
+
+        def commit_stocktake():
+            rows = show_diff()
+            if not stocktake_var.get():
+                return
+            if not messagebox.askyesno(
+                "Inwentaryzacja",
+                f"Zatwierdzić {len(rows)} korekt (+{sum(r['delta'] for r in rows if r['delta'] > 0)} / "
+                f"{sum(r['delta'] for r in rows if r['delta'] < 0)} szt.) i zamknąć inwentaryzację?"
+            ):
+                return
+            summary = self.db.commit_stocktake(stocktake_var.get(), uncounted_as_zero=uncounted_var.get())
+            stocktake_var.set("")
+            self.update_parts_list()
+            messagebox.showinfo("Sukces", f"Inwentaryzacja zatwierdzona ({summary['parts']} korekt).")
+
+        actions = ctk.CTkFrame(frame)
+        actions.pack(fill=tk.X, padx=5, pady=5)
+        ctk.CTkButton(actions, text="Zapisz liczenia", command=save_counts).pack(side=tk.LEFT, padx=5)
+        ctk.CTkButton(actions, text="Importuj plik liczenia", command=import_counts).pack(side=tk.LEFT, padx=5)
+        ctk.CTkButton(actions, text="Pokaż różnice", command=show_diff).pack(side=tk.LEFT, padx=5)
+        ctk.CTkCheckBox(actions, text="Niepoliczone = 0", variable=uncounted_var).pack(side=tk.LEFT, padx=5)
+        diff_box.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+        ctk.CTkButton(frame, text="Zatwierdź korekty", fg_color="red", command=commit_stocktake).pack(pady=10)
+        update_pending()
+        ean_entry.focus_set()
+
+    # -------------------------------------------------------------------------
+    #                      PICK LISTS (WAVE PICKING)
+    # -------------------------------------------------------------------------
+    def show_picking_view(self):
+        """Bins of parts/products and routed pick lists for a wave of orders."""
+        self.update_status("Kompletacja zamówień")
+        self.clear_main_content()
+
+        frame = ctk.CTkFrame(self.main_content)
+        frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        ctk.CTkLabel(frame, text="Kompletacja (listy pobrań)", font=("Arial", 18, "bold")).pack(pady=10)
+
+        # Bin assignment
+        bin_frame = ctk.CTkFrame(frame)
+        bin_frame.pack(fill=tk.X, padx=5, pady=5)
+        kind_var = tk.StringVar(value="Produkt")
+        item_var = tk.StringVar()
+        bin_var = tk.StringVar()
+        ctk.CTkOptionMenu(bin_frame, variable=kind_var, values=["Produkt", "Część"], width=100).pack(side=tk.LEFT, padx=5)
+        ctk.CTkLabel(bin_frame, text="Nazwa:").pack(side=tk.LEFT, padx=5)
+        ctk.CTkEntry(bin_frame, textvariable=item_var, width=200).pack(side=tk.LEFT, padx=5)
+        ctk.CTkLabel(bin_frame, text="Lokalizacja:").pack(side=tk.LEFT, padx=5)
+        ctk.CTkEntry(bin_frame, textvariable=bin_var, width=130, placeholder_text="MAG1-R03-P2").pack(side=tk.LEFT, padx=5)
+
+        def save_bin():
+            name = item_var.get().strip()
+            if not name:
+                messagebox.showerror("Błąd", "Podaj nazwę produktu lub części.")
+                return
+            try:
+                self.db.set_bin("products" if kind_var.get() == "Produkt" else "parts", name, bin_var.get().strip())
+            except ValueError as e:
+                messagebox.showerror("Błąd", str(e))
+                return
+            self.update_status(f"Lokalizacja '{name}': {bin_var.get().strip() or '-'}")
+            item_var.set("")
+            bin_var.set("")
+
+        ctk.CTkButton(bin_frame, text="Zapisz lokalizację", command=save_bin).pack(side=tk.LEFT, padx=5)
+
+        # Wave of orders: one line per order line
+        ctk.CTkLabel(frame, text="Zamówienia (zamówienie;produkt;ilość, jedna pozycja w wierszu):").pack(anchor="w", padx=5)
+        orders_box = ctk.CTkTextbox(frame, height=150)
+        orders_box.pack(fill=tk.X, padx=5, pady=5)
+
+        options = ctk.CTkFrame(frame)
+        options.pack(fill=tk.X, padx=5)
+        ctk.CTkLabel(options, text="Zamówień na kompletującego:").pack(side=tk.LEFT, padx=5)
+        batch_var = tk.StringVar(value="20")
+        ctk.CTkEntry(options, textvariable=batch_var, width=60).pack(side=tk.LEFT, padx=5)
+
+        result_box = ctk.CTkTextbox(frame, height=260, wrap="none")
+
+        def show_pick_lists(result, error):
+            if error:
+                messagebox.showerror("Błąd", f"Nie udało się przygotować list: {error}")
+                return
+            lines = [
+                f"Trasa razem: {result['distance_m']:.0f} m "
+                f"(zamówienie po zamówieniu: {result['naive_distance_m']:.0f} m)"
+            ]
+            for number, batch in enumerate(result["batches"], 1):
+                lines.append("")
+                lines.append(f"Lista {number}: {len(batch['orders'])} zamówień, {batch['distance_m']:.0f} m")
+                for stop in batch["stops"]:
+                    picks = ", ".join(f"{p['item']} x{p['quantity']} ({p['order']})" for p in stop["picks"])
+                    lines.append(f"  {stop['bin']}: {picks}")
+            if result["unlocated"]:
+                lines.append("")
+                lines.append("Bez lokalizacji: " + ", ".join(
+                    f"{line['item']} x{line['quantity']} ({line['order']})" for line in result["unlocated"]
+                ))
+            result_box.configure(state="normal")
+            result_box.delete("1.0", tk.END)
+            result_box.insert(tk.END, "\n".join(lines))
+            result_box.configure(state="disabled")
+
+        def generate():
+            order_lines = []
+            for number, row in enumerate(orders_box.get("1.0", tk.END).splitlines(), 1):
+                if not row.strip():
+                    continue
+                fields = [field.strip() for field in row.split(";")]
+                if len(fields) != 3 or not fields[2].isdigit():
+                    messagebox.showerror("Błąd", f"Wiersz {number}: oczekiwano 'zamówienie;produkt;ilość'.")
+                    return
+                order_lines.append({"order": fields[0], "item": fields[1], "quantity": int(fields[2])})
+            if not batch_var.get().isdigit() or int(batch_var.get()) <= 0:
+                messagebox.showerror("Błąd", "Podaj prawidłową liczbę zamówień na kompletującego.")
+                return
+            batch_size = int(batch_var.get())
+            self.run_in_background(lambda: self.controller.pick_lists(order_lines, batch_size), show_pick_lists)
+
+        ctk.CTkButton(options, text="Generuj listy pobrań", command=generate).pack(side=tk.LEFT, padx=5)
+        result_box.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+
     # -------------------------------------------------------------------------
     #           ORDERS (PACK & SHIP) - EXAMPLE OF REMOVING PRODUCTS
     # -------------------------------------------------------------------------
@@ -690,19 +1360,33 @@ class EMAGApp:
 
         # Load current products
         products = self.db.load_products()
-        product_names = [p["name"] for p in products]
+        self.sync_product_index(products)
 
         product_var = tk.StringVar()
-        if product_names:
-            product_var.set(product_names[0])
 
         ctk.CTkLabel(frame, text="Wybierz produkt do wysyłki:").pack(anchor="w", padx=5)
-        if product_names:
-            dropdown = ctk.CTkOptionMenu(frame, values=product_names, variable=product_var)
-            dropdown.pack(pady=5)
+        if products:
+            SearchPicker(frame, self.product_index, product_var).pack(pady=5)
         else:
             ctk.CTkLabel(frame, text="Brak produktów w bazie.").pack(pady=5)
 
+        stock_label = ctk.CTkLabel(frame, text="Dostępne: 0")
+        stock_label.pack(anchor="w", padx=5, pady=5)
+
+        # The picked product, read fresh with its ETag; shipping is conditional on it
+        selected = {"product": None}
+
+        def show_selected():
+            product = selected["product"]
+            stock_label.configure(text=f"Dostępne: {product['quantity'] if product else 0}")
+
+        def pick_product(*args):
+            name = product_var.get()
+            selected["product"] = self.db.load_product(name) if name else None
+            show_selected()
+
+        product_var.trace_add("write", pick_product)
+
         order_qty_var = tk.StringVar()
         ctk.CTkLabel(frame, text="Ilość do wysłania:").pack(anchor="w", padx=5)
         ctk.CTkEntry(frame, textvariable=order_qty_var, width=100).pack(pady=5)
@@ -722,19 +1406,34 @@ class EMAGApp:
                 messagebox.showerror("Błąd", "Ilość wysyłana musi być > 0.")
                 return
 
-            # Find product in our loaded list
-            product_data = next((p for p in products if p["name"] == selected_name), None)
-            if not product_data:
+            product = selected["product"]
+            if not product or product["name"] != selected_name:
                 messagebox.showerror("Błąd", f"Produkt '{selected_name}' nie istnieje w bazie.")
                 return
 
-            current_qty = product_data["quantity"]
+            current_qty = product["quantity"]
             if order_qty > current_qty:
                 messagebox.showerror("Błąd", f"Niewystarczający stan. Dostępne: {current_qty}.")
                 return
 
             new_quantity = current_qty - order_qty
-            product_data["quantity"] = new_quantity
+            product_data = {**product, "quantity": new_quantity}
+            try:
+                # Conditional write: fails if another station shipped or edited the product since it was picked
+                self.db.update_product_in_firebase(product_data)
+            except StaleProductError as e:
+                selected["product"] = e.current
+                show_selected()
+                messagebox.showerror("Konflikt", f"{e}\nZamówienie nie zostało wystawione, spróbuj ponownie.")
+                return
+            selected["product"] = product_data
+
+            shipment_id = self.db.ship_lots(selected_name, order_qty)
+            if print_note_var.get():
+                self.print_report(
+                    order_report(selected_name, order_qty, ean=product_data.get("ean"), remaining=new_quantity),
+                    f"wysylka-{time.strftime('%Y%m%d-%H%M%S')}.pdf",
+                )
 
             # If the product is fully used up
             if new_quantity == 0:
@@ -746,16 +1445,17 @@ class EMAGApp:
                     self.db.delete_product(selected_name)
                     messagebox.showinfo("Sukces", f"Produkt '{selected_name}' usunięty z bazy.")
             else:
-                # Update the product quantity
-                self.db.update_product_in_firebase(product_data)
                 messagebox.showinfo(
                     "Sukces",
-                    f"Wysłano {order_qty} szt. produktu '{selected_name}'. Pozostało {new_quantity}."
+                    f"Wysłano {order_qty} szt. produktu '{selected_name}' (wysyłka {shipment_id}). "
+                    f"Pozostało {new_quantity}."
                 )
 
             self.update_products_list()
             self.show_orders_form()  # refresh the UI
 
+        print_note_var = tk.BooleanVar(value=False)
+        ctk.CTkCheckBox(frame, text="Drukuj dokument wysyłki", variable=print_note_var).pack(pady=5)
         ctk.CTkButton(frame, text="Wystaw Zamówienie", command=process_order).pack(pady=10)
 
     # -------------------------------------------------------------------------
@@ -865,6 +1565,100 @@ class EMAGApp:
 
         ctk.CTkLabel(frame, text="Tutaj można dodać ustawienia (np. motyw).", font=("Arial", 14)).pack(pady=20)
 
+        def migrate_part_ids():
+            confirm = messagebox.askyesno(
+                "Migracja",
+                "Przepisać magazyn, BOM-y i kody EAN na identyfikatory części z katalogu?"
+            )
+            if confirm:
+                written = self.db.migrate_to_part_ids()
+                self.update_parts_list()
+                messagebox.showinfo("Sukces", f"Migracja zakończona ({written} zmian).")
+
+        ctk.CTkButton(frame, text="Migruj klucze części do ID katalogu", command=migrate_part_ids).pack(pady=5)
+
+        def check_integrity():
+            # The full check streams every tree: run it off the Tk thread
+            integrity_button.configure(state="disabled", text="Sprawdzanie spójności...")
+            self.run_in_background(self.db.check_integrity, show_integrity_result)
+
+        def show_integrity_result(issues, error):
+            if integrity_button.winfo_exists():
+                integrity_button.configure(state="normal", text="Sprawdź spójność danych")
+            if error:
+                messagebox.showerror("Błąd", f"Sprawdzenie spójności nie powiodło się: {error}")
+                return
+            if not issues:
+                messagebox.showinfo("Spójność danych", "Nie znaleziono niespójności.")
+                return
+            counts = {}
+            for issue in issues:
+                counts[issue["check"]] = counts.get(issue["check"], 0) + 1
+            repairable = [issue for issue in issues if issue["repair"]]
+            details = "\n".join(f"{check}: {count}" for check, count in sorted(counts.items()))
+            if not repairable:
+                messagebox.showwarning(
+                    "Spójność danych", f"Znalezione niespójności:\n{details}\n\nWymagają ręcznej poprawy."
+                )
+                return
+            if messagebox.askyesno(
+                "Spójność danych",
+                f"Znalezione niespójności:\n{details}\n\nNaprawić automatycznie {len(repairable)} z nich?"
+            ):
+                written = self.db.repair_integrity(repairable)
+                self.update_parts_list()
+                messagebox.showinfo("Sukces", f"Naprawiono ({written} zmian).")
+
+        integrity_button = ctk.CTkButton(frame, text="Sprawdź spójność danych", command=check_integrity)
+        integrity_button.pack(pady=5)
+
+        # UI stalls recorded by the watchdog, slowest first
+        ctk.CTkLabel(frame, text="Blokady interfejsu", font=("Arial", 16, "bold")).pack(pady=(20, 5))
+        summary = self.stall_monitor.summary()
+        lines = [f"{name}: {ms:.0f} ms ({calls} wywołań bazy)" for name, ms, calls in summary]
+        lines.append(f"Maks. opóźnienie pętli zdarzeń: {self.stall_monitor.max_lag * 1000:.0f} ms")
+        ctk.CTkLabel(frame, text="\n".join(lines) if summary else "Brak blokad powyżej progu.\n" + lines[-1],
+                     justify="left").pack(pady=5)
+
+        def export_stall_trace():
+            path = filedialog.asksaveasfilename(
+                title="Zapisz ślad blokad", defaultextension=".json",
+                initialfile="emag_stalls.json", filetypes=[("Chrome trace", "*.json")]
+            )
+            if path:
+                count = self.stall_monitor.export_chrome_trace(path)
+                messagebox.showinfo(
+                    "Sukces", f"Zapisano {count} blokad do '{path}'.\nOtwórz w chrome://tracing lub ui.perfetto.dev."
+                )
+
+        ctk.CTkButton(frame, text="Eksportuj ślad blokad (Chrome trace)", command=export_stall_trace).pack(pady=5)
+
+        # Log viewer over the in-memory ring buffer (formatted only when shown)
+        ctk.CTkLabel(frame, text="Dziennik zdarzeń", font=("Arial", 16, "bold")).pack(pady=(20, 5))
+        log_controls = ctk.CTkFrame(frame)
+        log_controls.pack(fill=tk.X, padx=5)
+        level_var = tk.StringVar(value=current_level())
+        log_box = ctk.CTkTextbox(frame, height=220, wrap="none")
+        log_box.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+
+        def show_log():
+            buffer = ring_buffer()
+            lines = buffer.lines(logging.getLevelName(level_var.get()), limit=LOG_VIEW_LINES) if buffer else []
+            log_box.configure(state="normal")
+            log_box.delete("1.0", tk.END)
+            log_box.insert(tk.END, "\n".join(lines) if lines else "Brak wpisów.")
+            log_box.configure(state="disabled")
+            log_box.see(tk.END)
+
+        def change_level(level):
+            set_level(level)
+            show_log()
+
+        ctk.CTkLabel(log_controls, text="Poziom:").pack(side=tk.LEFT, padx=5)
+        ctk.CTkOptionMenu(log_controls, variable=level_var, values=list(LEVELS), command=change_level).pack(side=tk.LEFT)
+        ctk.CTkButton(log_controls, text="Odśwież", width=90, command=show_log).pack(side=tk.LEFT, padx=5)
+        show_log()
+
     # -------------------------------------------------------------------------
     #                           STATUS UPDATER
     # -------------------------------------------------------------------------
@@ -873,10 +1667,12 @@ class EMAGApp:
 
 
 def run_gui():
+    setup_logging()
     root = ctk.CTk()
     root.title("EMAG")
     app = EMAGApp(root)
     root.mainloop()
+    app.renderer.shutdown()
 
 
 if __name__ == "__main__":
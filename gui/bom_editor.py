@@ -0,0 +1,117 @@
+import tkinter as tk
+import customtkinter as ctk
+
+from gui.search_picker import SearchPicker
+
+
+class BomEditor(ctk.CTkFrame):
+    """
+    Bill-of-materials editor for a new product. Starts empty; parts are added
+    through a SearchPicker and only the chosen lines get widgets, so opening
+    the form costs the same for ten parts in stock or a hundred thousand.
+    Every line is checked against stock (per-unit usage x product quantity)
+    as the user types.
+    """
+
+    def __init__(self, master, index, stock, quantity_var=None, **kwargs):
+        super().__init__(master, **kwargs)
+        self.index = index
+        self.stock = stock
+        self.quantity_var = quantity_var
+        self.lines = {}  # part -> (row frame, usage var, status label, usage entry)
+
+        self.picked_var = tk.StringVar()
+        self.picker = SearchPicker(self, index, self.picked_var, max_results=10, on_select=self.add_line)
+        self.picker.pack(fill=tk.X, pady=(0, 5))
+
+        self.lines_frame = ctk.CTkFrame(self, fg_color="transparent")
+        self.lines_frame.pack(fill=tk.X)
+        self.empty_label = ctk.CTkLabel(self.lines_frame, text="Brak części — wyszukaj i wybierz powyżej.")
+        self.empty_label.pack(anchor="w", padx=5)
+        self.summary_label = ctk.CTkLabel(self, text="")
+        self.summary_label.pack(anchor="w", padx=5)
+
+        if quantity_var is not None:
+            self._quantity_trace = quantity_var.trace_add("write", lambda *args: self.validate())
+            self.bind("<Destroy>", self._on_destroy, add="+")
+
+    def _on_destroy(self, event):
+        if event.widget is self and self.quantity_var is not None:
+            try:
+                self.quantity_var.trace_remove("write", self._quantity_trace)
+            except tk.TclError:
+                pass
+
+    def _quantity(self):
+        value = self.quantity_var.get().strip() if self.quantity_var is not None else ""
+        return int(value) if value.isdigit() and int(value) > 0 else 1
+
+    def add_line(self, part):
+        """Add `part` with a usage of 1 (or focus its line if already there)."""
+        if part in self.lines:
+            self.lines[part][3].focus_set()
+            return
+        self.empty_label.pack_forget()
+        row = ctk.CTkFrame(self.lines_frame)
+        row.pack(fill=tk.X, pady=1)
+        ctk.CTkLabel(row, text=part, anchor="w", width=220).pack(side=tk.LEFT, padx=5)
+        usage_var = tk.StringVar(value="1")
+        entry = ctk.CTkEntry(row, textvariable=usage_var, width=60)
+        entry.pack(side=tk.LEFT, padx=5)
+        status = ctk.CTkLabel(row, text="", width=160, anchor="w")
+        status.pack(side=tk.LEFT, padx=5)
+        ctk.CTkButton(row, text="✕", width=28, command=lambda: self.remove_line(part)).pack(side=tk.RIGHT, padx=5)
+        self.lines[part] = (row, usage_var, status, entry)
+        usage_var.trace_add("write", lambda *args: self.validate())
+        self.validate()
+        entry.focus_set()
+        entry.select_range(0, tk.END)
+
+    def remove_line(self, part):
+        row = self.lines.pop(part)[0]
+        row.destroy()
+        if not self.lines:
+            self.empty_label.pack(anchor="w", padx=5)
+        self.validate()
+
+    def clear(self):
+        for part in list(self.lines):
+            self.remove_line(part)
+        self.picked_var.set("")
+        self.picker.query_var.set("")
+        self.picker.refresh()
+
+    def validate(self):
+        """Refresh every line's status; returns (invalid parts, short parts)."""
+        quantity = self._quantity()
+        invalid, short = [], []
+        for part, (_, usage_var, status, _) in self.lines.items():
+            value = usage_var.get().strip()
+            available = self.stock.get(part, 0)
+            if not value.isdigit() or int(value) <= 0:
+                invalid.append(part)
+                status.configure(text="Niepoprawna ilość", text_color="orange")
+                continue
+            needed = int(value) * quantity
+            if needed > available:
+                short.append(part)
+                status.configure(text=f"Brakuje {needed - available} (dost.: {available})", text_color="red")
+            else:
+                status.configure(text=f"Potrzeba {needed} z {available}", text_color="green")
+        if not self.lines:
+            self.summary_label.configure(text="")
+        else:
+            self.summary_label.configure(
+                text=f"Pozycji: {len(self.lines)}  niepoprawnych: {len(invalid)}  z brakiem na stanie: {len(short)}",
+                text_color="red" if invalid or short else "green",
+            )
+        return invalid, short
+
+    def get_bom(self):
+        """{part: usage per unit} for the valid lines."""
+        bom = {}
+        for part, (_, usage_var, _, _) in self.lines.items():
+            value = usage_var.get().strip()
+            if value.isdigit() and int(value) > 0:
+                bom[part] = int(value)
+        return bom
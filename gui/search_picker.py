@@ -0,0 +1,68 @@
+import tkinter as tk
+import customtkinter as ctk
+
+
+class SearchPicker(ctk.CTkFrame):
+    """
+    Type-ahead replacement for CTkOptionMenu over large lists. Only the top
+    matches from a SearchIndex are shown (in a plain tk.Listbox, which is
+    far cheaper than one CTk widget per entry), so opening a form costs the
+    same for ten entries or a hundred thousand.
+    """
+
+    def __init__(self, master, index, variable, max_results=15, on_select=None, width=300, **kwargs):
+        super().__init__(master, **kwargs)
+        self.index = index
+        self.variable = variable
+        self.max_results = max_results
+        self.on_select = on_select
+        self.results = []
+
+        self.query_var = tk.StringVar(value=variable.get())
+        self.entry = ctk.CTkEntry(self, textvariable=self.query_var, width=width,
+                                  placeholder_text="Szukaj (nazwa, rozmiar, EAN)...")
+        self.entry.pack(fill=tk.X)
+        self.listbox = tk.Listbox(self, height=min(max_results, 8), activestyle="dotbox", exportselection=False)
+        self.listbox.pack(fill=tk.X, pady=(2, 0))
+
+        self.entry.bind("<KeyRelease>", self._on_key)
+        self.entry.bind("<Down>", lambda event: self._move(1))
+        self.entry.bind("<Up>", lambda event: self._move(-1))
+        self.entry.bind("<Return>", lambda event: self._choose_active())
+        self.listbox.bind("<<ListboxSelect>>", lambda event: self._choose_active())
+
+        self.refresh()
+
+    def refresh(self):
+        """Re-run the current query (e.g. after the index changed)."""
+        self.results = self.index.search(self.query_var.get(), self.max_results)
+        self.listbox.delete(0, tk.END)
+        for key in self.results:
+            self.listbox.insert(tk.END, key)
+        if self.results:
+            self.listbox.activate(0)
+
+    def _on_key(self, event):
+        if event.keysym in ("Up", "Down", "Return"):
+            return
+        self.refresh()
+
+    def _move(self, step):
+        if not self.results:
+            return
+        position = (self.listbox.index(tk.ACTIVE) + step) % len(self.results)
+        self.listbox.selection_clear(0, tk.END)
+        self.listbox.activate(position)
+        self.listbox.selection_set(position)
+        self.listbox.see(position)
+
+    def _choose_active(self):
+        selection = self.listbox.curselection()
+        position = selection[0] if selection else self.listbox.index(tk.ACTIVE)
+        if not self.results or position >= len(self.results):
+            return
+        key = self.results[position]
+        self.variable.set(key)
+        self.query_var.set(key)
+        if self.on_select:
+            self.on_select(key)
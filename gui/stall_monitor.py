@@ -0,0 +1,229 @@
+import os
+import json
+import time
+import logging
+import tkinter
+import tkinter.commondialog
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# -------------------------------------------------------------------------
+#                    UI STALL MONITOR (TK MAIN LOOP)
+# -------------------------------------------------------------------------
+# Every Python callback Tk runs (button commands, bindings, after() jobs)
+# goes through tkinter.CallWrapper, which is wrapped here to time it. While
+# a callback runs, calls made through a traced object (the Database) are
+# recorded as child spans. Callbacks slower than the threshold are kept,
+# together with the event-loop lag measured by an after() probe, and can be
+# exported as Chrome trace-event JSON (chrome://tracing, ui.perfetto.dev).
+#
+# Modal dialogs (messagebox, filedialog, simpledialog, CTkInputDialog) run a
+# nested event loop until the user answers. That wait is the user thinking,
+# not the UI being blocked: the time a modal is open is subtracted from
+# every callback running under it, and callbacks run by the nested loop are
+# timed as their own spans.
+MAX_STALLS = 2000
+MAX_LAG_SAMPLES = 10000
+
+_original_call = tkinter.CallWrapper.__call__
+# Entry points of the nested loops: Tk's native dialogs and wait_window/wait_variable
+_original_modals = {
+    (tkinter.commondialog.Dialog, "show"): tkinter.commondialog.Dialog.show,
+    (tkinter.Misc, "wait_window"): tkinter.Misc.wait_window,
+    (tkinter.Misc, "wait_variable"): tkinter.Misc.wait_variable,
+}
+_active = None
+
+
+def _monitored_call(wrapper, *args):
+    monitor = _active
+    if monitor is None or threading.get_ident() != monitor.main_thread:
+        return _original_call(wrapper, *args)
+    with monitor.span(_callback_name(wrapper.func)):
+        return _original_call(wrapper, *args)
+
+
+def _modal(original):
+    def modal(*args, **kwargs):
+        monitor = _active
+        if monitor is None or threading.get_ident() != monitor.main_thread:
+            return original(*args, **kwargs)
+        with monitor.paused():
+            return original(*args, **kwargs)
+
+    return modal
+
+
+def _callback_name(func):
+    # customtkinter widgets bind an internal handler that calls the user's command
+    command = getattr(getattr(func, "__self__", None), "_command", None)
+    if callable(command):
+        func = command
+    return getattr(func, "__qualname__", None) or getattr(func, "__name__", None) or repr(func)
+
+
+class _TracedProxy:
+    """Forwards everything to the wrapped object, timing method calls."""
+
+    __slots__ = ("_target", "_monitor", "_category")
+
+    def __init__(self, target, monitor, category):
+        object.__setattr__(self, "_target", target)
+        object.__setattr__(self, "_monitor", monitor)
+        object.__setattr__(self, "_category", category)
+
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        if name.startswith("_") or not callable(value):
+            return value
+        monitor, category = self._monitor, self._category
+
+        def traced(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return value(*args, **kwargs)
+            finally:
+                monitor._record_call(f"{category}.{name}", category, start, time.perf_counter() - start)
+
+        return traced
+
+    def __setattr__(self, name, value):
+        setattr(self._target, name, value)
+
+
+class StallMonitor:
+    """
+    Watchdog for the Tk event loop of `root`. Callbacks taking at least
+    `threshold_ms` are recorded with the traced calls they made; the loop's
+    lag is sampled every `probe_interval_ms`.
+    """
+
+    def __init__(self, root, threshold_ms=100, probe_interval_ms=100):
+        self.root = root
+        self.threshold = threshold_ms / 1000
+        self.probe_interval_ms = probe_interval_ms
+        self.main_thread = threading.get_ident()
+        self.origin = time.perf_counter()
+        self.stalls = deque(maxlen=MAX_STALLS)           # {"name", "start", "duration", "calls"}
+        self.lag_samples = deque(maxlen=MAX_LAG_SAMPLES)  # (time, lag seconds)
+        self.max_lag = 0.0
+        self._frames = []       # stack of running callbacks: {"calls", "paused", "modal"}
+        self._probe_due = None
+        self._probe_id = None
+
+    # ---- lifecycle --------------------------------------------------------
+    def start(self):
+        global _active
+        _active = self
+        tkinter.CallWrapper.__call__ = _monitored_call
+        for (cls, name), original in _original_modals.items():
+            setattr(cls, name, _modal(original))
+        tkinter.Misc.waitvar = tkinter.Misc.wait_variable
+        self._probe_due = time.perf_counter() + self.probe_interval_ms / 1000
+        self._probe_id = self.root.after(self.probe_interval_ms, self._probe)
+
+    def stop(self):
+        global _active
+        if _active is self:
+            _active = None
+            tkinter.CallWrapper.__call__ = _original_call
+            for (cls, name), original in _original_modals.items():
+                setattr(cls, name, original)
+            tkinter.Misc.waitvar = tkinter.Misc.wait_variable
+        if self._probe_id is not None:
+            self.root.after_cancel(self._probe_id)
+            self._probe_id = None
+
+    def _probe(self):
+        now = time.perf_counter()
+        lag = max(0.0, now - self._probe_due)
+        self.lag_samples.append((now, lag))
+        self.max_lag = max(self.max_lag, lag)
+        self._probe_due = now + self.probe_interval_ms / 1000
+        self._probe_id = self.root.after(self.probe_interval_ms, self._probe)
+
+    # ---- recording -----------------------------------------------------
+    def trace_calls(self, obj, category="db"):
+        """Returns `obj` wrapped so its method calls show up inside stalls."""
+        return _TracedProxy(obj, self, category)
+
+    @contextmanager
+    def span(self, name):
+        """Times a block on the UI thread like a callback (e.g. start-up work)."""
+        frame = {"calls": [], "paused": 0.0, "modal": 0}
+        self._frames.append(frame)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start - frame["paused"]
+            self._frames.pop()
+            if duration >= self.threshold:
+                calls = frame["calls"]
+                self.stalls.append({"name": name, "start": start, "duration": duration, "calls": calls,
+                                    "modal": frame["paused"]})
+                logger.warning("UI stall: '%s' blocked the UI for %.0f ms (%d database calls).",
+                               name, duration * 1000, len(calls))
+
+    @contextmanager
+    def paused(self):
+        """A modal dialog is open: its time is not charged to the callbacks waiting on it."""
+        frames = list(self._frames)
+        for frame in frames:
+            frame["modal"] += 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            for frame in frames:
+                frame["modal"] -= 1
+                frame["paused"] += elapsed
+
+    def _record_call(self, name, category, start, duration):
+        # Calls made while the innermost callback waits on a modal belong to the nested loop, not to it
+        if self._frames and threading.get_ident() == self.main_thread and not self._frames[-1]["modal"]:
+            self._frames[-1]["calls"].append((name, category, start, duration))
+
+    def summary(self, limit=10):
+        """The slowest recorded stalls as (name, ms, number of calls)."""
+        slowest = sorted(self.stalls, key=lambda stall: stall["duration"], reverse=True)[:limit]
+        return [(stall["name"], stall["duration"] * 1000, len(stall["calls"])) for stall in slowest]
+
+    # ---- export --------------------------------------------------------
+    def _us(self, t):
+        return round((t - self.origin) * 1_000_000)
+
+    def export_chrome_trace(self, path):
+        """Writes the stalls and lag samples as Chrome trace-event JSON. Returns the number of stalls."""
+        pid, tid = os.getpid(), self.main_thread
+        events = [
+            {"ph": "M", "name": "process_name", "pid": pid, "tid": tid, "args": {"name": "EMAG"}},
+            {"ph": "M", "name": "thread_name", "pid": pid, "tid": tid, "args": {"name": "Tk main loop"}},
+        ]
+        stalls = list(self.stalls)
+        for stall in stalls:
+            events.append({
+                "ph": "X", "cat": "callback", "name": stall["name"], "pid": pid, "tid": tid,
+                # Wall-clock extent, so the calls made after a modal closed stay inside the box
+                "ts": self._us(stall["start"]),
+                "dur": round((stall["duration"] + stall.get("modal", 0.0)) * 1_000_000),
+                "args": {"database_calls": len(stall["calls"]),
+                         "modal_ms": round(stall.get("modal", 0.0) * 1000, 2)},
+            })
+            for name, category, start, duration in stall["calls"]:
+                events.append({
+                    "ph": "X", "cat": category, "name": name, "pid": pid, "tid": tid,
+                    "ts": self._us(start), "dur": round(duration * 1_000_000),
+                })
+        for sampled_at, lag in list(self.lag_samples):
+            events.append({
+                "ph": "C", "name": "event loop lag", "pid": pid, "tid": tid,
+                "ts": self._us(sampled_at), "args": {"lag_ms": round(lag * 1000, 2)},
+            })
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+        return len(stalls)
@@ -0,0 +1,47 @@
+import os
+import sys
+import argparse
+
+from controllers.product_controller import ProductController
+from utils.logging_config import setup_logging
+
+
+def reject_path_for(rejects, path, several):
+    """--rejects for one of several files: <rejects>.<file name>.csv, so each file keeps its own rejects."""
+    if not rejects or not several:
+        return rejects
+    stem, extension = os.path.splitext(rejects)
+    return f"{stem}.{os.path.splitext(os.path.basename(path))[0]}{extension or '.csv'}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="EMAG - przyjęcie dostawy z pliku dostawcy (CSV/JSON/JSONL) bez GUI."
+    )
+    parser.add_argument("files", nargs="+", help="pliki dostaw")
+    parser.add_argument(
+        "--rejects",
+        help="plik na odrzucone wiersze (domyślnie <plik>.rejects.csv; przy kilku plikach <rejects>.<plik>.csv)",
+    )
+    parser.add_argument("--chunk-size", type=int, default=5000, help="liczba wierszy na jeden zapis")
+    args = parser.parse_args(argv)
+    setup_logging(console_level="INFO")  # the import summary is logged at INFO
+
+    controller = ProductController()
+    exit_code = 0
+    for path in args.files:
+        try:
+            summary = controller.import_delivery_file(
+                path, reject_path=reject_path_for(args.rejects, path, len(args.files) > 1),
+                chunk_size=args.chunk_size,
+            )
+            if summary["rejected"]:
+                exit_code = 2
+        except Exception as e:
+            print(f"Błąd importu dostawy '{path}': {e}")
+            exit_code = 1
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,42 @@
+import sys
+import argparse
+
+from utils.logging_config import setup_logging
+from utils.load_test import DEFAULT_LATENCY, run_sweep, format_report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="EMAG - test obciążeniowy: N symulowanych stanowisk na lokalnym backendzie w pamięci."
+    )
+    parser.add_argument("--stations", default="1,2,4,8",
+                        help="liczby stanowisk, po przecinku (jeden test na każdą)")
+    parser.add_argument("--ops", type=int, default=200, help="operacje na stanowisko")
+    parser.add_argument("--latency-ms", type=float, default=DEFAULT_LATENCY * 1000,
+                        help="symulowany czas odpowiedzi bazy na żądanie")
+    parser.add_argument("--mix", help="udział operacji, np. delivery=3,part_edit=1,build=4,ship=2")
+    parser.add_argument("--seed", type=int, default=0, help="ziarno generatora (powtarzalne scenariusze)")
+    parser.add_argument("--verbose", action="store_true", help="pokaż komunikaty bazy (poziom DEBUG)")
+    args = parser.parse_args(argv)
+    # Per-operation messages of the simulated stations would distort the timings
+    if args.verbose:
+        setup_logging(level="DEBUG", console_level="INFO")
+    else:
+        setup_logging(level="WARNING", console_level="ERROR")
+
+    mix = None
+    if args.mix:
+        mix = {kind: float(weight) for kind, weight in (item.split("=") for item in args.mix.split(","))}
+    reports = run_sweep(
+        [int(count) for count in args.stations.split(",")],
+        ops_per_station=args.ops, mix=mix, latency=args.latency_ms / 1000,
+        seed=args.seed,
+    )
+    for report in reports:
+        print(format_report(report))
+    # Exit code 2 when any run broke a stock invariant, so CI can gate on it
+    return 0 if all(report["invariants"]["ok"] for report in reports) else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
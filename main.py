@@ -1,7 +1,36 @@
-from gui.app_window import run_gui
+import os
+import sys
+import runpy
+import multiprocessing
+
+from utils.update_logic import active_version_dir
+
+
+def run_active_version():
+    """
+    Runs the GUI from the active installed version (see utils.update_logic).
+    Returns False if the active version is this tree itself.
+    """
+    install_root = os.path.dirname(os.path.abspath(__file__))
+    active_dir = os.path.abspath(active_version_dir(install_root))
+    if getattr(sys, "frozen", False) or active_dir == install_root:
+        return False
+
+    # Forget modules imported from this tree so the version's own copies are loaded
+    for name in list(sys.modules):
+        if name.split(".")[0] in ("utils", "config"):
+            del sys.modules[name]
+    sys.path.insert(0, active_dir)
+    runpy.run_path(os.path.join(active_dir, "main.py"), run_name="__main__")
+    return True
+
 
 if __name__ == "__main__":
+    # Label rendering runs in a process pool; frozen builds must not restart the GUI in the workers
+    multiprocessing.freeze_support()
     try:
-        run_gui()
+        if not run_active_version():
+            from gui.app_window import run_gui
+            run_gui()
     except Exception as e:
-        input(f"An error occurred: {e}\nPress Enter to exit...")
\ No newline at end of file
+        input(f"An error occurred: {e}\nPress Enter to exit...")
@@ -0,0 +1,65 @@
+import sys
+import argparse
+
+from database import schema
+from database.db import Database
+from utils.logging_config import setup_logging
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="EMAG - migracja produktów do zwartego schematu 2 bez zatrzymywania stanowisk."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("status", help="pokaż wersję schematu i postęp migracji")
+    estimate = commands.add_parser("estimate", help="porównaj rozmiar danych produktów w schemacie 1 i 2")
+    estimate.add_argument("--page-size", type=int, default=1000, help="liczba węzłów pobieranych na zapytanie")
+    run = commands.add_parser("run", help="przenieś produkty (lub wznów przerwaną migrację)")
+    run.add_argument("--batch-size", type=int, default=schema.MIGRATION_BATCH_SIZE,
+                     help="produkty przenoszone w jednym zapisie")
+    run.add_argument("--workers", type=int, default=schema.MIGRATION_WORKERS, help="równoległe transakcje")
+    run.add_argument("--pause-ms", type=int, default=0, help="przerwa między partiami (odciąża stanowiska)")
+    run.add_argument("--grace", type=float, default=schema.MIGRATION_GRACE_S,
+                     help="sekundy na przełączenie stanowisk w tryb podwójnego odczytu")
+    run.add_argument("--yes", action="store_true", help="nie pytaj o potwierdzenie")
+    args = parser.parse_args(argv)
+    setup_logging(console_level="INFO")
+
+    db = Database()
+    if args.command == "status":
+        status = db.schema_status()
+        migration = status["migration"]
+        print(f"Schemat: {status['version']} (tryb: {status['mode']})")
+        if migration:
+            print(f"Migracja: {migration.get('state')}, przeniesiono {migration.get('migrated', 0)} produktów, "
+                  f"ostatni: {migration.get('cursor')!r}")
+        return 0
+    if args.command == "estimate":
+        report = schema.payload_report(db, page_size=args.page_size)
+        count = max(report["products"], 1)
+        legacy = report["legacy_bytes"] + report["legacy_index_bytes"]
+        compact = report["compact_bytes"] + report["compact_index_bytes"]
+        print(f"Produkty w schemacie 1: {report['products']}")
+        print(f"  węzły produktów: {report['legacy_bytes']} B -> {report['compact_bytes']} B "
+              f"({report['legacy_bytes'] / count:.0f} -> {report['compact_bytes'] / count:.0f} B/produkt)")
+        print(f"  mapa EAN / indeks: {report['legacy_index_bytes']} B -> {report['compact_index_bytes']} B")
+        if legacy:
+            print(f"  razem: {legacy} B -> {compact} B ({compact / legacy:.0%})")
+        return 0
+
+    if not args.yes:
+        answer = input("Rozpocząć migrację produktów do schematu 2? Stanowiska mogą pracować w trakcie. [t/N] ")
+        if answer.strip().lower() not in ("t", "tak", "y", "yes"):
+            print("Przerwano.")
+            return 1
+    totals = db.migrate_schema(
+        batch_size=args.batch_size, workers=args.workers, grace_s=args.grace, pause_s=args.pause_ms / 1000,
+        progress=lambda migrated: print(f"  przeniesiono {migrated} produktów...", flush=True),
+    )
+    print(f"Migracja zakończona: {totals['migrated']} produktów w {totals['batches']} partiach "
+          f"({totals['seconds']:.1f} s).")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
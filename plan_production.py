@@ -0,0 +1,66 @@
+import sys
+import csv
+import argparse
+
+from controllers.product_controller import ProductController
+from utils.logging_config import setup_logging
+
+PRODUCT_COLUMNS = ("product", "produkt", "name", "nazwa")
+QUANTITY_COLUMNS = ("quantity", "qty", "ilosc", "ilość")
+DUE_COLUMNS = ("due", "termin", "date", "data")
+
+
+def _pick(row, names):
+    lowered = {str(k).strip().lower(): v for k, v in row.items() if k is not None}
+    return next((lowered[name] for name in names if lowered.get(name) not in (None, "")), None)
+
+
+def read_demand(path):
+    """Zamówienia z pliku CSV: produkt, ilość, termin (RRRR-MM-DD)."""
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        sample = f.read(4096)
+        f.seek(0)
+        dialect = csv.Sniffer().sniff(sample, delimiters=",;\t") if sample else csv.excel
+        return [
+            {"product": _pick(row, PRODUCT_COLUMNS), "quantity": int(_pick(row, QUANTITY_COLUMNS)),
+             "due": _pick(row, DUE_COLUMNS)}
+            for row in csv.DictReader(f, dialect=dialect)
+        ]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="EMAG - plan produkcji (MRP): harmonogram budowy i lista zakupów części dla zamówień."
+    )
+    parser.add_argument("demand", help="plik CSV z zamówieniami (produkt, ilość, termin)")
+    parser.add_argument("--start", help="początek planu (RRRR-MM-DD, domyślnie dziś)")
+    parser.add_argument("--bucket-days", type=int, default=7, help="długość okresu planowania w dniach")
+    parser.add_argument("--horizon", type=int, default=12, help="liczba okresów planowania")
+    parser.add_argument("--lead", type=int, default=0, help="czas budowy w okresach")
+    args = parser.parse_args(argv)
+    setup_logging()
+
+    controller = ProductController()
+    controller.planner.bucket_days = args.bucket_days
+    controller.planner.horizon_buckets = args.horizon
+    controller.planner.lead_buckets = args.lead
+    try:
+        plan = controller.plan_production(read_demand(args.demand), start=args.start)
+    except Exception as e:
+        print(f"Błąd planowania: {e}")
+        return 1
+
+    print("Harmonogram budowy:")
+    for row in plan["schedule"]:
+        print(f"  {row['period']}  {row['product']}: {row['quantity']}")
+    print("Lista zakupów:")
+    for row in plan["purchases"]:
+        print(f"  {row['part']}: {row['quantity']} (potrzebne od {row['needed_by']})")
+    if plan["unknown_products"] or plan["beyond_horizon"]:
+        print(f"Pominięte zamówienia: nieznany produkt {len(plan['unknown_products'])}, "
+              f"poza horyzontem {len(plan['beyond_horizon'])}")
+    return 2 if plan["purchases"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,57 @@
+import sys
+import json
+import argparse
+
+from server.rtdb_emulator import InjectionConfig, RTDBEmulator, run_emulator
+from utils.logging_config import setup_logging
+from utils.wan_benchmark import DEFAULT_PROFILES, run_benchmark, format_report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="EMAG - lokalny zamiennik Firebase Realtime Database z symulacją opóźnień i awarii sieci. "
+                    "Aplikacja łączy się z nim przez FIREBASE_DATABASE_EMULATOR_HOST=host:port."
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="adres nasłuchu")
+    parser.add_argument("--port", type=int, default=9000, help="port HTTP")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="czas odpowiedzi na żądanie (ms)")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="losowe odchylenie czasu odpowiedzi (ms)")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="udział żądań odrzucanych kodem 503 (0-1)")
+    parser.add_argument("--drop-rate", type=float, default=0.0,
+                        help="udział zapisów wykonanych bez wysłania odpowiedzi (0-1)")
+    parser.add_argument("--seed", type=int, help="ziarno generatora (powtarzalne scenariusze)")
+    parser.add_argument("--data", help="plik JSON z początkową zawartością bazy")
+    parser.add_argument("--bench", action="store_true",
+                        help="zamiast serwera: pomiar zamknięcia dostawy, usunięcia produktu i korekty części "
+                             "dla profili sieci lan / wan / mobile")
+    parser.add_argument("--profiles", help="profile do pomiaru, po przecinku (domyślnie wszystkie)")
+    parser.add_argument("--repeats", type=int, default=20, help="powtórzenia każdej operacji w profilu")
+    parser.add_argument("--log-level", help="poziom logowania (DEBUG, INFO, WARNING, ERROR)")
+    args = parser.parse_args(argv)
+
+    if args.bench:
+        setup_logging(level=args.log_level or "WARNING", console_level=args.log_level or "ERROR")
+        profiles = DEFAULT_PROFILES
+        if args.profiles:
+            names = [name.strip() for name in args.profiles.split(",")]
+            unknown = [name for name in names if name not in DEFAULT_PROFILES]
+            if unknown:
+                parser.error(f"nieznane profile: {', '.join(unknown)}")
+            profiles = {name: DEFAULT_PROFILES[name] for name in names}
+        for report in run_benchmark(profiles, repeats=args.repeats, seed=args.seed or 0, host=args.host):
+            print(format_report(report))
+        return 0
+
+    setup_logging(level=args.log_level, console_level=args.log_level or "INFO")
+    data = None
+    if args.data:
+        with open(args.data, encoding="utf-8") as f:
+            data = json.load(f)
+    config = InjectionConfig(args.latency_ms, args.jitter_ms, args.error_rate, args.drop_rate, seed=args.seed)
+    run_emulator(args.host, args.port, RTDBEmulator(config, data))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
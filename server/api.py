@@ -0,0 +1,218 @@
+import os
+import hmac
+import json
+import queue
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from controllers.product_controller import ProductController
+from database.errors import StaleProductError
+from server.methods import READ_METHODS, WRITE_METHODS
+
+logger = logging.getLogger(__name__)
+
+# -------------------------------------------------------------------------
+#                     HEADLESS EMAG SERVICE (LAN API)
+# -------------------------------------------------------------------------
+# One process owns the Database (and its Firebase connection, catalogue,
+# aggregates and caches). GUI clients and scanner stations call it over
+# HTTP instead of talking to Firebase themselves:
+#
+#   POST /rpc/<method>   {"args": [...], "kwargs": {...}} -> {"result": ...}
+#   GET  /events         Server-Sent Events stream of every change
+#   GET  /health
+#
+# Writes are serialized by one lock, so read-modify-write methods such as
+# update_part_quantity can no longer race between stations.
+#
+# The service listens on 127.0.0.1 unless told otherwise. Write methods
+# need the shared token (EMAG_SERVICE_TOKEN) in "Authorization: Bearer";
+# without a configured token they are only accepted from this machine.
+
+# Full trees served from memory for this long after a load; writes through
+# the service invalidate immediately, the TTL covers writers outside it.
+CACHE_TTL_SECONDS = 30
+SUBSCRIBER_QUEUE_SIZE = 1000
+LOOPBACK_ADDRESSES = {"127.0.0.1", "::1", "localhost"}
+# Incremental integrity check of what changed since the previous one
+INTEGRITY_CHECK_INTERVAL_S = 300
+
+
+class EMAGService:
+    """The shared Database + ProductController with a warm read cache and change feed."""
+
+    def __init__(self, controller=None, token=None):
+        self.controller = controller or ProductController()
+        self.db = self.controller.db
+        self.token = token if token is not None else (os.getenv("EMAG_SERVICE_TOKEN") or None)
+        self.write_lock = threading.Lock()
+        self.cache = {}          # method -> (loaded_at, result)
+        self.subscribers = set()
+        self.subscribers_lock = threading.Lock()
+        self.sequence = 0
+
+    def warm_up(self):
+        for method in ("load_inventory", "load_products"):
+            self.call(method, [], {})
+        logger.info("Service cache warmed up.")
+
+    @staticmethod
+    def exposes(method):
+        return method == "aggregates.snapshot" or method in READ_METHODS or method in WRITE_METHODS
+
+    def may_write(self, client_host, authorization):
+        """Write methods: the shared token if one is set, otherwise callers on this machine only."""
+        if self.token:
+            return hmac.compare_digest(authorization or "", f"Bearer {self.token}")
+        return client_host in LOOPBACK_ADDRESSES
+
+    def call(self, method, args, kwargs):
+        if method == "aggregates.snapshot":
+            return self.db.aggregates.snapshot()
+        if method in READ_METHODS:
+            if method in ("load_inventory", "load_products") and not args and not kwargs:
+                cached = self.cache.get(method)
+                if cached and time.monotonic() - cached[0] < CACHE_TTL_SECONDS:
+                    return cached[1]
+                result = getattr(self.db, method)()
+                self.cache[method] = (time.monotonic(), result)
+                return result
+            return getattr(self.db, method)(*args, **kwargs)
+        if method in WRITE_METHODS:
+            with self.write_lock:
+                result = getattr(self.db, method)(*args, **kwargs)
+                self.cache.clear()
+                self.publish({"method": method, "args": args, "kwargs": kwargs})
+            return result
+        raise KeyError(f"Unknown or not exposed method: {method}")
+
+    def start_integrity_checks(self, interval=INTEGRITY_CHECK_INTERVAL_S):
+        """Runs check_integrity(incremental=True) every `interval` seconds in the background."""
+        def loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    issues = self.db.check_integrity(incremental=True)
+                    if issues:
+                        logger.warning("Integrity check found %d issues (repair them from the settings view).",
+                                       len(issues))
+                except Exception:
+                    logger.exception("Periodic integrity check failed")
+
+        threading.Thread(target=loop, name="integrity-check", daemon=True).start()
+
+    # ---- change feed ----------------------------------------------------
+    def subscribe(self):
+        subscriber = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self.subscribers_lock:
+            self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.subscribers_lock:
+            self.subscribers.discard(subscriber)
+
+    def publish(self, event):
+        with self.subscribers_lock:
+            self.sequence += 1
+            event = {"seq": self.sequence, **event}
+            for subscriber in list(self.subscribers):
+                try:
+                    subscriber.put_nowait(event)
+                except queue.Full:
+                    # A stalled client loses its feed; it reloads when it reconnects
+                    self.subscribers.discard(subscriber)
+
+
+def make_handler(service):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            logger.debug("%s %s", self.address_string(), format % args)
+
+        def _send_json(self, status, payload):
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/health":
+                self._send_json(200, {"status": "ok", "subscribers": len(service.subscribers)})
+            elif self.path == "/events":
+                self._stream_events()
+            else:
+                self._send_json(404, {"error": "not found"})
+
+        def do_POST(self):
+            if not self.path.startswith("/rpc/"):
+                self._send_json(404, {"error": "not found"})
+                return
+            method = self.path[len("/rpc/"):]
+            # Looked up before the call, so a KeyError raised inside a method is a 500, not a 404
+            if not service.exposes(method):
+                self._send_json(404, {"error": f"Unknown or not exposed method: {method}"})
+                return
+            if method in WRITE_METHODS and not service.may_write(
+                    self.client_address[0], self.headers.get("Authorization")):
+                self._send_json(403, {"error": "Write methods need the service token."})
+                return
+            try:
+                length = int(self.headers.get("Content-Length") or 0)
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                result = service.call(method, payload.get("args", []), payload.get("kwargs", {}))
+                self._send_json(200, {"result": result})
+            except StaleProductError as e:
+                self._send_json(409, {
+                    "error": str(e), "type": "StaleProductError",
+                    "product_name": e.product_name, "current": e.current,
+                })
+            except ValueError as e:
+                self._send_json(400, {"error": str(e), "type": "ValueError"})
+            except Exception as e:
+                logger.exception("RPC '%s' failed", method)
+                self._send_json(500, {"error": str(e)})
+
+        def _stream_events(self):
+            subscriber = service.subscribe()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.end_headers()
+            try:
+                while True:
+                    try:
+                        event = subscriber.get(timeout=15)
+                        data = json.dumps(event, ensure_ascii=False)
+                        self.wfile.write(f"id: {event['seq']}\ndata: {data}\n\n".encode("utf-8"))
+                    except queue.Empty:
+                        self.wfile.write(b": keep-alive\n\n")
+                    self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            finally:
+                service.unsubscribe(subscriber)
+
+    return Handler
+
+
+def run_service(host="127.0.0.1", port=8765, service=None, token=None):
+    service = service or EMAGService(token=token)
+    if host not in LOOPBACK_ADDRESSES and not service.token:
+        logger.warning("EMAG service on %s without EMAG_SERVICE_TOKEN: other stations can only read.", host)
+    service.warm_up()
+    service.start_integrity_checks()
+    server = ThreadingHTTPServer((host, port), make_handler(service))
+    server.daemon_threads = True
+    logger.info("EMAG service listening on http://%s:%d", host, port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,89 @@
+import os
+import logging
+import json
+import threading
+import urllib.error
+import urllib.request
+
+from database.errors import StaleProductError
+from server.methods import READ_METHODS, WRITE_METHODS
+
+logger = logging.getLogger(__name__)
+
+
+class ServiceError(Exception):
+    """Raised when the EMAG service rejects or fails a call."""
+
+
+class _RemoteAggregates:
+    def __init__(self, client):
+        self.client = client
+
+    def snapshot(self):
+        return self.client.call("aggregates.snapshot")
+
+
+class RemoteDatabase:
+    """
+    Drop-in stand-in for Database that forwards calls to an EMAG service
+    (server/api.py) on the LAN instead of talking to Firebase.
+    """
+
+    def __init__(self, base_url, timeout=10, token=None):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.token = token or os.getenv("EMAG_SERVICE_TOKEN") or None
+        self.location = os.getenv("EMAG_LOCATION") or None
+        self.aggregates = _RemoteAggregates(self)
+
+    def call(self, method, *args, **kwargs):
+        body = json.dumps({"args": args, "kwargs": kwargs}).encode("utf-8")
+        headers = {"Content-Type": "application/json"}
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        request = urllib.request.Request(
+            f"{self.base_url}/rpc/{method}", data=body, headers=headers, method="POST",
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read())["result"]
+        except urllib.error.HTTPError as e:
+            payload = json.loads(e.read() or b"{}")
+            if payload.get("type") == "ValueError":
+                raise ValueError(payload.get("error"))
+            if payload.get("type") == "StaleProductError":
+                raise StaleProductError(payload.get("product_name"), payload.get("current"))
+            raise ServiceError(payload.get("error", str(e)))
+
+    def update_product_in_firebase(self, product):
+        """Keeps the caller's dict current (new ETag) like Database does."""
+        written = self.call("update_product_in_firebase", product)
+        if written:
+            product.update(written)
+        return written
+
+    def __getattr__(self, name):
+        if name in READ_METHODS or name in WRITE_METHODS:
+            return lambda *args, **kwargs: self.call(name, *args, **kwargs)
+        raise AttributeError(name)
+
+    def subscribe(self, callback):
+        """
+        Calls callback(event) for every change made through the service, on a
+        background thread. Reconnects automatically; returns the thread.
+        """
+        def listen():
+            while True:
+                try:
+                    with urllib.request.urlopen(f"{self.base_url}/events") as response:
+                        for raw_line in response:
+                            line = raw_line.decode("utf-8").strip()
+                            if line.startswith("data: "):
+                                callback(json.loads(line[len("data: "):]))
+                except Exception as e:
+                    logger.warning("Service event stream interrupted: %s", e)
+                    threading.Event().wait(2)
+
+        thread = threading.Thread(target=listen, daemon=True, name="emag-events")
+        thread.start()
+        return thread
@@ -0,0 +1,47 @@
+# Database methods the EMAG service exposes (shared by server and client).
+READ_METHODS = {
+    "load_inventory",
+    "load_products",
+    "load_product",
+    "load_location",
+    "load_ean_codes",
+    "list_locations",
+    "load_bins",
+    "get_total_quantity",
+    "verify_ean_in_firebase",
+    "verify_product_ean_in_firebase",
+    "check_aggregates",
+    "load_aggregates",
+    "check_integrity",
+    "list_open_stocktakes",
+    "stocktake_diff",
+    "open_lots",
+    "trace_build",
+    "trace_shipment",
+    "where_used",
+    "schema_status",
+}
+WRITE_METHODS = {
+    "add_part",
+    "apply_part_deltas",
+    "update_part_quantity",
+    "apply_location_deltas",
+    "adjust_location_quantity",
+    "transfer_part",
+    "set_bin",
+    "add_ean_to_firebase",
+    "add_product_ean_to_firebase",
+    "add_product_to_firebase",
+    "update_product_in_firebase",
+    "delete_product",
+    "migrate_to_part_ids",
+    "repair_integrity",
+    "start_stocktake",
+    "record_stocktake_counts",
+    "commit_stocktake",
+    "receive_lots",
+    "build_with_lots",
+    "ship_lots",
+    "dismantle_lots",
+    "change_product_quantity",
+}
@@ -0,0 +1,432 @@
+import copy
+import json
+import queue
+import random
+import logging
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, unquote
+
+from database.memory_backend import MemoryBackend, _etag, _split
+
+logger = logging.getLogger(__name__)
+
+# -------------------------------------------------------------------------
+#            LOCAL REALTIME DATABASE STAND-IN (REST + STREAMING)
+# -------------------------------------------------------------------------
+# Serves the part of the Realtime Database REST API that firebase_admin
+# uses in this app, over MemoryBackend trees (one per namespace, ?ns=...):
+#
+#   GET    /<path>.json   shallow=true, orderBy + startAt / endAt / equalTo /
+#                         limitToFirst / limitToLast, X-Firebase-ETag: true
+#   GET    /<path>.json   Accept: text/event-stream -> put / patch events
+#   PUT    /<path>.json   if-match: <etag> -> 412 + current value on mismatch
+#   PATCH  /<path>.json   multi-path update (server values resolved)
+#   DELETE /<path>.json
+#   GET|PATCH  /.emulator/config   latency / jitter / failure injection
+#   GET|DELETE /.emulator/stats    request counters (DELETE resets them)
+#
+# Point the app at it with FIREBASE_DATABASE_EMULATOR_HOST=host:port
+# (firebase_admin then skips authentication; the namespace is the first
+# label of FIREBASE_DATABASE_URL). Every request is delayed by `latency_ms`
+# +/- `jitter_ms`, half before and half after it takes effect, so WAN round
+# trips can be reproduced offline. `error_rate` answers 503 without doing
+# anything (firebase_admin retries those); `drop_rate` applies a write and
+# then closes the connection without an answer: the lost acknowledgement
+# that makes the client resend a write it cannot tell was applied.
+DEFAULT_NAMESPACE = "default"
+KEEP_ALIVE_SECONDS = 30
+LISTENER_QUEUE_SIZE = 1000
+CONTROL_PREFIX = "/.emulator/"  # "." is not allowed in database keys, so no clash
+
+
+class InjectionConfig:
+    """Simulated network conditions; changed at runtime through /.emulator/config."""
+
+    FIELDS = ("latency_ms", "jitter_ms", "error_rate", "drop_rate")
+
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0, drop_rate=0.0, seed=None):
+        self.latency_ms = self.jitter_ms = self.error_rate = self.drop_rate = 0.0
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.update({"latency_ms": latency_ms, "jitter_ms": jitter_ms,
+                     "error_rate": error_rate, "drop_rate": drop_rate})
+
+    def update(self, values):
+        unknown = set(values) - set(self.FIELDS) - {"seed"}
+        if unknown:
+            raise ValueError(f"Unknown settings: {', '.join(sorted(unknown))}")
+        with self.lock:
+            for field in self.FIELDS:
+                if field in values:
+                    value = float(values[field])
+                    if value < 0 or (field.endswith("_rate") and value > 1):
+                        raise ValueError(f"Invalid value for {field}: {value}")
+                    setattr(self, field, value)
+            if "seed" in values:
+                self.rng.seed(values["seed"])
+
+    def as_dict(self):
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    def one_way_delay(self):
+        """Seconds for half a round trip, jitter included."""
+        with self.lock:
+            delay = self.latency_ms + self.rng.uniform(-self.jitter_ms, self.jitter_ms)
+        return max(delay, 0.0) / 2000
+
+    def roll(self, rate_field):
+        with self.lock:
+            rate = getattr(self, rate_field)
+            return bool(rate) and self.rng.random() < rate
+
+
+class _Listener:
+    def __init__(self, namespace, parts):
+        self.namespace = namespace
+        self.parts = parts
+        self.events = queue.Queue(maxsize=LISTENER_QUEUE_SIZE)
+
+
+class RTDBEmulator:
+    """Namespaced in-memory trees, the change fan-out to listeners, and the injection settings."""
+
+    def __init__(self, config=None, data=None):
+        self.config = config or InjectionConfig()
+        self.namespaces = {}
+        self.namespaces_lock = threading.Lock()
+        self.listeners = set()
+        self.listeners_lock = threading.Lock()
+        self.stats = Counter()  # requests by method, injected_errors, dropped_acks, events
+        self.initial_data = data
+
+    def namespace(self, name=DEFAULT_NAMESPACE):
+        """The MemoryBackend holding namespace `name` (created on first use)."""
+        with self.namespaces_lock:
+            store = self.namespaces.get(name)
+            if store is None:
+                store = self.namespaces[name] = MemoryBackend(self.initial_data)
+            return store
+
+    # ---- writes (each one atomic, events computed under the same lock) -
+    def put(self, namespace, parts, value, expected_etag=None):
+        """Returns (stored value, etag) or, when `expected_etag` does not match, (None, current, etag)."""
+        store = self.namespace(namespace)
+        with store.lock:
+            current = store._get(parts)
+            if expected_etag is not None and _etag(current) != expected_etag:
+                store.stats["etag_conflicts"] += 1
+                return None, copy.deepcopy(current), _etag(current)
+            store.stats["set"] += 1
+            store._set(parts, store._resolve(value, current))
+            stored = copy.deepcopy(store._get(parts))
+            self._publish(namespace, store, parts, None)
+            return True, stored, _etag(stored)
+
+    def patch(self, namespace, parts, value):
+        if not isinstance(value, dict) or not value:
+            raise ValueError("PATCH body must be a non-empty object.")
+        store = self.namespace(namespace)
+        with store.lock:
+            store.stats["update"] += 1
+            for path, child in value.items():
+                child_parts = parts + _split(path)
+                store._set(child_parts, store._resolve(child, store._get(child_parts)))
+            self._publish(namespace, store, parts, list(value))
+            return {path: copy.deepcopy(store._get(parts + _split(path))) for path in value}
+
+    # ---- listeners -----------------------------------------------------
+    def listen(self, namespace, parts):
+        listener = _Listener(namespace, parts)
+        store = self.namespace(namespace)
+        with store.lock:
+            # Registered and primed under the lock: no write falls between the two
+            with self.listeners_lock:
+                self.listeners.add(listener)
+            listener.events.put(("put", {"path": "/", "data": copy.deepcopy(store._get(parts))}))
+        return listener
+
+    def unlisten(self, listener):
+        with self.listeners_lock:
+            self.listeners.discard(listener)
+
+    def _publish(self, namespace, store, parts, patch_paths):
+        """Queues the events a write at `parts` (a PATCH when `patch_paths` is given) means for each listener."""
+        with self.listeners_lock:
+            listeners = [listener for listener in self.listeners if listener.namespace == namespace]
+        for listener in listeners:
+            event = self._event_for(store, listener.parts, parts, patch_paths)
+            if event is None:
+                continue
+            try:
+                listener.events.put_nowait(event)
+                self.stats["events"] += 1
+            except queue.Full:
+                # A stalled listener is cut off; the client reconnects and gets a fresh snapshot
+                self.unlisten(listener)
+
+    @staticmethod
+    def _event_for(store, listening, written, patch_paths):
+        depth = len(listening)
+        if written[:depth] == listening:
+            # Write at or below the listened location: relative path and the new data
+            relative = "/" + "/".join(written[depth:])
+            if patch_paths is None:
+                return "put", {"path": relative, "data": copy.deepcopy(store._get(written))}
+            data = {path: copy.deepcopy(store._get(written + _split(path))) for path in patch_paths}
+            return "patch", {"path": relative, "data": data}
+        # Write above the listened location: resend it whole if it was touched
+        targets = [written] if patch_paths is None else [written + _split(path) for path in patch_paths]
+        for target in targets:
+            common = min(len(target), depth)
+            if target[:common] == listening[:common]:
+                return "put", {"path": "/", "data": copy.deepcopy(store._get(listening))}
+        return None
+
+    # ---- reads ---------------------------------------------------------
+    def get(self, namespace, parts, params, etag=False):
+        store = self.namespace(namespace)
+        reference = store.reference("/".join(parts))
+        if "orderBy" in params:
+            return self._query(reference, params), None
+        if params.get("shallow") == "true":
+            if etag:
+                raise ValueError("etag and shallow cannot both be set.")
+            return reference.get(shallow=True), None
+        if etag:
+            return reference.get(etag=True)
+        return reference.get(), None
+
+    @staticmethod
+    def _query(reference, params):
+        def param(name):
+            return json.loads(params[name]) if name in params else None
+
+        order_by = param("orderBy")
+        if order_by == "$key":
+            query = reference.order_by_key()
+        elif order_by == "$value":
+            query = reference.order_by_value()
+        elif isinstance(order_by, str) and order_by:
+            query = reference.order_by_child(order_by)
+        else:
+            raise ValueError(f"Invalid orderBy: {params['orderBy']}")
+        if "equalTo" in params:
+            query.equal_to(param("equalTo"))
+        if "startAt" in params:
+            query.start_at(param("startAt"))
+        if "endAt" in params:
+            query.end_at(param("endAt"))
+        if "limitToFirst" in params:
+            query.limit_to_first(int(params["limitToFirst"]))
+        if "limitToLast" in params:
+            query.limit_to_last(int(params["limitToLast"]))
+        return query.get()
+
+    def snapshot(self, namespace=DEFAULT_NAMESPACE):
+        return self.namespace(namespace).snapshot()
+
+    def stats_snapshot(self):
+        with self.namespaces_lock:
+            namespaces = {name: dict(store.stats) for name, store in self.namespaces.items()}
+        return {"emulator": dict(self.stats), "namespaces": namespaces, "listeners": len(self.listeners)}
+
+    def reset_stats(self):
+        self.stats.clear()
+        with self.namespaces_lock:
+            for store in self.namespaces.values():
+                store.stats.clear()
+
+
+class _DroppedConnection(Exception):
+    """The write was applied but the answer is never sent (injected lost acknowledgement)."""
+
+
+def make_handler(emulator):
+    config = emulator.config
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # Headers and body go out in separate writes; with Nagle on, every
+        # response with a body would wait for the client's delayed ACK (~40 ms)
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            logger.debug("%s %s", self.address_string(), format % args)
+
+        # ---- plumbing --------------------------------------------------
+        def _target(self):
+            url = urlsplit(self.path)
+            params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            path = unquote(url.path)
+            if path.endswith(".json"):
+                path = path[:-len(".json")]
+            return params.pop("ns", DEFAULT_NAMESPACE), _split(path), params
+
+        def _body(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            return json.loads(self.rfile.read(length) or b"null")
+
+        def _send_json(self, status, payload, headers=None, silent=False):
+            body = b"" if silent else json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(204 if silent and status == 200 else status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _handle(self, method, operation):
+            """Runs one database request under the injected network conditions."""
+            emulator.stats[method] += 1
+            time.sleep(config.one_way_delay())
+            if config.roll("error_rate"):
+                emulator.stats["injected_errors"] += 1
+                self._send_json(503, {"error": "Service unavailable (injected)."})
+                return
+            try:
+                status, payload, headers, silent = operation()
+            except ValueError as e:
+                status, payload, headers, silent = 400, {"error": str(e)}, None, False
+            except Exception as e:
+                logger.exception("%s %s failed", method, self.path)
+                status, payload, headers, silent = 500, {"error": str(e)}, None, False
+            if method != "GET" and status < 400 and config.roll("drop_rate"):
+                emulator.stats["dropped_acks"] += 1
+                self.close_connection = True
+                raise _DroppedConnection()
+            time.sleep(config.one_way_delay())
+            self._send_json(status, payload, headers, silent)
+
+        def _dispatch(self, method, operation):
+            try:
+                self._handle(method, operation)
+            except _DroppedConnection:
+                pass
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+        # ---- REST verbs ------------------------------------------------
+        def do_GET(self):
+            if self.path.startswith(CONTROL_PREFIX):
+                self._control("GET")
+                return
+            namespace, parts, params = self._target()
+            if "text/event-stream" in (self.headers.get("Accept") or ""):
+                self._stream(namespace, parts)
+                return
+
+            def read():
+                want_etag = (self.headers.get("X-Firebase-ETag") or "").lower() == "true"
+                value, etag = emulator.get(namespace, parts, params, etag=want_etag)
+                return 200, value, {"ETag": etag} if etag else None, False
+
+            self._dispatch("GET", read)
+
+        def do_PUT(self):
+            namespace, parts, params = self._target()
+
+            def write():
+                written, value, etag = emulator.put(namespace, parts, self._body(), self.headers.get("if-match"))
+                if written is None:
+                    return 412, value, {"ETag": etag}, False
+                return 200, value, {"ETag": etag}, params.get("print") == "silent"
+
+            self._dispatch("PUT", write)
+
+        def do_PATCH(self):
+            if self.path.startswith(CONTROL_PREFIX):
+                self._control("PATCH")
+                return
+            namespace, parts, params = self._target()
+
+            def write():
+                value = emulator.patch(namespace, parts, self._body())
+                return 200, value, None, params.get("print") == "silent"
+
+            self._dispatch("PATCH", write)
+
+        def do_DELETE(self):
+            if self.path.startswith(CONTROL_PREFIX):
+                self._control("DELETE")
+                return
+            namespace, parts, params = self._target()
+
+            def write():
+                emulator.put(namespace, parts, None)
+                return 200, None, None, params.get("print") == "silent"
+
+            self._dispatch("DELETE", write)
+
+        # ---- streaming -------------------------------------------------
+        def _stream(self, namespace, parts):
+            emulator.stats["LISTEN"] += 1
+            listener = emulator.listen(namespace, parts)
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.end_headers()
+            try:
+                while True:
+                    try:
+                        kind, data = listener.events.get(timeout=KEEP_ALIVE_SECONDS)
+                        time.sleep(config.one_way_delay())
+                        payload = json.dumps(data, ensure_ascii=False)
+                    except queue.Empty:
+                        kind, payload = "keep-alive", "null"
+                    self.wfile.write(f"event: {kind}\ndata: {payload}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            finally:
+                emulator.unlisten(listener)
+
+        # ---- control endpoints (not delayed, never fail) ---------------
+        def _control(self, method):
+            name = urlsplit(self.path).path[len(CONTROL_PREFIX):]
+            try:
+                if name == "config" and method == "GET":
+                    self._send_json(200, config.as_dict())
+                elif name == "config" and method == "PATCH":
+                    config.update(self._body() or {})
+                    logger.info("Emulator conditions changed: %s", config.as_dict())
+                    self._send_json(200, config.as_dict())
+                elif name == "stats" and method == "GET":
+                    self._send_json(200, emulator.stats_snapshot())
+                elif name == "stats" and method == "DELETE":
+                    emulator.reset_stats()
+                    self._send_json(200, None)
+                else:
+                    self._send_json(404, {"error": "not found"})
+            except ValueError as e:
+                self._send_json(400, {"error": str(e)})
+
+    return Handler
+
+
+def start_emulator(host="127.0.0.1", port=9000, emulator=None):
+    """Starts the emulator on a background thread; returns (server, emulator). port=0 picks a free port."""
+    emulator = emulator or RTDBEmulator()
+    server = ThreadingHTTPServer((host, port), make_handler(emulator))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="rtdb-emulator", daemon=True).start()
+    logger.info("Realtime Database emulator listening on http://%s:%d (%s)",
+                host, server.server_address[1], emulator.config.as_dict())
+    return server, emulator
+
+
+def run_emulator(host="127.0.0.1", port=9000, emulator=None):
+    emulator = emulator or RTDBEmulator()
+    server = ThreadingHTTPServer((host, port), make_handler(emulator))
+    server.daemon_threads = True
+    logger.info("Realtime Database emulator listening on http://%s:%d (%s)",
+                host, port, emulator.config.as_dict())
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,26 @@
+import sys
+import argparse
+
+from server.api import run_service
+from utils.logging_config import setup_logging
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="EMAG - usługa magazynowa dla stanowisk w sieci lokalnej (bez GUI)."
+    )
+    parser.add_argument(
+        "--host", default="127.0.0.1",
+        help="adres nasłuchu (0.0.0.0 udostępnia usługę w sieci; zapisy wymagają wtedy EMAG_SERVICE_TOKEN)",
+    )
+    parser.add_argument("--port", type=int, default=8765, help="port HTTP")
+    parser.add_argument("--token", help="wspólny token dla zapisów (domyślnie EMAG_SERVICE_TOKEN)")
+    parser.add_argument("--log-level", help="poziom logowania (DEBUG, INFO, WARNING, ERROR)")
+    args = parser.parse_args(argv)
+    setup_logging(level=args.log_level, console_level=args.log_level or "INFO")
+    run_service(args.host, args.port, token=args.token)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
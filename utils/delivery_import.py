@@ -0,0 +1,236 @@
+import os
+import csv
+import json
+
+from utils.helpers import is_valid_ean
+
+# -------------------------------------------------------------------------
+#                     SUPPLIER DELIVERY FILE IMPORT
+# -------------------------------------------------------------------------
+# Supplier files are read row by row and never loaded as a whole; only the
+# per-part totals of the current chunk are kept in memory.
+EAN_COLUMNS = ("ean", "kod", "kod_ean", "barcode", "gtin")
+QUANTITY_COLUMNS = ("quantity", "qty", "ilosc", "ilość")
+DEFAULT_CHUNK_SIZE = 5000
+# Stands in for a JSON row that could not be decoded; such rows are rejected, the rest is imported
+MALFORMED_ROW = object()
+
+
+def _pick(row, names):
+    """Returns the first non-empty value of `row` under any of `names` (case-insensitive)."""
+    lowered = {str(k).strip().lower(): v for k, v in row.items() if k is not None}
+    for name in names:
+        value = lowered.get(name)
+        if value not in (None, ""):
+            return value
+    return None
+
+
+def _iter_csv(path):
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        sample = f.read(4096)
+        f.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+        except csv.Error:
+            dialect = csv.excel
+        for line_no, row in enumerate(csv.DictReader(f, dialect=dialect), start=2):
+            yield line_no, row
+
+
+def _iter_json_lines(path):
+    # Binary lines: a line that is not valid JSON (or not UTF-8) is rejected on its own
+    with open(path, "rb") as f:
+        for line_no, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield line_no, json.loads(line)
+            except ValueError:
+                yield line_no, MALFORMED_ROW
+
+
+def _item_end(buffer):
+    """Index of the comma or bracket closing the first array item in `buffer`, or None if it is cut off."""
+    depth = 0
+    in_string = escaped = False
+    for i, char in enumerate(buffer):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "[{":
+            depth += 1
+        elif char in "]}":
+            if depth == 0:
+                return i
+            depth -= 1
+        elif char == "," and depth == 0:
+            return i
+    return None
+
+
+def _iter_json_array(path, buffer_size=65536):
+    """
+    Yields the items of a top-level JSON array without parsing the whole file.
+    An item that does not decode is skipped up to the next top-level comma
+    and yielded as MALFORMED_ROW.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8-sig") as f:
+        buffer = f.read(buffer_size).lstrip()
+        if not buffer.startswith("["):
+            raise ValueError("JSON delivery file must contain an array of rows")
+        buffer = buffer[1:]
+        index = 0
+        while True:
+            buffer = buffer.lstrip().lstrip(",").lstrip()
+            if buffer.startswith("]"):
+                return
+            try:
+                item, end = decoder.raw_decode(buffer)
+            except ValueError:
+                # Either the item continues past the buffer or it is malformed
+                end = _item_end(buffer)
+                more = f.read(buffer_size) if end is None else ""
+                if more:
+                    buffer += more
+                    continue
+                index += 1
+                yield index, MALFORMED_ROW
+                if end is None:
+                    return   # cut off at the end of the file
+                buffer = buffer[end:]
+                continue
+            index += 1
+            yield index, item
+            buffer = buffer[end:]
+            if len(buffer) < buffer_size:
+                buffer += f.read(buffer_size)
+
+
+def iter_delivery_rows(path):
+    """
+    Generator over a supplier delivery file (.csv, .json or .jsonl).
+    Yields (line_no, ean, quantity_raw, raw_row) without validating;
+    raw_row is MALFORMED_ROW for JSON that does not decode.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".csv":
+        rows = _iter_csv(path)
+    elif extension in (".jsonl", ".ndjson"):
+        rows = _iter_json_lines(path)
+    elif extension == ".json":
+        rows = _iter_json_array(path)
+    else:
+        raise ValueError(f"Nieobsługiwany format pliku dostawy: {extension}")
+
+    for line_no, row in rows:
+        if not isinstance(row, dict):
+            yield line_no, None, None, row
+            continue
+        ean = _pick(row, EAN_COLUMNS)
+        quantity = _pick(row, QUANTITY_COLUMNS)
+        yield line_no, (str(ean).strip() if ean is not None else None), quantity, row
+
+
+def import_delivery(db, path, reject_path=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Streams a delivery file into inventory:
+    - validates EAN check digits and quantities,
+    - resolves part names through /ean_codes (one read for the whole file),
+    - sums quantities per part and applies them every `chunk_size` rows
+      as batched writes (db.apply_part_deltas).
+    Rejected rows are written to `reject_path` (default: <file>.rejects.csv).
+    Returns a summary dict.
+    """
+    if reject_path is None:
+        reject_path = os.path.splitext(path)[0] + ".rejects.csv"
+
+    ean_to_part = db.load_ean_codes()
+    summary = {"rows": 0, "accepted": 0, "rejected": 0, "units": 0, "parts": set()}
+    pending = {}
+    pending_rows = 0
+
+    def flush():
+        nonlocal pending, pending_rows
+        if pending:
+            db.apply_part_deltas(pending)
+        pending = {}
+        pending_rows = 0
+
+    with open(reject_path, "w", encoding="utf-8", newline="") as reject_file:
+        rejects = csv.writer(reject_file)
+        rejects.writerow(["line", "ean", "quantity", "reason"])
+
+        for line_no, ean, quantity_raw, raw_row in iter_delivery_rows(path):
+            summary["rows"] += 1
+            reason = None
+            quantity = None
+
+            if raw_row is MALFORMED_ROW:
+                reason = "niepoprawny JSON"
+            elif not ean or not is_valid_ean(ean):
+                reason = "niepoprawny EAN"
+            else:
+                try:
+                    quantity = int(str(quantity_raw).strip())
+                    if quantity <= 0:
+                        reason = "ilość musi być > 0"
+                except (TypeError, ValueError):
+                    reason = "niepoprawna ilość"
+            part_name = ean_to_part.get(ean) if reason is None else None
+            if reason is None and not part_name:
+                reason = "nieznany EAN"
+
+            if reason:
+                summary["rejected"] += 1
+                rejects.writerow([line_no, ean or "", quantity_raw if quantity_raw is not None else "", reason])
+                continue
+
+            pending[part_name] = pending.get(part_name, 0) + quantity
+            pending_rows += 1
+            summary["accepted"] += 1
+            summary["units"] += quantity
+            summary["parts"].add(part_name)
+            if pending_rows >= chunk_size:
+                flush()
+
+        flush()
+
+    summary["parts"] = len(summary["parts"])
+    summary["reject_path"] = reject_path if summary["rejected"] else None
+    if not summary["rejected"]:
+        os.remove(reject_path)
+    return summary
+
+
+def read_count_file(db, path):
+    """
+    Reads a stocktake count file (same formats and columns as deliveries;
+    a count of 0 is valid). Returns ({part_name: counted}, summary); rows of
+    one part are summed, rejected rows are only counted.
+    """
+    ean_to_part = db.load_ean_codes()
+    counts = {}
+    summary = {"rows": 0, "accepted": 0, "rejected": 0}
+    for _, ean, quantity_raw, _ in iter_delivery_rows(path):
+        summary["rows"] += 1
+        try:
+            quantity = int(str(quantity_raw).strip())
+        except (TypeError, ValueError):
+            quantity = -1
+        part_name = ean_to_part.get(ean) if ean and is_valid_ean(ean) else None
+        if not part_name or quantity < 0:
+            summary["rejected"] += 1
+            continue
+        counts[part_name] = counts.get(part_name, 0) + quantity
+        summary["accepted"] += 1
+    summary["parts"] = len(counts)
+    return counts, summary
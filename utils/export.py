@@ -0,0 +1,151 @@
+import csv
+
+from database.schema import INDEX_PATH, split_eans
+
+# -------------------------------------------------------------------------
+#                     DATA EXPORT (CSV / PARQUET / ARROW)
+# -------------------------------------------------------------------------
+# Every dataset is a generator of row tuples fed by Database.iter_children,
+# so an export only ever holds one page of the tree plus one output chunk.
+DEFAULT_CHUNK_SIZE = 10000
+
+
+def iter_inventory_rows(db, page_size=1000):
+    """(part_id, part, quantity) for every part (the station counters' totals when they are on)."""
+    for key, quantity in db.iter_stock(page_size):
+        yield db.catalogue.id_from_key(key), db.part_label(key), quantity if isinstance(quantity, int) else None
+
+
+def iter_product_rows(db, page_size=1000):
+    """(name, ean, quantity) for every product (under /products or /products_v2)."""
+    for key, value, _ in db.iter_products(page_size):
+        yield value.get("name", key), value.get("ean"), value.get("quantity", 0)
+
+
+def iter_bom_rows(db, page_size=1000):
+    """BOM edges (product, part_id, part, quantity_per_unit), one row per part used by a product."""
+    for key, value, _ in db.iter_products(page_size):
+        parts = value.get("parts") or {}
+        if isinstance(parts, dict):
+            for part_key, per_unit in parts.items():
+                yield value.get("name", key), db.catalogue.id_from_key(part_key), db.part_label(part_key), per_unit
+
+
+def iter_ean_rows(db, page_size=1000):
+    """(ean, name, kind) for both EAN maps and the product index; kind is 'part' or 'product'."""
+    for path, kind in (("ean_codes", "part"), ("product_ean_codes", "product")):
+        for ean, value in db.iter_children(path, page_size):
+            name = value.get("name") if isinstance(value, dict) else None
+            yield ean, name, kind
+    for _, entry in db.iter_children(INDEX_PATH, page_size):
+        if isinstance(entry, dict):
+            for ean in split_eans(entry.get("e")):
+                yield ean, entry.get("n"), "product"
+
+
+# name -> (columns, arrow types, row generator)
+DATASETS = {
+    "inventory": (("part_id", "part", "quantity"), ("int64", "string", "int64"), iter_inventory_rows),
+    "products": (("name", "ean", "quantity"), ("string", "string", "int64"), iter_product_rows),
+    "bom": (
+        ("product", "part_id", "part", "quantity_per_unit"), ("string", "int64", "string", "int64"), iter_bom_rows
+    ),
+    "ean_codes": (("ean", "name", "kind"), ("string", "string", "string"), iter_ean_rows),
+}
+
+
+def _chunks(rows, chunk_size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow  # pip install pyarrow
+        return pyarrow
+    except ImportError:
+        raise RuntimeError("Eksport do Parquet/Arrow wymaga pakietu 'pyarrow' (pip install pyarrow).")
+
+
+def _arrow_schema(pa, columns, types):
+    return pa.schema([pa.field(name, getattr(pa, type_name)()) for name, type_name in zip(columns, types)])
+
+
+def _record_batches(pa, schema, rows, chunk_size):
+    """Turns row tuples into Arrow record batches, column by column, one chunk at a time."""
+    for chunk in _chunks(rows, chunk_size):
+        arrays = [
+            pa.array([row[i] for row in chunk], type=field.type)
+            for i, field in enumerate(schema)
+        ]
+        yield pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def export_csv(db, dataset, path, page_size=1000):
+    """Writes `dataset` to a CSV file row by row. Returns the number of rows."""
+    columns, _, iter_rows = DATASETS[dataset]
+    count = 0
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for row in iter_rows(db, page_size):
+            writer.writerow(row)
+            count += 1
+    return count
+
+
+def export_parquet(db, dataset, path, page_size=1000, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Writes `dataset` to a Parquet file, one row group per chunk. Returns the number of rows."""
+    pa = _require_pyarrow()
+    import pyarrow.parquet as pq
+
+    columns, types, iter_rows = DATASETS[dataset]
+    schema = _arrow_schema(pa, columns, types)
+    count = 0
+    with pq.ParquetWriter(path, schema) as writer:
+        for batch in _record_batches(pa, schema, iter_rows(db, page_size), chunk_size):
+            writer.write_batch(batch)
+            count += batch.num_rows
+    return count
+
+
+def export_arrow_table(db, dataset, page_size=1000, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Returns `dataset` as an in-memory pyarrow.Table built from per-chunk
+    record batches. The batches become the table's chunks without being
+    copied, and numeric columns convert to pandas/DuckDB without copying.
+    """
+    pa = _require_pyarrow()
+    columns, types, iter_rows = DATASETS[dataset]
+    schema = _arrow_schema(pa, columns, types)
+    return pa.Table.from_batches(list(_record_batches(pa, schema, iter_rows(db, page_size), chunk_size)), schema=schema)
+
+
+def export_dataset(db, dataset, path, fmt=None, page_size=1000, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Exports `dataset` to `path`; format taken from `fmt` or the file extension."""
+    if dataset not in DATASETS:
+        raise ValueError(f"Nieznany zbiór danych: {dataset} (dostępne: {', '.join(DATASETS)})")
+    fmt = (fmt or path.rsplit(".", 1)[-1]).lower()
+    if fmt == "csv":
+        return export_csv(db, dataset, path, page_size)
+    if fmt in ("parquet", "pq"):
+        return export_parquet(db, dataset, path, page_size, chunk_size)
+    if fmt in ("arrow", "feather", "ipc"):
+        pa = _require_pyarrow()
+        import pyarrow.ipc as ipc
+
+        columns, types, iter_rows = DATASETS[dataset]
+        schema = _arrow_schema(pa, columns, types)
+        count = 0
+        with pa.OSFile(path, "wb") as sink, ipc.new_file(sink, schema) as writer:
+            for batch in _record_batches(pa, schema, iter_rows(db, page_size), chunk_size):
+                writer.write_batch(batch)
+                count += batch.num_rows
+        return count
+    raise ValueError(f"Nieobsługiwany format eksportu: {fmt}")
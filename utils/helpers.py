@@ -1,3 +1,26 @@
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Installed updates live in <install root>/versions/<tag> (see utils/update_logic.py)
+VERSIONS_DIR = "versions"
+
+
+def install_root():
+    """
+    Folder the application is installed in. Code of an installed update runs
+    from <root>/versions/<tag>, while station-local files (.env, sync state,
+    counters, logs, render cache) stay in the root and are never copied into
+    a version.
+    """
+    code_root = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+    parent = os.path.dirname(code_root)
+    if os.path.basename(parent) == VERSIONS_DIR:
+        return os.path.dirname(parent)
+    return code_root
+
+
 def validate_positive_integer(value):
     """Waliduje, czy wartość jest dodatnią liczbą całkowitą."""
     try:
@@ -6,5 +29,19 @@ def validate_positive_integer(value):
             raise ValueError
         return num
     except ValueError:
-        print("Podaj poprawną dodatnią liczbę całkowitą.")
+        logger.warning("Podaj poprawną dodatnią liczbę całkowitą.")
         return None
+
+
+def is_valid_ean(code):
+    """
+    Sprawdza, czy kod jest poprawnym EAN-8, UPC-A, EAN-13 lub GTIN-14
+    (tylko cyfry, poprawna cyfra kontrolna).
+    """
+    if not isinstance(code, str) or not code.isdigit() or len(code) not in (8, 12, 13, 14):
+        return False
+    # Weights alternate 3,1,3,... starting from the digit next to the check digit
+    total = 0
+    for i, digit in enumerate(reversed(code[:-1])):
+        total += int(digit) * (3 if i % 2 == 0 else 1)
+    return (10 - total % 10) % 10 == int(code[-1])
@@ -0,0 +1,374 @@
+import os
+import json
+import time
+import hashlib
+import functools
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+from utils.helpers import is_valid_ean, install_root
+
+logger = logging.getLogger(__name__)
+
+# -------------------------------------------------------------------------
+#               BARCODE LABELS AND PRINTABLE REPORTS (PROCESS POOL)
+# -------------------------------------------------------------------------
+# EAN-13 / EAN-8 (and UPC-A as EAN-13) bar patterns are computed here, the
+# images are drawn with Pillow (installed with matplotlib). Rendering runs in
+# a process pool, so large batches use every core and the Tk thread only
+# waits for a future. Every rendered image is cached under the SHA-256 of
+# its content (text, code, layout version): the same EAN on 500 labels is
+# drawn once, and printing the same delivery again costs nothing. Files are
+# rendered to a temporary name and renamed into place, so a crashed or
+# killed worker never leaves a truncated image behind under a cache key.
+# The cache is trimmed to EMAG_RENDER_CACHE_MB, least recently used first.
+#
+#   EMAG_RENDER_CACHE_DIR   cache of rendered labels/pages (<install root>/render_cache)
+#   EMAG_RENDER_CACHE_MB    size limit of the cache (default 500)
+#   EMAG_PRINT_DIR          generated sheets and reports (<install root>/prints)
+RENDER_VERSION = 1          # part of every cache key; bump when a layout changes
+RENDER_CACHE_MB = 500
+# Temporary files older than this are left over from a crash
+STALE_TEMP_S = 3600
+DPI = 300
+LABEL_SIZE = (472, 236)     # 40 x 20 mm
+PAGE_SIZE = (2480, 3508)    # A4
+PAGE_MARGIN = 60
+REPORT_LINES_PER_PAGE = 60
+POOL_CHUNK_SIZE = 32
+
+_L_CODES = ("0001101", "0011001", "0010011", "0111101", "0100011",
+            "0110001", "0101111", "0111011", "0110111", "0001011")
+_R_CODES = tuple(code.translate(str.maketrans("01", "10")) for code in _L_CODES)
+_G_CODES = tuple(code[::-1] for code in _R_CODES)
+# Parity of the left half encodes the first digit of an EAN-13
+_PARITY = ("LLLLLL", "LLGLGG", "LLGGLG", "LLGGGL", "LGLLGG",
+           "LGGLLG", "LGGGLL", "LGLGLG", "LGLGGL", "LGGLGL")
+
+
+def _require_pillow():
+    try:
+        from PIL import Image, ImageDraw, ImageFont  # installed with matplotlib
+        return Image, ImageDraw, ImageFont
+    except ImportError:
+        raise RuntimeError("Drukowanie etykiet wymaga pakietu 'Pillow' (pip install pillow).")
+
+
+def ean_modules(code):
+    """
+    Bar pattern of an EAN-13, UPC-A (printed as EAN-13) or EAN-8 code as a
+    string of "1" (bar) and "0" (space) modules, guard bars included.
+    """
+    code = str(code).strip()
+    if not is_valid_ean(code) or len(code) == 14:
+        raise ValueError(f"Niepoprawny kod EAN-13/EAN-8: {code!r}")
+    if len(code) == 12:
+        code = "0" + code
+    digits = [int(d) for d in code]
+    if len(digits) == 8:
+        left = "".join(_L_CODES[d] for d in digits[:4])
+        right = "".join(_R_CODES[d] for d in digits[4:])
+    else:
+        parity = _PARITY[digits[0]]
+        left = "".join((_L_CODES if p == "L" else _G_CODES)[d] for p, d in zip(parity, digits[1:7]))
+        right = "".join(_R_CODES[d] for d in digits[7:])
+    return "101" + left + "01010" + right + "101"
+
+
+def content_key(kind, spec):
+    payload = json.dumps({"kind": kind, "v": RENDER_VERSION, **spec}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def _font(size):
+    """DejaVu Sans (shipped with matplotlib, has the Polish letters), else Pillow's default font."""
+    _, _, ImageFont = _require_pillow()
+    try:
+        import matplotlib
+        return ImageFont.truetype(os.path.join(matplotlib.get_data_path(), "fonts", "ttf", "DejaVuSans.ttf"), size)
+    except (ImportError, OSError):
+        pass
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        # Pillow < 10.1 has only the fixed bitmap font
+        return ImageFont.load_default()
+
+
+def _save_atomic(image, path, **params):
+    """Saves to a temporary file next to `path` (same extension, so the format) and renames it."""
+    base, extension = os.path.splitext(path)
+    tmp_path = f"{base}.{os.getpid()}.tmp{extension}"
+    try:
+        image.save(tmp_path, **params)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+# ---- workers (module level, so the process pool can import them) --------
+def _draw_label(spec):
+    Image, ImageDraw, _ = _require_pillow()
+    width, height = LABEL_SIZE
+    image = Image.new("L", LABEL_SIZE, 255)
+    draw = ImageDraw.Draw(image)
+    text = spec.get("text") or ""
+    if text:
+        draw.text((width // 2, 8), text[:40], fill=0, font=_font(26), anchor="ma")
+    modules = ean_modules(spec["ean"])
+    module_px = max(1, (width - 40) // len(modules))
+    x = (width - module_px * len(modules)) // 2
+    top, bottom = 44, height - 44
+    for i, bit in enumerate(modules):
+        if bit == "1":
+            draw.rectangle((x + i * module_px, top, x + (i + 1) * module_px - 1, bottom), fill=0)
+    draw.text((width // 2, bottom + 6), spec["ean"], fill=0, font=_font(28), anchor="ma")
+    return image
+
+
+def _render_label(job):
+    spec, path = job
+    _save_atomic(_draw_label(spec), path, dpi=(DPI, DPI))
+    return path
+
+
+def _render_page(job):
+    label_paths, path = job
+    Image, _, _ = _require_pillow()
+    # Bilevel pages: a fraction of the size of grayscale, and quick to decode when the PDF is assembled
+    page = Image.new("1", PAGE_SIZE, 1)
+    columns = (PAGE_SIZE[0] - 2 * PAGE_MARGIN) // LABEL_SIZE[0]
+    opened = {}
+    for index, label_path in enumerate(label_paths):
+        if label_path not in opened:
+            opened[label_path] = Image.open(label_path).convert("1", dither=Image.Dither.NONE)
+        row, column = divmod(index, columns)
+        page.paste(opened[label_path], (PAGE_MARGIN + column * LABEL_SIZE[0], PAGE_MARGIN + row * LABEL_SIZE[1]))
+    _save_atomic(page, path, dpi=(DPI, DPI))
+    return path
+
+
+def _render_report(job):
+    report, path = job
+    Image, ImageDraw, _ = _require_pillow()
+    header = [report.get("title", ""), *report.get("header", [])]
+    body = [
+        "  ".join(str(cell).ljust(width) for cell, width in zip(row, report.get("widths", [24] * len(row))))
+        for row in [report.get("columns", [])] + list(report.get("rows", []))
+    ]
+    footer = report.get("footer", [])
+    lines = body + [""] + footer
+    font, title_font = _font(34), _font(48)
+    pages = []
+    for start in range(0, max(len(lines), 1), REPORT_LINES_PER_PAGE):
+        page = Image.new("L", PAGE_SIZE, 255)
+        draw = ImageDraw.Draw(page)
+        y = PAGE_MARGIN * 2
+        for i, line in enumerate(header):
+            draw.text((PAGE_MARGIN * 2, y), line, fill=0, font=title_font if i == 0 else font)
+            y += 70 if i == 0 else 48
+        y += 30
+        for line in lines[start:start + REPORT_LINES_PER_PAGE]:
+            draw.text((PAGE_MARGIN * 2, y), line, fill=0, font=font)
+            y += 48
+        draw.text((PAGE_SIZE[0] - PAGE_MARGIN * 2, PAGE_SIZE[1] - PAGE_MARGIN * 2),
+                  f"{start // REPORT_LINES_PER_PAGE + 1}", fill=0, font=font, anchor="rs")
+        pages.append(page)
+    if path.lower().endswith(".pdf"):
+        _save_atomic(pages[0], path, save_all=True, append_images=pages[1:], resolution=DPI)
+    else:
+        _save_atomic(pages[0], path, dpi=(DPI, DPI))
+    return path
+
+
+# ---- service -------------------------------------------------------------
+def _default_dir(variable, name):
+    return os.getenv(variable) or os.path.join(install_root(), name)
+
+
+class LabelRenderer:
+    """Renders labels, label sheets and reports in a process pool with a content-hash cache."""
+
+    def __init__(self, cache_dir=None, output_dir=None, workers=None, cache_mb=None):
+        self.cache_dir = cache_dir or _default_dir("EMAG_RENDER_CACHE_DIR", "render_cache")
+        self.output_dir = output_dir or _default_dir("EMAG_PRINT_DIR", "prints")
+        if cache_mb is None:
+            cache_mb = os.getenv("EMAG_RENDER_CACHE_MB") or RENDER_CACHE_MB
+        self.cache_bytes = int(cache_mb) * 1024 * 1024
+        self.workers = workers or os.cpu_count() or 1
+        self._pool = None
+
+    def _executor(self):
+        if self._pool is None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def _run(self, worker, jobs):
+        """Runs the (input, output path) jobs whose output is not cached yet; returns how many ran."""
+        missing = []
+        for job in jobs:
+            try:
+                os.utime(job[1])  # a cache hit is recently used
+            except OSError:
+                missing.append(job)
+        if missing:
+            list(self._executor().map(worker, missing, chunksize=POOL_CHUNK_SIZE))
+        return len(missing)
+
+    def prune_cache(self, keep=()):
+        """Deletes the least recently used cache files beyond the size limit (never those in `keep`)."""
+        keep = {os.path.abspath(path) for path in keep}
+        now = time.time()
+        files, total = [], 0
+        try:
+            entries = list(os.scandir(self.cache_dir))
+        except OSError:
+            return 0
+        for entry in entries:
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            if ".tmp" in entry.name:
+                if now - stat.st_mtime > STALE_TEMP_S:
+                    self._remove(entry.path)
+                continue
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+        removed = 0
+        for _, size, path in sorted(files):
+            if total <= self.cache_bytes:
+                break
+            if os.path.abspath(path) in keep:
+                continue
+            if self._remove(path):
+                total -= size
+                removed += 1
+        if removed:
+            logger.debug("Render cache trimmed: %d files removed.", removed)
+        return removed
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            return False
+
+    def _copy_output(self, cached, name):
+        os.makedirs(self.output_dir, exist_ok=True)
+        path = os.path.join(self.output_dir, name)
+        with open(cached, "rb") as source, open(path, "wb") as target:
+            target.write(source.read())
+        return path
+
+    def render_labels(self, items):
+        """
+        PNG labels for [{"ean", "text"}]; returns {(ean, text): path}.
+        Invalid codes are skipped with a warning.
+        """
+        jobs = {}
+        for item in items:
+            spec = {"ean": str(item["ean"]).strip(), "text": item.get("text") or ""}
+            try:
+                ean_modules(spec["ean"])
+            except ValueError as e:
+                logger.warning("Label skipped: %s", e)
+                continue
+            jobs[(spec["ean"], spec["text"])] = (spec, os.path.join(self.cache_dir, content_key("label", spec) + ".png"))
+        os.makedirs(self.cache_dir, exist_ok=True)
+        rendered = self._run(_render_label, list(jobs.values()))
+        logger.debug("Labels: %d requested, %d rendered, %d cached.", len(jobs), rendered, len(jobs) - rendered)
+        paths = {key: job[1] for key, job in jobs.items()}
+        if rendered:
+            self.prune_cache(keep=paths.values())
+        return paths
+
+    def render_label_sheet(self, items, name):
+        """
+        A4 PDF with `copies` labels of every [{"ean", "text", "copies"}]
+        item; pages are composed in the pool. Returns (path, labels printed).
+        """
+        started = time.perf_counter()
+        paths = self.render_labels(items)
+        sequence = []
+        for item in items:
+            path = paths.get((str(item["ean"]).strip(), item.get("text") or ""))
+            if path:
+                sequence.extend([path] * int(item.get("copies", 1)))
+        if not sequence:
+            return None, 0
+        columns = (PAGE_SIZE[0] - 2 * PAGE_MARGIN) // LABEL_SIZE[0]
+        rows = (PAGE_SIZE[1] - 2 * PAGE_MARGIN) // LABEL_SIZE[1]
+        per_page = columns * rows
+        page_jobs = []
+        for start in range(0, len(sequence), per_page):
+            labels = sequence[start:start + per_page]
+            key = content_key("page", {"labels": [os.path.basename(p) for p in labels]})
+            page_jobs.append((labels, os.path.join(self.cache_dir, key + ".png")))
+        rendered = self._run(_render_page, page_jobs)
+
+        sheet = os.path.join(self.cache_dir, content_key("sheet", {"pages": [p for _, p in page_jobs]}) + ".pdf")
+        try:
+            os.utime(sheet)
+        except OSError:
+            Image, _, _ = _require_pillow()
+            pages = [Image.open(path) for _, path in page_jobs]
+            _save_atomic(pages[0], sheet, save_all=True, append_images=pages[1:], resolution=DPI)
+            rendered += 1
+        path = self._copy_output(sheet, name)
+        if rendered:
+            self.prune_cache(keep=[sheet])
+        logger.info("Label sheet '%s': %d labels on %d pages (%.1f s).",
+                    path, len(sequence), len(page_jobs), time.perf_counter() - started)
+        return path, len(sequence)
+
+    def render_report(self, report, name):
+        """
+        Renders {"title", "header": [...], "columns": [...], "rows": [[...]],
+        "widths": [...], "footer": [...]} to PDF (or PNG) in the pool;
+        identical reports come from the cache. Returns the path.
+        """
+        extension = os.path.splitext(name)[1] or ".pdf"
+        cached = os.path.join(self.cache_dir, content_key("report", report) + extension)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        if self._run(_render_report, [(report, cached)]):
+            self.prune_cache(keep=[cached])
+        path = self._copy_output(cached, name)
+        logger.info("Report written to '%s'.", path)
+        return path
+
+
+def delivery_report(items, station=None, when=None):
+    """Report spec of a delivery receipt from {part_name: (quantity, [eans])}."""
+    rows = [[name, ", ".join(eans), quantity] for name, (quantity, eans) in sorted(items.items())]
+    return {
+        "title": "Potwierdzenie przyjęcia dostawy",
+        "header": [f"Data: {when or time.strftime('%Y-%m-%d %H:%M')}", f"Stanowisko: {station or '-'}"],
+        "columns": ["Część", "EAN", "Ilość"],
+        "widths": [32, 30, 8],
+        "rows": rows,
+        "footer": [f"Pozycje: {len(rows)}, sztuk razem: {sum(row[2] for row in rows)}"],
+    }
+
+
+def order_report(product, quantity, ean=None, remaining=None, when=None):
+    """Report spec of a shipment (order) note."""
+    return {
+        "title": "Dokument wysyłki",
+        "header": [f"Data: {when or time.strftime('%Y-%m-%d %H:%M')}"],
+        "columns": ["Produkt", "EAN", "Ilość"],
+        "widths": [32, 16, 8],
+        "rows": [[product, ean or "-", quantity]],
+        "footer": [f"Pozostało w magazynie: {remaining}"] if remaining is not None else [],
+    }
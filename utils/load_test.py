@@ -0,0 +1,269 @@
+import os
+import time
+import random
+import threading
+from collections import Counter, defaultdict
+
+from controllers.product_controller import ProductController
+from database import backend
+from database.catalogue import format_label
+from database.db import Database
+from database.errors import StaleProductError
+from database.memory_backend import MemoryBackend
+
+# -------------------------------------------------------------------------
+#                  MULTI-STATION LOAD TEST (LOCAL BACKEND)
+# -------------------------------------------------------------------------
+# N simulated stations (threads, each with its own Database and controller,
+# so nothing is shared but the backend) run a scripted mix of the GUI's
+# write paths against an in-memory backend with a simulated round-trip.
+# Every station keeps a ledger of the changes it believes it made; at the
+# end the ledgers are checked against the stored stock, so lost updates
+# show up as invariant violations rather than as slightly odd numbers.
+DEFAULT_MIX = {"delivery": 0.3, "part_edit": 0.1, "build": 0.35, "ship": 0.25}
+DEFAULT_LATENCY = 0.005
+MAX_RETRIES = 5
+
+
+class _Station(threading.Thread):
+    def __init__(self, index, ops, mix, parts, product_names, seed, barrier):
+        super().__init__(name=f"station-{index}", daemon=True)
+        self.controller = ProductController(Database())
+        self.db = self.controller.db
+        self.ops = ops
+        self.mix = mix
+        self.parts = parts
+        self.product_names = product_names
+        self.rng = random.Random(seed)
+        self.barrier = barrier
+        self.latencies = defaultdict(list)   # op -> [seconds]
+        self.counts = Counter()              # done / rejected / conflicts / retries / aborted / errors
+        self.part_ledger = Counter()         # part label -> net change made by this station
+        self.product_ledger = Counter()      # product name -> net change made by this station
+
+    def run(self):
+        kinds = list(self.mix)
+        weights = [self.mix[k] for k in kinds]
+        self.barrier.wait()
+        for _ in range(self.ops):
+            kind = self.rng.choices(kinds, weights)[0]
+            started = time.perf_counter()
+            try:
+                outcome = getattr(self, f"_{kind}")()
+            except Exception:
+                outcome = "errors"
+            self.latencies[kind].append(time.perf_counter() - started)
+            self.counts[outcome] += 1
+
+    # ---- scripted operations (the GUI's write paths) -------------------
+    def _delivery(self):
+        """Scanner delivery: one multi-path increment."""
+        deltas = {part: self.rng.randint(1, 50) for part in self.rng.sample(self.parts, self.rng.randint(1, 3))}
+        self.db.apply_part_deltas(deltas)
+        self.part_ledger.update(deltas)
+        return "done"
+
+    def _part_edit(self):
+        """Manual correction in the edit-part form."""
+        part, delta = self.rng.choice(self.parts), self.rng.randint(1, 20)
+        self.db.update_part_quantity(part, delta)
+        self.part_ledger[part] += delta
+        return "done"
+
+    def _change_product(self, name, delta, product=None):
+        """
+        Conditional product write as in the forms: `product` is what the form
+        read when it opened; a conflict re-reads it and retries.
+        """
+        for attempt in range(MAX_RETRIES):
+            if product is None:
+                product = self.db.load_product(name)
+            if product is None or product["quantity"] + delta < 0:
+                return None
+            try:
+                self.db.update_product_in_firebase({**product, "quantity": product["quantity"] + delta})
+                return product
+            except StaleProductError:
+                self.counts["conflicts"] += 1
+                product = None
+                if attempt < MAX_RETRIES - 1:
+                    self.counts["retries"] += 1
+        self.counts["aborted"] += 1
+        return None
+
+    def _build(self):
+        """Edit-product form, quantity up: check parts, write product, deduct parts."""
+        name, delta = self.rng.choice(self.product_names), self.rng.randint(1, 3)
+        product = self.db.load_product(name)
+        inventory = self.db.load_inventory()
+        if product is None or any(inventory.get(p, 0) < delta * q for p, q in product["parts"].items()):
+            return "rejected"
+        product = self._change_product(name, delta, product)
+        if product is None:
+            return "rejected"
+        for part, per_unit in product["parts"].items():
+            self.db.update_part_quantity(part, -delta * per_unit)
+            self.part_ledger[part] -= delta * per_unit
+        self.product_ledger[name] += delta
+        return "done"
+
+    def _ship(self):
+        """Orders form: ship 1-3 units if in stock."""
+        name, quantity = self.rng.choice(self.product_names), self.rng.randint(1, 3)
+        if self._change_product(name, -quantity) is None:
+            return "rejected"
+        self.product_ledger[name] -= quantity
+        return "done"
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def _seed(store, parts_count, products_count, initial_stock, rng):
+    """Catalogue, starting stock and products with random BOMs."""
+    setup = Database()
+    parts = [
+        format_label(category, size)
+        for category, sizes in setup.catalogue.families().items()
+        for size in sizes
+    ][:parts_count]
+    setup.apply_part_deltas({part: initial_stock for part in parts})
+    product_names = [f"LT-{i:03d}" for i in range(products_count)]
+    for name in product_names:
+        bom = {part: rng.randint(1, 3) for part in rng.sample(parts, rng.randint(2, min(4, len(parts))))}
+        setup.add_product_to_firebase({"name": name, "quantity": 0, "parts": bom})
+    store.stats.clear()
+    return setup, parts, product_names
+
+
+def _check_invariants(setup, store, stations, parts, product_names, initial_stock):
+    """Compares the stored stock with what the stations' ledgers say it must be."""
+    data = store.snapshot()
+    inventory = data.get("inventory", {})
+    products = data.get("products", {})
+    part_ledger, product_ledger = Counter(), Counter()
+    for station in stations:
+        part_ledger.update(station.part_ledger)
+        product_ledger.update(station.product_ledger)
+
+    part_errors = {}
+    for part in parts:
+        expected = initial_stock + part_ledger[part]
+        actual = inventory.get(setup.part_key(part, create=False), 0)
+        if actual != expected:
+            part_errors[part] = (expected, actual)
+    product_errors = {}
+    for name in product_names:
+        expected = product_ledger[name]
+        actual = (products.get(name) or {}).get("quantity", 0)
+        if actual != expected:
+            product_errors[name] = (expected, actual)
+    negative = [key for key, quantity in inventory.items() if isinstance(quantity, int) and quantity < 0]
+    return {
+        "part_mismatches": part_errors,
+        "product_mismatches": product_errors,
+        "lost_part_units": sum(abs(e - a) for e, a in part_errors.values()),
+        "negative_stock": negative,
+        "ok": not part_errors and not product_errors and not negative,
+    }
+
+
+def run_load_test(stations=4, ops_per_station=200, mix=None, latency=DEFAULT_LATENCY,
+                  parts=12, products=8, initial_stock=100000, seed=0):
+    """
+    Runs one load test on a fresh in-memory backend and returns a report:
+    throughput, per-operation latency percentiles, contention counters,
+    backend request counts and the final-stock invariants.
+    """
+    if os.getenv("EMAG_COUNTERS") == "1":
+        raise ValueError("Load test runs the default data layer; unset EMAG_COUNTERS.")
+    mix = mix or DEFAULT_MIX
+    rng = random.Random(seed)
+    previous = backend.memory_backend()
+    store = backend.use_memory_backend(MemoryBackend(latency=latency))
+    try:
+        setup, part_names, product_names = _seed(store, parts, products, initial_stock, rng)
+        barrier = threading.Barrier(stations + 1)
+        threads = [
+            _Station(i, ops_per_station, mix, part_names, product_names, rng.random(), barrier)
+            for i in range(stations)
+        ]
+        for thread in threads:
+            thread.start()
+        barrier.wait()
+        started = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        invariants = _check_invariants(setup, store, threads, part_names, product_names, initial_stock)
+    finally:
+        if previous is None:
+            backend.use_firebase()
+        else:
+            backend.use_memory_backend(previous)
+
+    counts = Counter()
+    latencies = defaultdict(list)
+    for thread in threads:
+        counts.update(thread.counts)
+        for kind, values in thread.latencies.items():
+            latencies[kind].extend(values)
+    total_ops = sum(len(values) for values in latencies.values())
+    operations = {}
+    for kind, values in sorted(latencies.items()):
+        values.sort()
+        operations[kind] = {
+            "count": len(values),
+            "p50_ms": _percentile(values, 0.50) * 1000,
+            "p95_ms": _percentile(values, 0.95) * 1000,
+            "p99_ms": _percentile(values, 0.99) * 1000,
+            "max_ms": values[-1] * 1000,
+        }
+    return {
+        "stations": stations,
+        "ops": total_ops,
+        "elapsed_s": elapsed,
+        "throughput_ops_s": total_ops / elapsed if elapsed else 0.0,
+        "operations": operations,
+        "outcomes": dict(counts),
+        "backend": dict(store.stats),
+        "invariants": invariants,
+    }
+
+
+def run_sweep(station_counts, **kwargs):
+    """One load test per station count; returns the reports in order."""
+    return [run_load_test(stations=count, **kwargs) for count in station_counts]
+
+
+def format_report(report):
+    lines = [
+        f"Stanowiska: {report['stations']}  operacje: {report['ops']}  "
+        f"czas: {report['elapsed_s']:.2f} s  przepustowość: {report['throughput_ops_s']:.1f} op/s",
+    ]
+    for kind, stats in report["operations"].items():
+        lines.append(
+            f"  {kind:<10} n={stats['count']:<6} p50={stats['p50_ms']:.1f} ms  p95={stats['p95_ms']:.1f} ms  "
+            f"p99={stats['p99_ms']:.1f} ms  max={stats['max_ms']:.1f} ms"
+        )
+    outcomes = report["outcomes"]
+    lines.append(
+        f"  konflikty: {outcomes.get('conflicts', 0)}  ponowienia: {outcomes.get('retries', 0)}  "
+        f"porzucone: {outcomes.get('aborted', 0)}  odrzucone: {outcomes.get('rejected', 0)}  "
+        f"błędy: {outcomes.get('errors', 0)}"
+    )
+    lines.append("  backend: " + ", ".join(f"{k}={v}" for k, v in sorted(report["backend"].items())))
+    invariants = report["invariants"]
+    if invariants["ok"]:
+        lines.append("  niezmienniki: OK")
+    else:
+        lines.append(
+            f"  niezmienniki: NARUSZONE - części: {len(invariants['part_mismatches'])} "
+            f"(utracone sztuki: {invariants['lost_part_units']}), "
+            f"produkty: {len(invariants['product_mismatches'])}, "
+            f"ujemne stany: {len(invariants['negative_stock'])}"
+        )
+    return "\n".join(lines)
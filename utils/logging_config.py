@@ -0,0 +1,146 @@
+import os
+import queue
+import atexit
+import logging
+import threading
+from collections import deque
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from utils.helpers import install_root
+
+# -------------------------------------------------------------------------
+#                     LOGGING (NON-BLOCKING, LEVELED)
+# -------------------------------------------------------------------------
+# Modules log through logging.getLogger(__name__) with %-style arguments, so
+# a message below the active level is never formatted. Records that pass
+# the level are put on a queue by the calling thread (the Tk thread, too)
+# and written by a background listener: to rotating files under logs/, to
+# the console (warnings and up by default) and to an in-memory ring buffer
+# that the settings view shows.
+#
+#   EMAG_LOG_LEVEL          level of the log files and ring buffer (INFO)
+#   EMAG_CONSOLE_LOG_LEVEL  level of the console output (WARNING)
+#   EMAG_LOG_DIR            directory of the log files (<app>/logs)
+LOG_FORMAT = "%(asctime)s %(levelname)-7s %(threadName)s %(name)s: %(message)s"
+LOG_FILE = "emag.log"
+MAX_LOG_BYTES = 2 * 1024 * 1024
+LOG_BACKUPS = 5
+RING_BUFFER_SIZE = 2000
+LEVELS = ("DEBUG", "INFO", "WARNING", "ERROR")
+
+_listener = None
+_ring_buffer = None
+_setup_lock = threading.Lock()
+
+
+class RingBufferHandler(logging.Handler):
+    """Keeps the last `capacity` records in memory; formatted only when viewed."""
+
+    def __init__(self, capacity=RING_BUFFER_SIZE):
+        super().__init__()
+        self.records = deque(maxlen=capacity)
+
+    def emit(self, record):
+        self.records.append(record)
+
+    def lines(self, level=logging.NOTSET, limit=None):
+        records = [record for record in list(self.records) if record.levelno >= level]
+        if limit:
+            records = records[-limit:]
+        return [self.format(record) for record in records]
+
+    def clear(self):
+        self.records.clear()
+
+
+def _level(value):
+    if isinstance(value, int):
+        return value
+    level = logging.getLevelName(str(value).upper())
+    return level if isinstance(level, int) else logging.INFO
+
+
+def default_log_dir():
+    return os.getenv("EMAG_LOG_DIR") or os.path.join(install_root(), "logs")
+
+
+def setup_logging(level=None, console_level=None, log_dir=None):
+    """
+    Configures the root logger once per process (later calls only change the
+    levels). Returns the ring buffer handler.
+    """
+    global _listener, _ring_buffer
+    level = _level(level or os.getenv("EMAG_LOG_LEVEL") or "INFO")
+    console_level = _level(console_level or os.getenv("EMAG_CONSOLE_LOG_LEVEL") or "WARNING")
+    with _setup_lock:
+        if _listener is not None:
+            set_level(level, console_level)
+            return _ring_buffer
+
+        formatter = logging.Formatter(LOG_FORMAT)
+        handlers = []
+        log_dir = log_dir or default_log_dir()
+        try:
+            os.makedirs(log_dir, exist_ok=True)
+            file_handler = RotatingFileHandler(
+                os.path.join(log_dir, LOG_FILE), maxBytes=MAX_LOG_BYTES, backupCount=LOG_BACKUPS, encoding="utf-8"
+            )
+            file_handler.setFormatter(formatter)
+            file_handler.setLevel(level)
+            handlers.append(file_handler)
+        except OSError as e:
+            # Read-only install directory: console and ring buffer still work
+            logging.getLogger(__name__).warning("Log files disabled (%s): %s", log_dir, e)
+
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(formatter)
+        console_handler.setLevel(console_level)
+        handlers.append(console_handler)
+
+        _ring_buffer = RingBufferHandler()
+        _ring_buffer.setFormatter(formatter)
+        _ring_buffer.setLevel(level)
+        handlers.append(_ring_buffer)
+
+        log_queue = queue.SimpleQueue()
+        root = logging.getLogger()
+        root.handlers[:] = [QueueHandler(log_queue)]
+        root.setLevel(min(level, console_level))
+        _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown_logging)
+        return _ring_buffer
+
+
+def set_level(level, console_level=None):
+    """Changes the file/ring buffer level (and optionally the console level) at runtime."""
+    level = _level(level)
+    if _listener is None:
+        logging.getLogger().setLevel(level)
+        return
+    console = None
+    for handler in _listener.handlers:
+        if isinstance(handler, logging.StreamHandler) and not isinstance(handler, logging.FileHandler):
+            console = handler
+            if console_level is not None:
+                handler.setLevel(_level(console_level))
+        else:
+            handler.setLevel(level)
+    logging.getLogger().setLevel(min(level, console.level if console else level))
+
+
+def current_level():
+    return logging.getLevelName(_ring_buffer.level) if _ring_buffer else logging.getLevelName(logging.getLogger().level)
+
+
+def ring_buffer():
+    """The in-memory handler with the latest records (None before setup_logging)."""
+    return _ring_buffer
+
+
+def shutdown_logging():
+    """Flushes the queue and stops the background writer."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
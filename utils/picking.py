@@ -0,0 +1,194 @@
+import re
+import logging
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+# -------------------------------------------------------------------------
+#                    PICK LISTS AND PICK ROUTES (WAVE PICKING)
+# -------------------------------------------------------------------------
+# Bin codes follow the location format "MAG1-R03-P2": R is the aisle (row
+# of racks), P the position along it; anything else in the code (site,
+# level) does not change the walk. The warehouse is modelled as parallel
+# aisles joined by a front and a back cross-aisle, with the depot (pack
+# station) at the front of aisle 1:
+#
+#   same aisle        |p1 - p2| positions
+#   other aisle       walk to the front or back end, whichever is shorter,
+#                     across, and into the other aisle
+#
+# A wave of orders is split into picker batches of orders whose picks are
+# close together; every batch visits each bin once (quantities for several
+# orders picked together, sorted into totes at the pack station). The stop
+# sequence is built nearest-neighbour from the depot and improved by 2-opt
+# over the distance matrix, with numpy evaluating all moves for one edge at
+# a time.
+# Aisle and position segments, wherever they sit in the code ("MAG1-R03-L2-P5")
+BIN_PATTERN = re.compile(r"(?<![A-Z])R(\d+)", re.IGNORECASE)
+POSITION_PATTERN = re.compile(r"(?<![A-Z])P(\d+)", re.IGNORECASE)
+AISLE_SPACING = 3.0      # metres between aisle centre lines
+POSITION_LENGTH = 1.0    # metres per rack position
+AISLE_POSITIONS = 40     # positions per aisle (length of an aisle)
+MAX_TWO_OPT_PASSES = 50
+
+
+def _require_numpy():
+    try:
+        import numpy  # installed with matplotlib
+        return numpy
+    except ImportError:
+        raise RuntimeError("Trasy kompletacji wymagają pakietu 'numpy' (pip install numpy).")
+
+
+class WarehouseLayout:
+    """Parallel-aisle grid: walking distances between bin codes in metres."""
+
+    def __init__(self, aisle_spacing=AISLE_SPACING, position_length=POSITION_LENGTH,
+                 aisle_positions=AISLE_POSITIONS):
+        self.aisle_spacing = aisle_spacing
+        self.position_length = position_length
+        self.aisle_length = aisle_positions * position_length
+
+    def coordinates(self, code):
+        """(aisle, metres from the front) of a bin code, or None if it has no aisle."""
+        match = BIN_PATTERN.search(code or "")
+        if not match:
+            return None
+        position_match = POSITION_PATTERN.search(code, match.end())
+        position = int(position_match.group(1)) if position_match else 0
+        return int(match.group(1)), min(position * self.position_length, self.aisle_length)
+
+    @property
+    def depot(self):
+        return 1, 0.0
+
+    def distance_matrix(self, points):
+        """Pairwise walking distances between (aisle, depth) points as a numpy array."""
+        np = _require_numpy()
+        aisles = np.array([p[0] for p in points], dtype=float)
+        depths = np.array([p[1] for p in points], dtype=float)
+        across = np.abs(aisles[:, None] - aisles[None, :]) * self.aisle_spacing
+        via_front = depths[:, None] + depths[None, :]
+        via_back = 2 * self.aisle_length - via_front
+        same_aisle = aisles[:, None] == aisles[None, :]
+        return np.where(same_aisle, np.abs(depths[:, None] - depths[None, :]), across + np.minimum(via_front, via_back))
+
+
+def _route_length(distances, route):
+    return float(sum(distances[a, b] for a, b in zip(route, route[1:])))
+
+
+def _nearest_neighbour(np, distances):
+    """Tour over all points starting and ending at point 0 (the depot)."""
+    count = len(distances)
+    visited = np.zeros(count, dtype=bool)
+    visited[0] = True
+    route = [0]
+    for _ in range(count - 1):
+        row = np.where(visited, np.inf, distances[route[-1]])
+        nxt = int(row.argmin())
+        visited[nxt] = True
+        route.append(nxt)
+    return route + [0]
+
+
+def _two_opt(np, distances, route):
+    """
+    Reverses route segments while that shortens the tour. For every edge
+    (a, b) the gain of every 2-opt move with a later edge (c, d) is
+    computed at once: d(a,b) + d(c,d) - d(a,c) - d(b,d).
+    """
+    route = np.array(route)
+    for _ in range(MAX_TWO_OPT_PASSES):
+        improved = False
+        for i in range(1, len(route) - 2):
+            a, b = route[i - 1], route[i]
+            c, d = route[i + 1:-1], route[i + 2:]
+            gains = distances[a, b] + distances[c, d] - distances[a, c] - distances[b, d]
+            best = int(gains.argmax()) if len(gains) else -1
+            if best >= 0 and gains[best] > 1e-9:
+                j = i + 1 + best
+                route[i:j + 1] = route[i:j + 1][::-1]
+                improved = True
+        if not improved:
+            break
+    return route.tolist()
+
+
+def route_stops(layout, codes):
+    """
+    Orders the bin `codes` into a short walk from the depot and back.
+    Returns (codes in pick order, metres walked).
+    """
+    np = _require_numpy()
+    if not codes:
+        return [], 0.0
+    points = [layout.depot] + [layout.coordinates(code) for code in codes]
+    distances = layout.distance_matrix(points)
+    route = _two_opt(np, distances, _nearest_neighbour(np, distances))
+    return [codes[i - 1] for i in route[1:-1]], _route_length(distances, route)
+
+
+def _naive_length(layout, codes):
+    """Walk from the depot through the bins in the given order and back."""
+    if not codes:
+        return 0.0
+    points = [layout.depot] + [layout.coordinates(code) for code in codes] + [layout.depot]
+    distances = layout.distance_matrix(points)
+    return _route_length(distances, list(range(len(points))))
+
+
+def _batches(layout, orders, batch_size):
+    """Splits orders into picker batches of nearby orders (sorted by their mean aisle and depth)."""
+    def centroid(lines):
+        points = [layout.coordinates(line["bin"]) for line in lines]
+        return (sum(p[0] for p in points) / len(points), sum(p[1] for p in points) / len(points)) if points else (0, 0)
+
+    ordered = sorted(orders.items(), key=lambda item: centroid(item[1]))
+    return [dict(ordered[i:i + batch_size]) for i in range(0, len(ordered), batch_size)]
+
+
+def build_pick_lists(lines, bins, layout=None, batch_size=20):
+    """
+    `lines` are [{"order", "item", "quantity"}] (item: product or part
+    name), `bins` is {item: bin code}. Returns {"batches": [{"orders",
+    "stops": [{"bin", "picks": [{"item", "order", "quantity"}]}],
+    "distance_m", "naive_distance_m"}], "unlocated": [lines without a bin],
+    "distance_m", "naive_distance_m"}.
+    """
+    layout = layout or WarehouseLayout()
+    orders, unlocated = defaultdict(list), []
+    for line in lines:
+        code = bins.get(line["item"])
+        if not code or layout.coordinates(code) is None:
+            unlocated.append(line)
+            continue
+        orders[line["order"]].append({**line, "bin": code})
+
+    batches = []
+    for batch_orders in _batches(layout, orders, batch_size):
+        picks_by_bin = defaultdict(list)
+        for order, order_lines in batch_orders.items():
+            for line in order_lines:
+                picks_by_bin[line["bin"]].append({"item": line["item"], "order": order, "quantity": line["quantity"]})
+        sequence, distance = route_stops(layout, sorted(picks_by_bin))
+        batches.append({
+            "orders": list(batch_orders),
+            "stops": [{"bin": code, "picks": picks_by_bin[code]} for code in sequence],
+            "distance_m": distance,
+            # Today's baseline: one trip per order, lines in the order entered
+            "naive_distance_m": sum(
+                _naive_length(layout, [line["bin"] for line in order_lines]) for order_lines in batch_orders.values()
+            ),
+        })
+    result = {
+        "batches": batches,
+        "unlocated": unlocated,
+        "distance_m": sum(batch["distance_m"] for batch in batches),
+        "naive_distance_m": sum(batch["naive_distance_m"] for batch in batches),
+    }
+    logger.info(
+        "Pick lists: %d orders in %d batches, %.0f m walked (%.0f m one order at a time), %d lines without a bin.",
+        len(orders), len(batches), result["distance_m"], result["naive_distance_m"], len(unlocated),
+    )
+    return result
@@ -0,0 +1,84 @@
+import logging
+import queue
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.helpers import is_valid_ean
+
+logger = logging.getLogger(__name__)
+
+# -------------------------------------------------------------------------
+#                     BARCODE SCANNER SESSION
+# -------------------------------------------------------------------------
+# A keyboard-wedge scanner "types" the code followed by Enter. Each scan is
+# handled in O(1) on the Tk thread: check digit validation and a counter
+# increment. Name lookups run on a small thread pool and come back through
+# a queue that the GUI drains with `after`, so Firebase latency never
+# stalls scanning.
+STATUS_PENDING = "pending"
+STATUS_KNOWN = "known"
+STATUS_UNKNOWN = "unknown"
+STATUS_ERROR = "error"
+
+
+class ScanSession:
+    """Coalesces scans into one line per EAN and resolves names in the background."""
+
+    def __init__(self, resolve_name, max_workers=4):
+        # resolve_name(ean) -> name or None, e.g. Database.verify_ean_in_firebase
+        self.resolve_name = resolve_name
+        self.items = OrderedDict()   # ean -> {"quantity": int, "name": str|None, "status": str}
+        self.rejected = 0
+        self.results = queue.Queue()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ean-lookup")
+
+    def add_scan(self, code, quantity=1):
+        """
+        Registers one scan. Returns (ean, is_new_line) for a valid code,
+        or (None, False) if the check digit is wrong.
+        """
+        ean = code.strip()
+        if not is_valid_ean(ean):
+            self.rejected += 1
+            return None, False
+
+        item = self.items.get(ean)
+        if item is not None:
+            item["quantity"] += quantity
+            return ean, False
+
+        self.items[ean] = {"quantity": quantity, "name": None, "status": STATUS_PENDING}
+        self.executor.submit(self._lookup, ean)
+        return ean, True
+
+    def _lookup(self, ean):
+        try:
+            name = self.resolve_name(ean)
+            status = STATUS_KNOWN if name else STATUS_UNKNOWN
+        except Exception as e:
+            logger.error("Error resolving EAN '%s': %s", ean, e)
+            name, status = None, STATUS_ERROR
+        self.results.put((ean, name, status))
+
+    def drain_results(self):
+        """Applies finished lookups; returns the list of EANs whose line changed. Call on the Tk thread."""
+        changed = []
+        while True:
+            try:
+                ean, name, status = self.results.get_nowait()
+            except queue.Empty:
+                return changed
+            item = self.items.get(ean)
+            if item is not None:
+                item["name"], item["status"] = name, status
+                changed.append(ean)
+
+    def total_units(self):
+        return sum(item["quantity"] for item in self.items.values())
+
+    def clear(self):
+        self.items.clear()
+        self.rejected = 0
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
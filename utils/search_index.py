@@ -0,0 +1,202 @@
+import heapq
+import unicodedata
+from itertools import islice
+
+# -------------------------------------------------------------------------
+#                     TYPE-AHEAD SEARCH INDEX
+# -------------------------------------------------------------------------
+# Prefix trie over the words of every entry, plus a trigram index for
+# typo-tolerant (fuzzy) matches. Entries are added and removed one at a
+# time, so the index follows the catalogue without being rebuilt.
+NGRAM = 3
+# Trigrams shared by more entries than this say little about a match and are skipped
+MAX_NGRAM_POSTINGS = 5000
+# Ranked results cached per trie node, enough for one picker page
+BEST_CACHE_SIZE = 50
+
+
+def normalize(text):
+    """Lower-case and strip Polish diacritics ('Śrubki' -> 'srubki', 'Ł' -> 'l')."""
+    text = str(text).lower().replace("ł", "l")
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def _tokens(text):
+    cleaned = "".join(c if c.isalnum() else " " for c in normalize(text))
+    return [token for token in cleaned.split() if token]
+
+
+def _ngrams(token):
+    padded = f" {token} "
+    return {padded[i:i + NGRAM] for i in range(len(padded) - NGRAM + 1)}
+
+
+class _TrieNode:
+    __slots__ = ("children", "keys", "best")
+    # The root's keys are all entries, so its ranked cache serves the empty query
+
+    def __init__(self):
+        self.children = {}
+        self.keys = set()   # keys having a word that starts with this prefix
+        self.best = None    # cached best-ranked keys, None = not computed / invalidated
+
+
+class SearchIndex:
+    """
+    Maps display keys (part names, product names, EANs, ...) to search text.
+    `search(query, k)` returns up to k keys: prefix matches on every query
+    word first, then fuzzy trigram matches.
+    """
+
+    def __init__(self, max_prefix_length=12):
+        # Longer prefixes are checked against the entry text instead of the trie
+        self.max_prefix_length = max_prefix_length
+        self.root = _TrieNode()
+        self.ngrams = {}     # trigram -> set of keys
+        self.entries = {}    # key -> normalized search text
+        self.ranks = {}      # key -> (text length, key), the result order
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def add(self, key, *extra_texts):
+        """Indexes `key` under its own text and any extra text (size, EAN, ...)."""
+        if key in self.entries:
+            self.remove(key)
+        text = " ".join(normalize(t) for t in (key,) + extra_texts if t)
+        self.entries[key] = text
+        rank = self.ranks[key] = (len(text), key)
+        self.root.keys.add(key)
+        if self.root.best is not None:
+            self._offer(self.root, key, rank)
+        for token in set(_tokens(text)):
+            node = self.root
+            for char in token[:self.max_prefix_length]:
+                node = node.children.setdefault(char, _TrieNode())
+                if key not in node.keys:
+                    node.keys.add(key)
+                    if node.best is not None:
+                        self._offer(node, key, rank)
+            for gram in _ngrams(token):
+                self.ngrams.setdefault(gram, set()).add(key)
+
+    def remove(self, key):
+        text = self.entries.pop(key, None)
+        if text is None:
+            return
+        self.ranks.pop(key, None)
+        self.root.keys.discard(key)
+        if self.root.best is not None and key in self.root.best:
+            self.root.best = None
+        for token in set(_tokens(text)):
+            path = [self.root]
+            for char in token[:self.max_prefix_length]:
+                node = path[-1].children.get(char)
+                if node is None:
+                    break
+                node.keys.discard(key)
+                if node.best is not None and key in node.best:
+                    node.best = None
+                path.append(node)
+            # Drop trie branches that no longer lead anywhere
+            for depth in range(len(path) - 1, 0, -1):
+                if path[depth].keys or path[depth].children:
+                    break
+                del path[depth - 1].children[token[depth - 1]]
+            for gram in _ngrams(token):
+                keys = self.ngrams.get(gram)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self.ngrams[gram]
+
+    def replace_all(self, items):
+        """Re-indexes from scratch; `items` is an iterable of (key, extra_texts)."""
+        self.root = _TrieNode()
+        self.ngrams = {}
+        self.entries = {}
+        self.ranks = {}
+        for key, extra_texts in items:
+            self.add(key, *extra_texts)
+
+    def _offer(self, node, key, rank):
+        best = node.best
+        if len(best) < BEST_CACHE_SIZE or rank < self.ranks[best[-1]]:
+            best.append(key)
+            best.sort(key=self.ranks.__getitem__)
+            del best[BEST_CACHE_SIZE:]
+
+    def _node(self, token):
+        node = self.root
+        for char in token[:self.max_prefix_length]:
+            node = node.children.get(char)
+            if node is None:
+                return None
+        return node
+
+    def _best(self, node):
+        if node.best is None:
+            node.best = heapq.nsmallest(BEST_CACHE_SIZE, node.keys, key=self.ranks.__getitem__)
+        return node.best
+
+    def search(self, query, k=20):
+        tokens = _tokens(query)
+        if not tokens:
+            # Empty query (picker opened or cleared): the root's ranked cache
+            if k <= BEST_CACHE_SIZE:
+                return self._best(self.root)[:k]
+            return heapq.nsmallest(k, self.entries, key=self.ranks.__getitem__)
+
+        long_tokens = [t for t in tokens if len(t) > self.max_prefix_length]
+        nodes = [self._node(t) for t in tokens]
+        if any(node is None for node in nodes):
+            return self._fuzzy(tokens, [], k)
+
+        # Walk the rarest word's ranked keys and check the other words on each
+        # candidate (set lookups), so nothing is proportional to the index size
+        nodes.sort(key=lambda node: len(node.keys))
+        rarest, others = nodes[0], nodes[1:]
+
+        def matches(key):
+            if not all(key in node.keys for node in others):
+                return False
+            words = self.entries[key].split() if long_tokens else ()
+            return all(any(w.startswith(t) for w in words) for t in long_tokens)
+
+        best = self._best(rarest)
+        results = list(islice((key for key in best if matches(key)), k))
+        if len(results) < k and len(best) < len(rarest.keys):
+            # Selective combination (few of the best candidates match): intersect, the hits are few
+            hits = rarest.keys.intersection(*(node.keys for node in others))
+            if long_tokens:
+                hits = [key for key in hits if matches(key)]
+            results = heapq.nsmallest(k, hits, key=self.ranks.__getitem__)
+        return self._fuzzy(tokens, results, k)
+
+    def _fuzzy(self, tokens, results, k):
+        """Fills `results` (prefix matches) up to k with fuzzy trigram matches."""
+        if len(results) >= k:
+            return results
+        prefix_hits = set(results)
+
+        # Fuzzy fill-up: rank by shared trigrams
+        scores = {}
+        for token in tokens:
+            postings_lists = sorted((self.ngrams.get(gram, ()) for gram in _ngrams(token)), key=len)
+            # Always use the rarest trigram, skip the ones shared by too many entries
+            usable = postings_lists[:1] + [p for p in postings_lists[1:] if len(p) <= MAX_NGRAM_POSTINGS]
+            for postings in usable:
+                for key in postings:
+                    if key not in prefix_hits:
+                        scores[key] = scores.get(key, 0) + 1
+        minimum = max(1, sum(len(_ngrams(t)) for t in tokens) // 3)
+        fuzzy = heapq.nsmallest(
+            k - len(results),
+            (key for key, score in scores.items() if score >= minimum),
+            key=lambda key: (-scores[key], len(self.entries[key]), key),
+        )
+        return results + fuzzy
@@ -1,4 +1,6 @@
 import os
+import json
+import logging
 import shutil
 import zipfile
 import requests
@@ -6,18 +8,51 @@ from tkinter import messagebox
 from packaging.version import parse  # pip install packaging
 import threading
 
+from config.config import VERSION
+from utils.helpers import VERSIONS_DIR, install_root as _install_root
+
+logger = logging.getLogger(__name__)
+
 # -------------------------------------------------------------------------
 #                     SETTINGS / EXCLUSIONS
 # -------------------------------------------------------------------------
-# Folders or files to exclude from backup. 
-# You might also exclude ".git", ".venv", etc. if they exist in your repo.
+# Top-level folders or files that are never part of an installed version.
+# Matched against whole path components, so "venv" does not swallow "events".
 EXCLUDED_PATHS = {
-    "backup",         # don't back up the backup folder itself
+    "versions",       # the version store itself
+    "backup",         # legacy backup folder from the copy-based updater
+    "update_temp",    # legacy extraction folder
     "__pycache__",    # skip typical Python cache
     "venv",           # skip local Python environment
+    ".venv",
     ".git",           # skip git repo data
+    ".env",           # credentials stay with the installation, not the version
+    "sync_state.json",        # station-local state, resolved from the install root
+    "sync_state.journal",
+    "station_counters.json",  # (utils.helpers.install_root), never from a version
+    "logs",
+    "render_cache",
+    "prints",
 }
 
+# Every installed release lives in its own folder under VERSIONS_DIR.
+# The active one is named by POINTER_FILE, which is only ever replaced
+# atomically (os.replace), so a crash leaves either the old or the new
+# version active - never a mix of both.
+POINTER_FILE = "current.json"
+MANIFEST_FILE = ".manifest.json"
+
+# The tree the application was originally unpacked into acts as the base
+# version; it is active whenever no pointer exists.
+BASE_VERSION = VERSION
+
+
+def _is_excluded(relative_path):
+    """Return True if any component of `relative_path` is excluded."""
+    parts = os.path.normpath(relative_path).split(os.sep)
+    return any(part in EXCLUDED_PATHS for part in parts)
+
+
 # -------------------------------------------------------------------------
 #                 CHECK FOR UPDATES (GITHUB RELEASES)
 # -------------------------------------------------------------------------
@@ -35,14 +70,14 @@ def check_for_updates(current_version):
 
         latest_version = release_info["tag_name"]   # e.g. "1.2.3"
         update_url = release_info["zipball_url"]    # e.g. https://github.com/...zipball/...
-        
+
         # Compare versions (pip install packaging)
         if parse(current_version) < parse(latest_version):
             return True, latest_version, update_url
         else:
             return False, None, None
     except Exception as e:
-        print(f"Error checking for updates: {e}")
+        logger.error("Error checking for updates: %s", e)
         return False, None, None
 
 
@@ -62,76 +97,189 @@ def download_update(update_url, destination="update.zip"):
                     file.write(chunk)
         return destination
     except Exception as e:
-        print(f"Error downloading update: {e}")
+        logger.error("Error downloading update: %s", e)
         return None
 
 
 # -------------------------------------------------------------------------
-#                      INSTALL THE UPDATE
+#                     VERSION POINTER / MANIFESTS
 # -------------------------------------------------------------------------
-def install_update(update_zip_path, extract_dir="update_temp"):
+def _root(install_root):
+    """`install_root`, or the folder the application is installed in (utils.helpers.install_root)."""
+    return _install_root() if install_root is None else install_root
+
+
+def read_pointer(install_root=None):
     """
-    Installs the update by:
-    1) Creating a backup of current files
-    2) Extracting the new files into `extract_dir`
-    3) Moving them into the current directory
-    4) Cleaning up after success
-    Returns True if successful, False otherwise.
+    Returns the pointer dict {"current": <version>, "previous": <version>}.
+    A missing or unreadable pointer means the base tree is active.
     """
+    install_root = _root(install_root)
+    path = os.path.join(install_root, VERSIONS_DIR, POINTER_FILE)
     try:
-        backup_dir = "backup"
-        os.makedirs(backup_dir, exist_ok=True)
-
-        # 1) Backup current files
-        for root, dirs, files in os.walk("."):
-            # Skip excluded paths
-            relative_root = os.path.relpath(root, ".")
-            if any(x in relative_root for x in EXCLUDED_PATHS):
+        with open(path, "r", encoding="utf-8") as f:
+            pointer = json.load(f)
+        if isinstance(pointer, dict):
+            return pointer
+    except (OSError, ValueError):
+        pass
+    return {"current": BASE_VERSION, "previous": None}
+
+
+def _write_pointer(install_root, current, previous):
+    """Atomically replace the version pointer."""
+    versions_dir = os.path.join(install_root, VERSIONS_DIR)
+    os.makedirs(versions_dir, exist_ok=True)
+    tmp_path = os.path.join(versions_dir, POINTER_FILE + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"current": current, "previous": previous}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, os.path.join(versions_dir, POINTER_FILE))
+
+
+def version_dir(version, install_root=None):
+    """Returns the folder holding `version` (the install root for the base version)."""
+    install_root = _root(install_root)
+    if version in (None, BASE_VERSION):
+        return install_root
+    return os.path.join(install_root, VERSIONS_DIR, version)
+
+
+def active_version_dir(install_root=None):
+    """Returns the folder of the currently active version."""
+    install_root = _root(install_root)
+    current = read_pointer(install_root).get("current")
+    path = version_dir(current, install_root)
+    # A pointer to a folder that is gone (e.g. removed by hand) falls back to the base tree
+    return path if os.path.isdir(path) else install_root
+
+
+def _load_manifest(root):
+    """
+    Returns {relative_path: [size, crc32]} for the files of a version.
+    Versions installed by this module carry a manifest; the base tree
+    gets one computed on first use.
+    """
+    manifest_path = os.path.join(root, MANIFEST_FILE)
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        pass
+
+    manifest = {}
+    for dirpath, dirnames, files in os.walk(root):
+        relative_root = os.path.relpath(dirpath, root)
+        # Prune excluded folders so os.walk never descends into them
+        dirnames[:] = [d for d in dirnames if not _is_excluded(os.path.join(relative_root, d))]
+        for file in files:
+            relative_path = os.path.normpath(os.path.join(relative_root, file))
+            if file == MANIFEST_FILE or _is_excluded(relative_path):
                 continue
+            manifest[relative_path] = [
+                os.path.getsize(os.path.join(dirpath, file)),
+                _file_crc32(os.path.join(dirpath, file)),
+            ]
+    return manifest
 
-            for file in files:
-                # Don't back up the update zip or any in excluded folders
-                if file == os.path.basename(update_zip_path):
-                    continue
 
-                source = os.path.join(root, file)
-                # Build the backup destination path
-                dest = os.path.join(backup_dir, os.path.relpath(source, "."))
-                os.makedirs(os.path.dirname(dest), exist_ok=True)
-                shutil.copy2(source, dest)  # copy with metadata
+def _file_crc32(path):
+    crc = 0
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            crc = zipfile.crc32(chunk, crc)
+    return crc & 0xFFFFFFFF
 
-        # 2) Extract update zip
+
+# -------------------------------------------------------------------------
+#                      INSTALL THE UPDATE
+# -------------------------------------------------------------------------
+def install_update(update_zip_path, version=None, install_root=None):
+    """
+    Installs the update as a new side-by-side version:
+    1) Builds versions/.staging-<version> from the zip. Files whose size and
+       CRC match the active version are hard-linked instead of extracted,
+       so only changed files are written.
+    2) Renames the staging folder to versions/<version> (atomic).
+    3) Flips the version pointer to it (atomic).
+    The active version is never touched, so a crash at any point leaves
+    a fully working installation. Returns True if successful, False otherwise.
+    """
+    install_root = _root(install_root)
+    staging_dir = None
+    try:
+        pointer = read_pointer(install_root)
+        active_version = pointer.get("current")
+        active_dir = active_version_dir(install_root)
+        active_manifest = _load_manifest(active_dir)
+
+        if version is None:
+            version = os.path.splitext(os.path.basename(update_zip_path))[0]
+        target_dir = version_dir(version, install_root)
+        if version == active_version:
+            logger.info("Version '%s' is already active.", version)
+            return True
+
+        versions_dir = os.path.join(install_root, VERSIONS_DIR)
+        staging_dir = os.path.join(versions_dir, f".staging-{version}")
+        if os.path.isdir(staging_dir):
+            shutil.rmtree(staging_dir)  # leftover from an interrupted install
+        os.makedirs(staging_dir)
+
+        manifest = {}
+        linked = extracted = 0
         with zipfile.ZipFile(update_zip_path, "r") as zip_ref:
-            zip_ref.extractall(extract_dir)
-
-        # 3) Move extracted files into our current directory
-        # The GitHub zip typically contains a top-level folder like 
-        # "filiprzeszowski-EMAG-<hash>/...", so we find that subfolder:
-        subdirs = os.listdir(extract_dir)
-        # If there's exactly one subfolder, we can assume it's the update
-        # Otherwise, just move everything inside `extract_dir`.
-        if len(subdirs) == 1 and os.path.isdir(os.path.join(extract_dir, subdirs[0])):
-            update_root = os.path.join(extract_dir, subdirs[0])
-        else:
-            update_root = extract_dir
+            entries = [info for info in zip_ref.infolist() if not info.is_dir()]
+
+            # The GitHub zip typically contains a top-level folder like
+            # "filiprzeszowski-EMAG-<hash>/...", which we strip.
+            top_levels = {info.filename.split("/", 1)[0] for info in entries}
+            prefix = ""
+            if len(top_levels) == 1 and all("/" in info.filename for info in entries):
+                prefix = next(iter(top_levels)) + "/"
+
+            for info in entries:
+                relative_path = os.path.normpath(info.filename[len(prefix):])
+                if relative_path.startswith("..") or os.path.isabs(relative_path):
+                    continue  # never write outside the staging folder
+                if _is_excluded(relative_path):
+                    continue
+
+                destination = os.path.join(staging_dir, relative_path)
+                os.makedirs(os.path.dirname(destination), exist_ok=True)
+                entry = [info.file_size, info.CRC]
+
+                if active_manifest.get(relative_path) == entry:
+                    try:
+                        os.link(os.path.join(active_dir, relative_path), destination)
+                        linked += 1
+                        manifest[relative_path] = entry
+                        continue
+                    except OSError:
+                        pass  # e.g. FAT volume or source removed; fall back to extracting
 
-        for root, dirs, files in os.walk(update_root):
-            relative_root = os.path.relpath(root, update_root)
-            dest_root = os.path.join(".", relative_root)
-            os.makedirs(dest_root, exist_ok=True)
+                with zip_ref.open(info) as source, open(destination, "wb") as target:
+                    shutil.copyfileobj(source, target)
+                extracted += 1
+                manifest[relative_path] = entry
 
-            for file in files:
-                source_path = os.path.join(root, file)
-                destination_path = os.path.join(dest_root, file)
-                os.makedirs(os.path.dirname(destination_path), exist_ok=True)
-                shutil.move(source_path, destination_path)
+        with open(os.path.join(staging_dir, MANIFEST_FILE), "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
 
-        # 4) Cleanup
+        if os.path.isdir(target_dir):
+            shutil.rmtree(target_dir)  # an older, inactive install of the same tag
+        os.rename(staging_dir, target_dir)
+        staging_dir = None
+
+        _write_pointer(install_root, version, active_version)
         os.remove(update_zip_path)
-        shutil.rmtree(extract_dir)
+        logger.info("Installed version '%s': %d files written, %d hard-linked.", version, extracted, linked)
         return True
     except Exception as e:
-        print(f"Error installing update: {e}")
+        logger.exception("Error installing update: %s", e)
+        if staging_dir and os.path.isdir(staging_dir):
+            shutil.rmtree(staging_dir, ignore_errors=True)
         return False
 
 
@@ -144,8 +292,8 @@ def perform_update(current_version):
     1) Checks if there's a newer GitHub release
     2) If yes, asks user to confirm
     3) Downloads the update zip
-    4) Installs it (with backup)
-    5) Notifies user or reverts on failure
+    4) Installs it as a new version and switches to it
+    5) Notifies user or switches back on failure
     """
     is_update_available, latest_version, update_url = check_for_updates(current_version)
     if not is_update_available:
@@ -165,46 +313,70 @@ def perform_update(current_version):
             messagebox.showerror("Aktualizacja", "Nie udało się pobrać aktualizacji.")
             return
 
-        success = install_update(update_zip)
+        success = install_update(update_zip, version=latest_version)
         if success:
             messagebox.showinfo(
                 "Aktualizacja",
                 "Aktualizacja została pomyślnie zainstalowana. Uruchom ponownie aplikację."
             )
         else:
+            # The pointer was never flipped, so the previous version is still active.
             messagebox.showerror(
                 "Aktualizacja",
-                "Wystąpił problem podczas instalacji aktualizacji. Przywracanie poprzedniej wersji..."
+                "Wystąpił problem podczas instalacji aktualizacji. Poprzednia wersja pozostaje aktywna."
             )
-            restore_backup()
 
     # Perform the download/install in a separate thread so the UI doesn't freeze.
     threading.Thread(target=update_thread, daemon=True).start()
 
 
 # -------------------------------------------------------------------------
-#                     RESTORE BACKUP ON FAILURE
+#                     ROLLBACK TO PREVIOUS VERSION
 # -------------------------------------------------------------------------
-def restore_backup(backup_dir="backup"):
+def rollback_update(install_root=None):
     """
-    Restores files from `backup_dir` into the current directory if the update 
-    installation fails. Then removes `backup_dir`.
+    Switches back to the previously active version with a single atomic
+    pointer flip. The rolled-back version stays on disk, so rolling
+    forward again is just as cheap. Returns True if a switch happened.
     """
+    install_root = _root(install_root)
     try:
-        for root, dirs, files in os.walk(backup_dir):
-            relative_root = os.path.relpath(root, backup_dir)
-            # Skip if path is in EXCLUDED_PATHS, although typically 
-            # the backup wouldn't contain them anyway
-            if any(x in relative_root for x in EXCLUDED_PATHS):
-                continue
-
-            for file in files:
-                source_path = os.path.join(root, file)
-                destination_path = os.path.join(".", relative_root, file)
-                os.makedirs(os.path.dirname(destination_path), exist_ok=True)
-                shutil.copy2(source_path, destination_path)
+        pointer = read_pointer(install_root)
+        previous = pointer.get("previous")
+        if not previous:
+            logger.warning("No previous version to roll back to.")
+            return False
+        if not os.path.isdir(version_dir(previous, install_root)):
+            logger.warning("Previous version '%s' is no longer installed.", previous)
+            return False
 
-        shutil.rmtree(backup_dir)
-        print("Backup restored successfully.")
+        _write_pointer(install_root, previous, pointer.get("current"))
+        logger.info("Rolled back to version '%s'.", previous)
+        return True
     except Exception as e:
-        print(f"Error restoring backup: {e}")
+        logger.exception("Error rolling back update: %s", e)
+        return False
+
+
+def restore_backup(backup_dir="backup"):
+    """Kept for callers of the copy-based updater; now an atomic rollback."""
+    return rollback_update()
+
+
+def prune_versions(keep=2, install_root=None):
+    """Removes installed versions other than the current, previous and `keep` newest ones."""
+    install_root = _root(install_root)
+    pointer = read_pointer(install_root)
+    protected = {pointer.get("current"), pointer.get("previous")}
+    versions_dir = os.path.join(install_root, VERSIONS_DIR)
+    if not os.path.isdir(versions_dir):
+        return
+
+    installed = [
+        name for name in os.listdir(versions_dir)
+        if os.path.isdir(os.path.join(versions_dir, name)) and not name.startswith(".")
+    ]
+    installed.sort(key=lambda name: os.path.getmtime(os.path.join(versions_dir, name)), reverse=True)
+    for name in installed[keep:]:
+        if name not in protected:
+            shutil.rmtree(os.path.join(versions_dir, name), ignore_errors=True)
@@ -0,0 +1,177 @@
+import os
+import time
+import random
+import logging
+from collections import Counter, defaultdict
+
+import firebase_admin
+
+from database.catalogue import format_label
+from database.db import Database
+from server.rtdb_emulator import RTDBEmulator, InjectionConfig, start_emulator
+
+logger = logging.getLogger(__name__)
+
+# -------------------------------------------------------------------------
+#              ROUND-TRIP BENCHMARK UNDER SIMULATED NETWORKS
+# -------------------------------------------------------------------------
+# Runs the data layer's write paths through the real firebase_admin client
+# against the local Realtime Database emulator, once per network profile,
+# and reports per-operation latency, round trips per operation and stock
+# drift: the emulator's tree is read directly around every operation, so a
+# write that was applied twice (lost acknowledgement + client retry) or not
+# at all shows up as a difference from the change the operation intended.
+DEFAULT_PROFILES = {
+    "lan": {"latency_ms": 2, "jitter_ms": 1},
+    "wan": {"latency_ms": 80, "jitter_ms": 20},
+    "mobile": {"latency_ms": 250, "jitter_ms": 80, "error_rate": 0.02, "drop_rate": 0.01},
+}
+NAMESPACE = "emag-bench"
+INITIAL_STOCK = 100000
+REQUEST_KINDS = ("GET", "PUT", "PATCH", "DELETE")
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+class _Bench:
+    def __init__(self, emulator, db, parts, delivery_parts, rng):
+        self.emulator = emulator
+        self.db = db
+        self.parts = parts
+        self.delivery_parts = delivery_parts
+        self.rng = rng
+        self.sequence = 0
+
+    def _stock(self):
+        return self.emulator.snapshot(NAMESPACE).get("inventory", {})
+
+    def _requests(self):
+        return sum(self.emulator.stats[kind] for kind in REQUEST_KINDS)
+
+    def measure(self, kind, operation, expected):
+        """Runs `operation`; returns (seconds, round trips, outcome, units of stock drift)."""
+        before, requests = self._stock(), self._requests()
+        started = time.perf_counter()
+        try:
+            operation()
+            outcome = "done"
+        except Exception as e:
+            logger.debug("%s failed: %s", kind, e)
+            outcome = "errors"
+        elapsed = time.perf_counter() - started
+        after = self._stock()
+        drift = 0
+        if outcome == "done":
+            for key in set(before) | set(after) | set(expected):
+                change = (after.get(key) or 0) - (before.get(key) or 0)
+                drift += abs(change - expected.get(key, 0))
+        return elapsed, self._requests() - requests, outcome, drift
+
+    # ---- scenarios (what the GUI actions do to the database) -----------
+    def close_delivery(self):
+        """Scanner delivery of `delivery_parts` different parts: one multi-path increment."""
+        deltas = {part: self.rng.randint(1, 20) for part in self.rng.sample(self.parts, self.delivery_parts)}
+        expected = {self.db.part_key(part, create=False): delta for part, delta in deltas.items()}
+        return self.measure("close_delivery", lambda: self.db.apply_part_deltas(deltas), expected)
+
+    def delete_product(self):
+        """Delete a built product: read it, return its parts and remove it in one update."""
+        self.sequence += 1
+        name = f"WAN-{self.sequence:05d}"
+        bom = {part: self.rng.randint(1, 3) for part in self.rng.sample(self.parts, 3)}
+        quantity = self.rng.randint(1, 5)
+        self.db.add_product_to_firebase({"name": name, "quantity": quantity, "parts": bom})
+        expected = {self.db.part_key(part, create=False): per_unit * quantity for part, per_unit in bom.items()}
+        return self.measure("delete_product", lambda: self.db.delete_product(name), expected)
+
+    def part_edit(self):
+        """Manual correction in the edit-part form: read, then write the new total."""
+        part = self.rng.choice(self.parts)
+        expected = {self.db.part_key(part, create=False): 1}
+        return self.measure("part_edit", lambda: self.db.update_part_quantity(part, 1), expected)
+
+
+def _connect(emulator, host, port):
+    """Points firebase_admin at the emulator and seeds a catalogue and stock (without simulated delays)."""
+    if firebase_admin._apps:
+        raise RuntimeError("Firebase is already initialized in this process; run the benchmark on its own.")
+    os.environ["FIREBASE_DATABASE_EMULATOR_HOST"] = f"{host}:{port}"
+    os.environ["FIREBASE_DATABASE_URL"] = f"https://{NAMESPACE}.firebaseio.com"
+    db = Database()
+    parts = [
+        format_label(category, size)
+        for category, sizes in db.catalogue.families().items()
+        for size in sizes
+    ]
+    db.apply_part_deltas({part: INITIAL_STOCK for part in parts})
+    return db, parts
+
+
+def run_benchmark(profiles=None, repeats=20, delivery_parts=20, seed=0, host="127.0.0.1"):
+    """
+    One pass of every scenario per network profile ({name: injection
+    settings}). Returns [{"profile", "conditions", "operations": {kind:
+    {"count", "p50_ms", "p95_ms", "max_ms", "round_trips", "errors",
+    "drift_units"}}, "emulator": counters}].
+    """
+    profiles = profiles or DEFAULT_PROFILES
+    emulator = RTDBEmulator(InjectionConfig(seed=seed))
+    server, _ = start_emulator(host, 0, emulator)
+    try:
+        db, parts = _connect(emulator, host, server.server_address[1])
+        delivery_parts = min(delivery_parts, len(parts))
+        reports = []
+        for name, conditions in profiles.items():
+            emulator.config.update({"latency_ms": 0, "jitter_ms": 0, "error_rate": 0, "drop_rate": 0,
+                                    **conditions, "seed": seed})
+            emulator.reset_stats()
+            bench = _Bench(emulator, db, parts, delivery_parts, random.Random(seed))
+            samples = defaultdict(list)
+            for _ in range(repeats):
+                for scenario in ("close_delivery", "delete_product", "part_edit"):
+                    samples[scenario].append(getattr(bench, scenario)())
+            operations = {}
+            for kind, rows in samples.items():
+                times = sorted(row[0] for row in rows)
+                outcomes = Counter(row[2] for row in rows)
+                operations[kind] = {
+                    "count": len(rows),
+                    "p50_ms": _percentile(times, 0.50) * 1000,
+                    "p95_ms": _percentile(times, 0.95) * 1000,
+                    "max_ms": times[-1] * 1000,
+                    "round_trips": sum(row[1] for row in rows) / len(rows),
+                    "errors": outcomes["errors"],
+                    "drift_units": sum(row[3] for row in rows),
+                }
+            reports.append({
+                "profile": name,
+                "conditions": emulator.config.as_dict(),
+                "operations": operations,
+                "emulator": dict(emulator.stats),
+            })
+            logger.info("WAN benchmark profile '%s' done.", name)
+        return reports
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def format_report(report):
+    conditions = report["conditions"]
+    lines = [
+        f"Profil: {report['profile']}  opóźnienie: {conditions['latency_ms']:.0f} ms "
+        f"± {conditions['jitter_ms']:.0f} ms  błędy: {conditions['error_rate']:.1%}  "
+        f"utracone potwierdzenia: {conditions['drop_rate']:.1%}",
+    ]
+    for kind, stats in report["operations"].items():
+        lines.append(
+            f"  {kind:<15} n={stats['count']:<4} p50={stats['p50_ms']:.1f} ms  p95={stats['p95_ms']:.1f} ms  "
+            f"max={stats['max_ms']:.1f} ms  żądania/op={stats['round_trips']:.1f}  "
+            f"błędy: {stats['errors']}  rozbieżność stanów: {stats['drift_units']} szt."
+        )
+    lines.append("  emulator: " + ", ".join(f"{k}={v}" for k, v in sorted(report["emulator"].items())))
+    return "\n".join(lines)